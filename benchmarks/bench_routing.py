@@ -0,0 +1,54 @@
+# benchmark of the routing of the days of a trip: distance per day of the
+# greedy chain of navigo.itinerary (nearest POI, nearest restaurant, nearest
+# hosting) against navigo.planner.routing.plan_day on random days:
+#   python -m benchmarks.bench_routing [nb_days] [max_pois_by_day]
+
+import random
+import sys
+import time
+
+from navigo.planner.models import POI, Restaurant, Hosting
+from navigo.planner.routing import day_slots_after, distance_matrix, \
+    greedy_day, path_length, plan_day
+
+
+def random_point(point_class, i, latitude, longitude, spread):
+    return point_class(longitude=longitude + random.gauss(0, spread),
+                       latitude=latitude + random.gauss(0, spread),
+                       city="Bordeaux", city_code=33000, uuid=str(i))
+
+
+def main(nb_days: int = 200, max_pois_by_day: int = 8):
+    random.seed(0)
+    greedy_km, optimised_km, greedy_s, optimised_s = 0, 0, 0, 0
+    for day in range(nb_days):
+        nb_pois = random.randint(1, max_pois_by_day)
+        points = [random_point(POI, i, 44.84, -0.57, 0.01)
+                  for i in range(nb_pois)] + \
+            [random_point(Restaurant, i, 44.84, -0.57, 0.015)
+             for i in range(20)] + \
+            [random_point(Hosting, i, 44.84, -0.57, 0.02) for i in range(10)]
+        dist = distance_matrix(points)
+        pois = list(range(1, nb_pois))
+        candidates = {'restaurant': list(range(nb_pois, nb_pois + 20)),
+                      'hosting': list(range(nb_pois + 20, len(points)))}
+
+        start = time.process_time()
+        greedy_km += path_length(
+            greedy_day(0, pois, candidates, dist), dist)
+        greedy_s += time.process_time() - start
+        start = time.process_time()
+        optimised_km += plan_day(0, day_slots_after(0, pois, candidates),
+                                 pois, candidates, dist)[1]
+        optimised_s += time.process_time() - start
+
+    print(f"{nb_days} days of 1 to {max_pois_by_day} POIs")
+    print(f"greedy chain: {greedy_km / nb_days:.3f} km/day, "
+          f"{greedy_s / nb_days * 1000:.3f} ms/day")
+    print(f"plan_day:     {optimised_km / nb_days:.3f} km/day, "
+          f"{optimised_s / nb_days * 1000:.3f} ms/day")
+    print(f"distance saved: {(1 - optimised_km / greedy_km) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,91 @@
+# benchmark of the /data/* pages: CPU time per request of the previous path
+# (all the points of the zone read, copied with dataclasses.asdict, sliced,
+# validated against PagedResponseSchema and encoded by jsonable_encoder and
+# json) against get_zone_page, which counts the points of the zone and only
+# reads the page, encoded by ORJSONResponse from the dataclasses.
+# the points are read from a snapshot written in a temporary directory, no
+# database is needed:
+#   python -m benchmarks.bench_serialization [page_size] [nb_requests]
+
+import dataclasses
+import random
+import sys
+import tempfile
+import time
+import uuid
+from unittest.mock import patch
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from navigo.app.main import get_zone_page
+from navigo.app.paginate import PageParams, PagedResponseSchema
+from navigo.planner.models import POI
+from navigo.snapshot import SnapshotStore, publish, write_department
+
+ZONE = [33000]
+
+
+def make_pois(nb: int) -> list[POI]:
+    return [
+        POI(longitude=random.uniform(-1, 0), latitude=random.uniform(44, 45),
+            city="Bordeaux", city_code=33000, name=f"POI {i}",
+            uuid=str(uuid.uuid4()),
+            type_list=["PlaceOfInterest", "CulturalSite", "PointOfInterest"],
+            theme_list=["InTown"])
+        for i in range(nb)
+    ]
+
+
+def make_store(snapshot_dir, nb_pois: int) -> SnapshotStore:
+    store = SnapshotStore(snapshot_dir, "bench")
+    write_department(store.department_path("33"), "bench", "33",
+                     {'poi': make_pois(nb_pois)})
+    publish(snapshot_dir, "bench")
+    return SnapshotStore(snapshot_dir)
+
+
+def previous_response(store, page_params) -> bytes:
+    res = [dataclasses.asdict(p) for p in store.get_points('poi', ZONE)]
+    first_el = (page_params.page - 1) * page_params.size
+    page = PagedResponseSchema[POI](
+        total=len(res), page=page_params.page, size=page_params.size,
+        results=res[first_el:first_el + page_params.size])
+    # what FastAPI did with the response_model of the endpoint
+    page = PagedResponseSchema[POI].model_validate(page.model_dump())
+    return JSONResponse(jsonable_encoder(page)).body
+
+
+def current_response(store, page_params) -> bytes:
+    return get_zone_page('poi', "33000", "10", 1, page_params, "POI").body
+
+
+def cpu_time_per_request(func, store, page_params, nb_requests) -> float:
+    start = time.process_time()
+    for _ in range(nb_requests):
+        func(store, page_params)
+    return (time.process_time() - start) / nb_requests
+
+
+def main(page_size: int = 100, nb_requests: int = 200, nb_pois: int = 500):
+    page_params = PageParams(page=1, size=page_size)
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        store = make_store(snapshot_dir, nb_pois)
+        with patch("navigo.db.get_snapshot_store", return_value=store), \
+                patch("navigo.db.get_zone_filter", return_value=ZONE):
+            previous = cpu_time_per_request(previous_response, store,
+                                            page_params, nb_requests)
+            current = cpu_time_per_request(current_response, store,
+                                           page_params, nb_requests)
+    print(f"pages of {page_size} POI among {nb_pois}, "
+          f"{nb_requests} requests")
+    print(f"whole zone + asdict + pydantic + json: "
+          f"{previous * 1000:.3f} ms/request")
+    print(f"get_zone_page + orjson:                "
+          f"{current * 1000:.3f} ms/request")
+    print(f"CPU saved: {(previous - current) * 1000:.3f} ms/request "
+          f"({previous / current:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
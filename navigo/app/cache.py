@@ -0,0 +1,82 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str
+    etag: str
+    created_at: float
+
+
+def make_etag(body: bytes) -> str:
+    """weak ETag of a response content: the compression middleware runs
+    after the cache, so the same ETag is sent with the compressed and the
+    uncompressed bodies"""
+    return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """whether an If-None-Match header matches the ETag (weak comparison,
+    as required for If-None-Match)"""
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class ResponseCache:
+    """
+    LRU cache of response bodies bounded by their total size, entries
+    older than ttl seconds (0 to never expire) are ignored.
+
+    Keys must include the version of the data the response is built from,
+    so that responses of a previous version are never served.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl > 0 and time.time() - entry.created_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body: bytes, media_type: str) -> CachedResponse:
+        entry = CachedResponse(body=body, media_type=media_type,
+                               etag=make_etag(body), created_at=time.time())
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        self.size -= len(self._entries.pop(key).body)
@@ -1,37 +1,51 @@
-import dataclasses
 import json
 import logging
-from datetime import datetime
+import secrets
+from datetime import date, datetime
+from enum import Enum
+from functools import partial
 from pathlib import Path
 from typing import Annotated
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, \
+    Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from a2wsgi import WSGIMiddleware
-from pydantic import BaseModel
-from starlette.routing import Mount
-
-from navigo.app.paginate import PageParams, PagedResponseSchema, paginate
-
-from navigo.db import get_restaurants_by_zone, get_poi_by_zone, \
-    get_hosting_by_zone, get_trails_by_zone, get_wc_by_zone, get_poi_types, \
-    get_poi_themes, get_restaurants_types, get_hostings_types, \
-    get_poi_categories_of_theme, get_poi_categories_of_type
+from pydantic import BaseModel, field_validator
+
+from navigo.app.cache import ResponseCache, etag_matches
+from navigo.app.plans import DashDispatcher, PlanStore, itinerary_to_days
+from navigo.app.paginate import PageParams, PagedResponseSchema, \
+    CursorPageParams, CursorPagedResponseSchema
+from navigo.app.serialization import ORJSONResponse, add_compression, \
+    dumps
+
+from navigo.communes import get_communes_table
+from navigo.db import count_points, get_points_at, get_zone_filter, \
+    get_points_page, iter_points_by_zone, expand_zone_search
 from navigo.external import get_zipcode
-from navigo.map import create_dash_app
 from navigo.planner.models import UserData
-from navigo.planner.planner import plan_trip
-from navigo.settings import DEBUG
+from navigo.planner.planner import plan_trip, plan_trips
+from navigo.planner.routing import parse_day_template
+from navigo.reference import reference_data
+from navigo.settings import DEBUG, MIN_FETCHED_POI_BY_ZONE_PER_DAY, \
+    MIN_FETCHED_RESTAURANT_BY_ZONE_PER_DAY, \
+    MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY, MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY, \
+    MIN_FETCHED_WC_BY_ZONE_PER_DAY, RESPONSE_CACHE_MAX_BYTES, \
+    RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_AGE, COMPRESSION_MINIMUM_SIZE, \
+    PLAN_STORE_SIZE, REFERENCE_REFRESH_TOKEN
+from navigo.snapshot import get_snapshot_store
+from navigo.walking import get_zone_walking_graph
 
 from navigo.planner.models import POI, Restaurant, Hosting, Trail, WC
 
 logger = logging.getLogger(__name__)
 
 
-app = FastAPI(debug=DEBUG)
+app = FastAPI(debug=DEBUG, default_response_class=ORJSONResponse)
 app.mount("/static",
           StaticFiles(directory=str(
               Path(Path(__file__).resolve().parent, 'static'))
@@ -42,24 +56,85 @@ templates = Jinja2Templates(
         Path(Path(__file__).resolve().parent, 'templates'))
 )
 
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+
+
+def is_cacheable(request: Request) -> bool:
+    path = request.url.path
+    return request.method == "GET" and (
+        path == "/" or
+        path.startswith("/data/") and not path.endswith("/export"))
+
+
+def get_data_version(path: str) -> str:
+    """version of the data a response is built from"""
+    if path == "/":
+        return f"reference-{reference_data.get().loaded_at}-{date.today()}"
+    store = get_snapshot_store()
+    return f"snapshot-{store.version}" if store is not None else "live"
+
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    """serve identical GET requests from response_cache, with their ETag,
+    and answer 304 when the client already has the response"""
+    if not is_cacheable(request):
+        return await call_next(request)
+
+    version = get_data_version(request.url.path)
+    key = (version, request.url.path,
+           tuple(sorted(request.query_params.multi_items())))
+    entry = response_cache.get(key)
+    if entry is None:
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        entry = response_cache.put(key, body,
+                                   response.headers.get("content-type"))
+
+    headers = {
+        "ETag": entry.etag,
+        "X-Data-Version": version,
+        # snapshots are immutable, live data may change at any time
+        "Cache-Control": f"public, max-age={RESPONSE_CACHE_MAX_AGE}"
+        if version.startswith("snapshot-") else "no-cache",
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type=entry.media_type, headers=headers)
+
+
+# added last to compress the responses served from the cache too
+add_compression(app, COMPRESSION_MINIMUM_SIZE)
+
+
+@app.on_event("startup")
+def load_reference_data():
+    try:
+        reference_data.get()
+    except Exception as e:
+        # the cache will be loaded on first use
+        logger.error(f"unable to load reference data at startup: {e}")
+
+
+@app.on_event("startup")
+def load_communes_table():
+    # the index of the names is built with the table, not on a request
+    get_communes_table()
+
 
 @app.get("/", response_class=HTMLResponse)
 async def get_home(request: Request):
     today_date = datetime.now().strftime("%Y-%m-%d")
     try:
-        # types = get_poi_types()
-        # themes = get_poi_themes()
-        types_agg = get_poi_categories_of_type()
-        themes_agg = get_poi_categories_of_theme()
-        rest_types = get_restaurants_types()
-        hosting_types = get_hostings_types()
+        ref = reference_data.get()
         logger.info(
             f"""
-            Serving form with categories of types = ({types_agg})
-            Serving form with categories of themes = ({themes_agg})
-            Serving form with rest_types = ({[t['TYPE'] for t in rest_types]})
-            Serving form with hosting_types = (
-                {[t['TYPE'] for t in hosting_types]})""")
+            Serving form with categories of types = ({ref.poi_type_categories})
+            Serving form with categories of themes = ({ref.poi_theme_categories})
+            Serving form with rest_types = ({ref.restaurant_types})
+            Serving form with hosting_types = ({ref.hosting_types})""")
     except Exception as e:
         msg = f"unable to fetch themes and/or types: {str(e)}"
         logger.error(msg)
@@ -68,10 +143,33 @@ async def get_home(request: Request):
         "index.html",
         {"request": request,
          "today_date": today_date,
-         "types": types_agg,
-         "themes": themes_agg,
-         "rest_types": rest_types,
-         "hosting_types": hosting_types})
+         "types": ref.poi_type_categories,
+         "themes": ref.poi_theme_categories,
+         "rest_types": ref.restaurant_types,
+         "hosting_types": ref.hosting_types})
+
+
+@app.post("/data/reference/refresh")
+async def refresh_reference_data(
+        x_refresh_token: Annotated[str | None, Header()] = None):
+    """
+    Reloads the reference data, with REFERENCE_REFRESH_TOKEN in the
+    X-Refresh-Token header. Only the worker serving the request reloads
+    them: with several uvicorn workers, the others reload them after
+    REFERENCE_DATA_TTL seconds.
+    """
+    if not REFERENCE_REFRESH_TOKEN or x_refresh_token is None or \
+            not secrets.compare_digest(x_refresh_token,
+                                       REFERENCE_REFRESH_TOKEN):
+        raise HTTPException(status_code=403,
+                            detail="invalid or missing refresh token")
+    try:
+        ref = reference_data.refresh()
+    except Exception as e:
+        logger.error(f"unable to reload reference data: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    response_cache.clear()
+    return {"loaded_at": ref.loaded_at}
 
 
 # Request body model for the POST endpoint
@@ -89,6 +187,15 @@ class UserTripRequestInput(BaseModel):
     # means_of_transport: str
     sensitivity_to_weather: str
     days_on_hiking: str
+    # slots of each day, eg ["POI", "LUNCH", "POI", "POI", "DINNER", "HOSTING"]
+    day_template: list[str] | None = None
+
+    @field_validator('day_template')
+    @classmethod
+    def check_day_template(cls, day_template):
+        if day_template is None:
+            return None
+        return list(parse_day_template(day_template))
 
     def to_user_data(self) -> UserData:
         # check if trip zone a zip code, else translate it
@@ -97,21 +204,16 @@ class UserTripRequestInput(BaseModel):
         except ValueError:
             _trip_zone = get_zipcode(self.trip_zone)
 
+        favorite_poi_type_list, favorite_poi_theme_list = [], []
         try:
             # transform from a request of a list of categories to a list
             # of types (or themes) it will allowed to stay with a list
             # of poi types and a list of poi themes for the UserData
-            poi_type_list = get_poi_types()
-            # logger.info(f"poi_type_list = {poi_type_list}")
-            poi_theme_list = get_poi_themes()
-            favorite_poi_type_list, favorite_poi_theme_list = [], []
-            for t in poi_type_list:
-                # logger.info(f"t.CATEGORY = {t.CATEGORY}")
-                if t.CATEGORY in self.favorite_category_poi_type_list:
-                    favorite_poi_type_list.append(t.NAME)
-            for t in poi_theme_list:
-                if t.CATEGORY in self.favorite_category_poi_theme_list:
-                    favorite_poi_theme_list.append(t.NAME)
+            ref = reference_data.get()
+            favorite_poi_type_list = ref.expand_poi_type_categories(
+                self.favorite_category_poi_type_list)
+            favorite_poi_theme_list = ref.expand_poi_theme_categories(
+                self.favorite_category_poi_theme_list)
         except Exception as e:
             logger.error(e)
         logger.info(f"favorite_poi_type_list = {favorite_poi_type_list}")
@@ -127,10 +229,30 @@ class UserTripRequestInput(BaseModel):
             favorite_hosting_categories=self.favorite_hosting_categories,
             # means_of_transport=self.means_of_transport,
             sensitivity_to_weather=bool(self.sensitivity_to_weather == 'true'),
-            days_on_hiking=float(self.days_on_hiking)
+            days_on_hiking=float(self.days_on_hiking),
+            day_template=self.day_template
         )
 
 
+plan_store = PlanStore(PLAN_STORE_SIZE)
+app.mount("/dash", WSGIMiddleware(DashDispatcher(plan_store)))
+
+
+def plan_response(itinerary: list, selected_toilets: list,
+                  trip_zone: int) -> dict:
+    """stores a plan and returns its itinerary by day (measured on the
+    walking graph the trip was planned with) and the url of its map"""
+    plan_id = plan_store.add(itinerary, selected_toilets)
+    days = itinerary_to_days(itinerary, get_zone_walking_graph(trip_zone))
+    return {
+        "plan_id": plan_id,
+        "map_url": f"/dash/{plan_id}/",
+        "distance": round(sum(day["distance"] for day in days), 3),
+        "days": days,
+        "toilets": selected_toilets,
+    }
+
+
 # POST endpoint to get recommendations
 @app.post("/recommendations/")
 async def create_trip_recommendations(
@@ -140,36 +262,89 @@ async def create_trip_recommendations(
             user_request_input.model_dump(),
             indent=4)}""")
 
-        geospatial_point_list, selected_toilets = plan_trip(
-            user_request_input.to_user_data())
+        user_data = user_request_input.to_user_data()
+        geospatial_point_list, selected_toilets = plan_trip(user_data)
 
         # logger.info(f"result: {geospatial_point_list}")
 
-        # create and serve Dash app
-        _dash_app = create_dash_app(geospatial_point_list, selected_toilets)
-
-        # delete any /dash mount before updating the dashboard
-        for index, route in enumerate(app.routes):
-            if isinstance(route, Mount) and route.path == "/dash":
-                del app.routes[index]
-                break
-
-        app.mount(
-            "/dash", WSGIMiddleware(
-                _dash_app.server))
-
-        return
+        # the Dash map is created on the first request of its url
+        return ORJSONResponse(plan_response(
+            geospatial_point_list, selected_toilets, user_data.trip_zone))
     except Exception as e:
         logger.error(str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# POST endpoint to plan several trips at once
+@app.post("/recommendations/batch")
+def create_batch_trip_recommendations(
+        user_request_inputs: list[UserTripRequestInput]):
+    logger.info(f"received batch of {len(user_request_inputs)} "
+                f"planning requests")
+    # a trip whose input can't be converted (eg unknown city) gets its
+    # error, the other ones are planned
+    results = [None] * len(user_request_inputs)
+    indexes, user_inputs = [], []
+    for index, user_request_input in enumerate(user_request_inputs):
+        try:
+            user_inputs.append(user_request_input.to_user_data())
+            indexes.append(index)
+        except Exception as e:
+            logger.error(f"trip {index} of the batch: {e}")
+            results[index] = {"trip": index, "error": str(e)}
+
+    for index, user_input, result in zip(indexes, user_inputs,
+                                         plan_trips(user_inputs)):
+        if isinstance(result, Exception):
+            results[index] = {"trip": index, "error": str(result)}
+        else:
+            results[index] = {"trip": index, **plan_response(
+                *result, user_input.trip_zone)}
+    return ORJSONResponse(results)
+
+
 # Technical APIs to fetch DATA
 @app.get("/favicon.ico")
 async def get_favicon():
     return FileResponse("navigo/app/static/img/favicon.ico", 200)
 
 
+def parse_zone(zip_code: str, rayon: str) -> (int, int):
+    try:
+        return int(zip_code), int(rayon)
+    except Exception as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def get_zone_page(kind: str, zip_code: str, rayon: str, min_nb: int,
+                  page_params: PageParams, name: str) -> ORJSONResponse:
+    """
+    Page of the points of a zone, searched in a growing radius until it
+    holds at least min_nb points: the points are counted, then only those
+    of the page are fetched (LIMIT/OFFSET) and hydrated.
+    """
+    _zip_code, _rayon = parse_zone(zip_code, rayon)
+    total, zone_filter = expand_zone_search(
+        _zip_code, _rayon, partial(count_points, kind), min_nb, count=int)
+    if not total:
+        logger.warning(f"no {name} found for zone {_zip_code} "
+                       f"with rayon {_rayon}")
+        raise HTTPException(status_code=404,
+                            detail=f"no {name} found for this zone")
+    first_el = (page_params.page - 1) * page_params.size
+    # return an error if the page is out of range
+    if first_el > total:
+        raise HTTPException(status_code=404, detail="Page out of range")
+    return ORJSONResponse({
+        "total": total,
+        "page": page_params.page,
+        "size": page_params.size,
+        "results": get_points_at(kind, zone_filter, first_el,
+                                 page_params.size),
+    })
+
+
 @app.get("/data/pois", response_model=PagedResponseSchema[POI])
 async def get_pois(
     zip_code: Annotated[str, 'zip code'],
@@ -177,25 +352,8 @@ async def get_pois(
     request: Request,
     page_params: PageParams = Depends()
 ):
-    try:
-        _zip_code = int(zip_code)
-        _rayon = int(rayon)
-    except Exception as e:
-        logger.error(str(e))
-        raise HTTPException(status_code=500, detail=str(e))
-
-    res = get_poi_by_zone(_zip_code, _rayon)[0]
-    if res is None:
-        logger.warning(f"no POI found for zone {_zip_code} \
-                       with rayon {_rayon}")
-        raise HTTPException(status_code=404, detail="no POI found \
-                            for this zone")
-    try:
-        res = [dataclasses.asdict(r) for r in res]
-    except TypeError as e:
-        logger.error(f"unable to convert POI to dict: {res}")
-        raise HTTPException(status_code=500, detail=str(e))
-    return paginate(page_params, res, POI)
+    return get_zone_page('poi', zip_code, rayon,
+                         MIN_FETCHED_POI_BY_ZONE_PER_DAY, page_params, "POI")
 
 
 @app.get("/data/restaurants", response_model=PagedResponseSchema[Restaurant])
@@ -205,26 +363,9 @@ async def get_restaurants(
     request: Request,
     page_params: PageParams = Depends()
 ):
-    try:
-        _zip_code = int(zip_code)
-        _rayon = int(rayon)
-    except Exception as e:
-        logger.error(str(e))
-        raise HTTPException(status_code=500, detail=str(e))
-
-    res = get_restaurants_by_zone(f'({str(_zip_code)})', _rayon)
-    if res is None:
-        logger.warning(f"no Restaurants found for zone {_zip_code} \
-                       with rayon {_rayon}")
-        raise HTTPException(status_code=404, detail="no restaurants found \
-                            for this zone")
-    try:
-        res = [dataclasses.asdict(r) for r in res]
-    except TypeError as e:
-        logger.error(f"unable to convert restaurants to dict: {res}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-    return paginate(page_params, res, Restaurant)
+    return get_zone_page('restaurant', zip_code, rayon,
+                         MIN_FETCHED_RESTAURANT_BY_ZONE_PER_DAY, page_params,
+                         "restaurants")
 
 
 @app.get("/data/hostings", response_model=PagedResponseSchema[Hosting])
@@ -234,26 +375,9 @@ async def get_hosting(
     request: Request,
     page_params: PageParams = Depends()
 ):
-    try:
-        _zip_code = int(zip_code)
-        _rayon = int(rayon)
-    except Exception as e:
-        logger.error(str(e))
-        raise HTTPException(status_code=500, detail=str(e))
-
-    res = get_hosting_by_zone(f'({str(_zip_code)})', _rayon)
-    if res is None:
-        logger.warning(f"no hosting found for zone {_zip_code} \
-                       with rayon {_rayon}")
-        raise HTTPException(status_code=404, detail="no hosting found \
-                            for this zone")
-    try:
-        res = [dataclasses.asdict(r) for r in res]
-    except TypeError as e:
-        logger.error(f"unable to convert hostings to dict: {res}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-    return paginate(page_params, res, Hosting)
+    return get_zone_page('hosting', zip_code, rayon,
+                         MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY, page_params,
+                         "hosting")
 
 
 @app.get("/data/trails", response_model=PagedResponseSchema[Trail])
@@ -263,26 +387,9 @@ async def get_trails(
     request: Request,
     page_params: PageParams = Depends()
 ):
-    try:
-        _zip_code = int(zip_code)
-        _rayon = int(rayon)
-    except Exception as e:
-        logger.error(str(e))
-        raise HTTPException(status_code=500, detail=str(e))
-
-    res = get_trails_by_zone(f'({str(_zip_code)})', _rayon)
-    if res is None:
-        logger.warning(f"no trail found for zone {_zip_code} \
-                       with rayon {_rayon}")
-        raise HTTPException(status_code=404, detail="no trail found \
-                            for this zone")
-    try:
-        res = [dataclasses.asdict(r) for r in res]
-    except TypeError as e:
-        logger.error(f"unable to convert trail to dict: {res}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-    return paginate(page_params, res, Trail)
+    return get_zone_page('trail', zip_code, rayon,
+                         MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY, page_params,
+                         "trail")
 
 
 @app.get("/data/wcs", response_model=PagedResponseSchema[WC])
@@ -292,26 +399,55 @@ async def get_wcs(
     request: Request,
     page_params: PageParams = Depends()
 ):
-    try:
-        _zip_code = int(zip_code)
-        _rayon = int(rayon)
-    except Exception as e:
-        logger.error(str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+    return get_zone_page('wc', zip_code, rayon,
+                         MIN_FETCHED_WC_BY_ZONE_PER_DAY, page_params, "wc")
 
-    res = get_wc_by_zone(f'({str(_zip_code)})', _rayon)
-    if res is None:
-        logger.warning(f"no WC found for zone {_zip_code} \
-                       with rayon {_rayon}")
-        raise HTTPException(status_code=404, detail="no wc found \
-                            for this zone")
-    try:
-        res = [dataclasses.asdict(r) for r in res]
-    except TypeError as e:
-        logger.error(f"unable to convert wc to dict: {res}")
-        raise HTTPException(status_code=500, detail=str(e))
 
-    return paginate(page_params, res, WC)
+class PointKind(str, Enum):
+    pois = 'pois'
+    restaurants = 'restaurants'
+    hostings = 'hostings'
+    trails = 'trails'
+    wcs = 'wcs'
+
+    @property
+    def kind(self) -> str:
+        """kind of point in navigo.db"""
+        return self.value[:-1]
+
+
+@app.get("/data/{kind}/page", response_model=CursorPagedResponseSchema[dict])
+def get_points_by_cursor(
+    kind: PointKind,
+    zip_code: Annotated[str, 'zip code'],
+    rayon: Annotated[str, 'rayon'],
+    page_params: CursorPageParams = Depends()
+):
+    """keyset paginated points of a zone: pass the next value of a page as
+    the after param to get the following page"""
+    _zip_code, _rayon = parse_zone(zip_code, rayon)
+    points, next_cursor = get_points_page(
+        kind.kind, get_zone_filter(_zip_code, _rayon),
+        page_params.size, page_params.after)
+    return ORJSONResponse({
+        "size": page_params.size,
+        "next": next_cursor,
+        "results": points,
+    })
+
+
+@app.get("/data/{kind}/export")
+def export_points(
+    kind: PointKind,
+    zip_code: Annotated[str, 'zip code'],
+    rayon: Annotated[str, 'rayon'],
+):
+    """all points of a zone streamed as newline delimited JSON"""
+    _zip_code, _rayon = parse_zone(zip_code, rayon)
+    zone_filter = get_zone_filter(_zip_code, _rayon)
+    lines = (dumps(p) + b"\n"
+             for p in iter_points_by_zone(kind.kind, zone_filter))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 # todo api du modèle ML ?
 # todo: dependeing on mean of transport => define search zone
@@ -1,6 +1,5 @@
 from typing import Generic, List, TypeVar
 from pydantic import BaseModel, conint
-from fastapi import HTTPException
 
 
 class PageParams(BaseModel):
@@ -21,19 +20,16 @@ class PagedResponseSchema(BaseModel, Generic[T]):
     results: List[T]
 
 
-def paginate(page_params: PageParams,
-             result_list,
-             ResponseSchema: BaseModel) -> PagedResponseSchema[T]:
-    """Paginate the response."""
-    first_el = (page_params.page-1) * page_params.size
-    last_el = (page_params.page) * page_params.size
-    # return an error if the page is out of range
-    if first_el > len(result_list):
-        raise HTTPException(status_code=404, detail="Page out of range")
-
-    return PagedResponseSchema(
-        total=len(result_list),
-        page=page_params.page,
-        size=page_params.size,
-        results=result_list[first_el:last_el],
-    )
+class CursorPageParams(BaseModel):
+    """ Request query params for keyset paginated API. """
+    after: str | None = None
+    size: conint(ge=1, le=100) = 10
+
+
+class CursorPagedResponseSchema(BaseModel, Generic[T]):
+    """Response schema for any keyset paged API, next is the after
+    param of the next page (None on the last page)."""
+
+    size: int
+    next: str | None
+    results: List[T]
@@ -0,0 +1,118 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from navigo.map import create_dash_app
+from navigo.walking import leg_km
+
+logger = logging.getLogger(__name__)
+
+
+def itinerary_to_days(itinerary: list, graph=None) -> list[dict]:
+    """
+    Returns the itinerary as an ordered list of days, each of them with
+    its steps (rank, point and distance in km from the previous step of
+    the itinerary, walked on graph, the walking graph of the trip, when
+    there is one) and its distance in km.
+    """
+    points = sorted((p for p in itinerary if p.day is not None),
+                    key=lambda p: (p.day, p.rank))
+    days = []
+    previous = None
+    for point in points:
+        if previous is not None and \
+                (previous.day, previous.rank) == (point.day, point.rank):
+            continue
+        if not days or days[-1]["day"] != point.day:
+            days.append({"day": point.day, "distance": 0.0, "steps": []})
+        leg_distance = None
+        if previous is not None:
+            leg_distance = round(leg_km(previous, point, graph), 3)
+            days[-1]["distance"] = round(
+                days[-1]["distance"] + leg_distance, 3)
+        days[-1]["steps"].append({"rank": point.rank,
+                                  "leg_distance": leg_distance,
+                                  "point": point})
+        previous = point
+    return days
+
+
+@dataclass
+class Plan:
+    itinerary: list
+    toilets: list
+    dash_app: object = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def get_dash_app(self, requests_pathname_prefix: str):
+        """the Dash map of the plan, created on first use"""
+        with self.lock:
+            if self.dash_app is None:
+                self.dash_app = create_dash_app(
+                    self.itinerary, self.toilets,
+                    requests_pathname_prefix=requests_pathname_prefix)
+        return self.dash_app
+
+
+class PlanStore:
+    """
+    Last max_plans plans, by id, in the memory of the process: the map_url
+    of a plan is only served by the worker which planned it, so the API
+    has to run in a single uvicorn worker (or behind sticky sessions).
+    """
+
+    def __init__(self, max_plans: int):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, itinerary: list, toilets: list) -> str:
+        plan_id = uuid.uuid4().hex
+        with self._lock:
+            self._plans[plan_id] = Plan(itinerary, toilets)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan_id
+
+    def get(self, plan_id: str) -> Plan | None:
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if plan is not None:
+                self._plans.move_to_end(plan_id)
+            return plan
+
+
+class DashDispatcher:
+    """
+    WSGI application serving the Dash map of each plan of a store under
+    /<plan id>/ of its mount point.
+    """
+
+    def __init__(self, store: PlanStore):
+        self.store = store
+
+    def __call__(self, environ, start_response):
+        script_name = environ.get("SCRIPT_NAME", "").rstrip("/")
+        plan_id, slash, rest = environ.get("PATH_INFO", "").lstrip(
+            "/").partition("/")
+
+        plan = self.store.get(plan_id)
+        if plan is None:
+            start_response("404 Not Found",
+                           [("Content-Type", "text/plain")])
+            return [b"plan not found"]
+        if not slash:
+            return redirect(start_response, f"{script_name}/{plan_id}/")
+
+        prefix = f"{script_name}/{plan_id}/"
+        dash_app = plan.get_dash_app(requests_pathname_prefix=prefix)
+        environ = {**environ, "SCRIPT_NAME": prefix.rstrip("/"),
+                   "PATH_INFO": "/" + rest}
+        return dash_app.server(environ, start_response)
+
+
+def redirect(start_response, location: str):
+    start_response("307 Temporary Redirect", [("Location", location)])
+    return [b""]
@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    # optional, brotli compression is used when brotli-asgi is installed
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+def default(obj):
+    """encode the types orjson does not support"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    """orjson encoding, dataclasses and numpy values are encoded
+    directly without any copy to dicts"""
+    return orjson.dumps(content, default=default,
+                        option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson. Returned by an endpoint, its content
+    is neither converted by jsonable_encoder nor validated against the
+    response model: use it for trusted internal objects only.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def add_compression(app, minimum_size: int):
+    """compress responses larger than minimum_size bytes, with brotli
+    when available and accepted by the client, else with gzip"""
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, minimum_size=minimum_size,
+                           gzip_fallback=True)
+    else:
+        app.add_middleware(GZipMiddleware, minimum_size=minimum_size)
@@ -0,0 +1,104 @@
+# offline build of the denormalised snapshot of points (see navigo/snapshot.py)
+#
+# joins MariaDB rows, MongoDB labels and neo4j coordinates of every point
+# of the given departments (all of them by default) into a new version of
+# SNAPSHOT_DIR, then publishes it:
+#   python -m navigo.build_snapshot [department ...]
+
+import logging
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+
+from navigo.db import get_engine, maria_connect, RESTAURANT_COLUMNS, \
+    HOSTING_COLUMNS, WC_COLUMNS
+from navigo.planner.models import db_raw_to_poi, db_raw_to_restaurant, \
+    db_raw_to_hosting, db_raw_to_trail, db_raw_to_wc
+from navigo.planner.models_DB_ORM import Poi, Trail
+from navigo.settings import SNAPSHOT_DIR, MARIADB_POI_TABLE, \
+    MARIADB_TRAIL_TABLE, MARIADB_RESTAURANT_TABLE, MARIADB_HOSTING_TABLE, \
+    MARIADB_WC_TABLE
+from navigo.snapshot import get_department, write_department, publish, \
+    SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+POINT_TABLES = (MARIADB_POI_TABLE, MARIADB_TRAIL_TABLE,
+                MARIADB_RESTAURANT_TABLE, MARIADB_HOSTING_TABLE,
+                MARIADB_WC_TABLE)
+
+
+def postal_code_range(department: str) -> (int, int):
+    """first and last postal codes of a department"""
+    return int(department.ljust(5, '0')), int(department.ljust(5, '9'))
+
+
+def list_departments() -> list[str]:
+    postal_codes = set()
+    with get_engine().begin() as con:
+        for table in POINT_TABLES:
+            postal_codes.update(con.execute(text(
+                f"SELECT DISTINCT POSTAL_CODE FROM {table}")).scalars())
+    return sorted({get_department(p) for p in postal_codes if p})
+
+
+def fetch_department_points(department: str) -> dict:
+    """points of a department by kind, hydrated as the planner needs them"""
+    first, last = postal_code_range(department)
+    params = {"first": first, "last": last}
+
+    session = maria_connect()
+    try:
+        pois = session.query(Poi).options(
+            selectinload(Poi.POI_TYPES), selectinload(Poi.POI_THEMES)
+        ).filter(Poi.POSTAL_CODE.between(first, last)).all()
+        trails = session.query(Trail).filter(
+            Trail.POSTAL_CODE.between(first, last)).all()
+        points = {
+            'poi': [db_raw_to_poi(x) for x in pois],
+            'trail': [db_raw_to_trail(x) for x in trails],
+        }
+    finally:
+        session.close()
+
+    with get_engine().begin() as con:
+        for kind, columns, table, converter in (
+                ('restaurant', RESTAURANT_COLUMNS, MARIADB_RESTAURANT_TABLE,
+                 db_raw_to_restaurant),
+                ('hosting', HOSTING_COLUMNS, MARIADB_HOSTING_TABLE,
+                 db_raw_to_hosting),
+                ('wc', WC_COLUMNS, MARIADB_WC_TABLE, db_raw_to_wc)):
+            rows = con.execute(text(
+                f"""
+                SELECT {columns} FROM {table}
+                WHERE POSTAL_CODE BETWEEN :first AND :last ORDER BY UUID
+                """
+            ), params).mappings().all()
+            points[kind] = [converter(x) for x in rows]
+    return points
+
+
+def build_snapshot(departments: list = None, snapshot_dir=SNAPSHOT_DIR,
+                   version: str = None) -> SnapshotStore:
+    """build and publish a new version of the snapshot"""
+    if not snapshot_dir:
+        raise ValueError("SNAPSHOT_DIR is not set")
+    version = version or time.strftime('%Y%m%d%H%M%S')
+    departments = departments or list_departments()
+
+    store = SnapshotStore(snapshot_dir, version)
+    for department in departments:
+        points = fetch_department_points(department)
+        write_department(store.department_path(department), version,
+                         department, points)
+        logger.info(f"department {department}: " + ", ".join(
+            f"{len(v)} {k}" for k, v in points.items()))
+    publish(snapshot_dir, version)
+    logger.info(f"snapshot {version} published in {snapshot_dir}")
+    return store
+
+
+if __name__ == "__main__":
+    build_snapshot(sys.argv[1:])
@@ -0,0 +1,199 @@
+# local reference table of french communes (postal code, name, centroid)
+#
+# the table is stored as a directory of numpy arrays memory-mapped at load
+# time so that several workers share the same pages:
+#   postal_codes.npy   int32   sorted postal codes (one row by commune)
+#   latitudes.npy      float32 centroid latitude of the commune
+#   longitudes.npy     float32 centroid longitude of the commune
+#   name_offsets.npy   uint32  offsets (n + 1) of the names in names.bin
+#   names.bin          utf-8 string table of the commune names
+#
+# it is built from the La Poste "base officielle des codes postaux" csv:
+#   python -m navigo.communes build laposte_hexasmal.csv [output_dir]
+
+import csv
+import logging
+import sys
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from navigo.settings import COMMUNES_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def normalize_name(name: str) -> str:
+    """normalize a commune name for lookups: upper case, no accents,
+    no punctuation and SAINT(E) abbreviated as in La Poste labels"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = ''.join(c if c.isalnum() else ' ' for c in name.upper())
+    words = ['ST' if w == 'SAINT' else 'STE' if w == 'SAINTE' else w
+             for w in name.split()]
+    return ' '.join(words)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """great circle distance in km between a point and arrays of points"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + \
+        np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class CommunesTable:
+    """
+    In-process lookup of french communes.
+
+    Args:
+        data_dir: directory holding the arrays written by build_table.
+    """
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self.postal_codes = np.load(data_dir / 'postal_codes.npy',
+                                    mmap_mode='r')
+        self.latitudes = np.load(data_dir / 'latitudes.npy', mmap_mode='r')
+        self.longitudes = np.load(data_dir / 'longitudes.npy', mmap_mode='r')
+        self.name_offsets = np.load(data_dir / 'name_offsets.npy',
+                                    mmap_mode='r')
+        self.names = np.memmap(data_dir / 'names.bin', dtype=np.uint8,
+                               mode='r')
+        self._zip_by_name = self._build_zip_by_name()
+
+    def __len__(self):
+        return len(self.postal_codes)
+
+    def name_at(self, index: int) -> str:
+        start, end = self.name_offsets[index], self.name_offsets[index + 1]
+        return self.names[start:end].tobytes().decode('utf-8')
+
+    def _first_index_of_zip(self, zipcode: int) -> int | None:
+        index = int(np.searchsorted(self.postal_codes, zipcode))
+        if index < len(self) and self.postal_codes[index] == zipcode:
+            return index
+        return None
+
+    def get_cityname(self, zipcode: int) -> str | None:
+        """name of the first commune of a postal code"""
+        index = self._first_index_of_zip(int(zipcode))
+        return None if index is None else self.name_at(index)
+
+    def _build_zip_by_name(self) -> dict[str, int]:
+        """normalized name => postal code, the table is sorted by postal
+        code so the lowest postal code of a commune is kept"""
+        blob = self.names.tobytes()
+        offsets = self.name_offsets.tolist()
+        zip_by_name = {}
+        for name, zipcode in zip(
+                (blob[start:end] for start, end in zip(offsets, offsets[1:])),
+                self.postal_codes.tolist()):
+            if name not in zip_by_name:
+                zip_by_name[name] = zipcode
+        # several rows of a commune share its name, normalized once
+        return {normalize_name(name.decode('utf-8')): zipcode
+                for name, zipcode in reversed(zip_by_name.items())}
+
+    def get_zipcode(self, city_name: str) -> int | None:
+        """postal code of a commune name (first one if several)"""
+        return self._zip_by_name.get(normalize_name(city_name))
+
+    def get_location(self, zipcode: int) -> tuple[float, float] | None:
+        """(latitude, longitude) of the first commune of a postal code"""
+        index = self._first_index_of_zip(int(zipcode))
+        if index is None:
+            return None
+        return float(self.latitudes[index]), float(self.longitudes[index])
+
+    def get_nearby_zipcodes(self, zipcode: int, rayon: float) -> set:
+        """postal codes of the communes within rayon km of a postal code,
+        the postal code itself is always part of the result"""
+        location = self.get_location(zipcode)
+        if location is None:
+            return set()
+        distances = haversine_km(location[0], location[1],
+                                 self.latitudes, self.longitudes)
+        nearby = np.unique(self.postal_codes[distances <= rayon])
+        return set(int(z) for z in nearby) | {int(zipcode)}
+
+
+@lru_cache(maxsize=1)
+def get_communes_table() -> CommunesTable | None:
+    """the communes table of COMMUNES_DATA_DIR, None if not built"""
+    if not Path(COMMUNES_DATA_DIR, 'postal_codes.npy').exists():
+        logger.warning(f"no communes table in {COMMUNES_DATA_DIR}, "
+                       f"falling back on remote APIs")
+        return None
+    table = CommunesTable(COMMUNES_DATA_DIR)
+    logger.info(f"loaded {len(table)} communes from {COMMUNES_DATA_DIR}")
+    return table
+
+
+def _find_column(header, *candidates):
+    for candidate in candidates:
+        for i, column in enumerate(header):
+            if candidate in column:
+                return i
+    return None
+
+
+def read_laposte_csv(csv_path) -> list[tuple[int, str, float, float]]:
+    """read (postal code, name, latitude, longitude) rows of the La Poste
+    csv, rows without coordinates are skipped"""
+    rows = set()
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f, delimiter=';')
+        header = [h.lower() for h in next(reader)]
+        zip_col = _find_column(header, 'code_postal')
+        name_col = _find_column(header, 'nom_de_la_commune', 'nom_commune')
+        gps_col = _find_column(header, 'coordonnees_gps', '_geopoint')
+        lat_col = _find_column(header, 'latitude')
+        lon_col = _find_column(header, 'longitude')
+        for line in reader:
+            try:
+                if gps_col is not None:
+                    lat, lon = line[gps_col].split(',')
+                else:
+                    lat, lon = line[lat_col], line[lon_col]
+                rows.add((int(line[zip_col]), line[name_col].strip(),
+                          float(lat), float(lon)))
+            except (ValueError, IndexError):
+                continue
+    return sorted(rows)
+
+
+def build_table(rows, output_dir):
+    """write the arrays of the communes table from
+    (postal code, name, latitude, longitude) rows"""
+    rows = sorted(rows)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    encoded_names = [name.encode('utf-8') for _, name, _, _ in rows]
+    offsets = np.zeros(len(rows) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(n) for n in encoded_names])
+
+    np.save(output_dir / 'postal_codes.npy',
+            np.array([r[0] for r in rows], dtype=np.int32))
+    np.save(output_dir / 'latitudes.npy',
+            np.array([r[2] for r in rows], dtype=np.float32))
+    np.save(output_dir / 'longitudes.npy',
+            np.array([r[3] for r in rows], dtype=np.float32))
+    np.save(output_dir / 'name_offsets.npy', offsets)
+    with open(output_dir / 'names.bin', 'wb') as f:
+        f.write(b''.join(encoded_names))
+    logger.info(f"communes table of {len(rows)} rows written in {output_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != 'build':
+        print("usage: python -m navigo.communes build <csv> [output_dir]")
+        sys.exit(1)
+    build_table(read_laposte_csv(sys.argv[2]),
+                sys.argv[3] if len(sys.argv) > 3 else COMMUNES_DATA_DIR)
@@ -0,0 +1,124 @@
+# selection of the points along the legs of an itinerary (eg toilets):
+# points are indexed by cell of a regular grid, the cells crossed by each leg
+# give the candidates whose distance to the leg is then computed exactly
+
+import copy
+import math
+
+import numpy as np
+
+M_BY_DEGREE = 111320
+
+
+class GridIndex:
+    """
+    Index of points by cell of a regular grid of cell_deg degrees.
+
+    Args:
+        latitudes, longitudes: coordinates of the points.
+        cell_deg: size of the cells in degrees.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_deg: float):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_deg = cell_deg
+        rows = np.floor(self.latitudes / cell_deg).astype(np.int64)
+        cols = np.floor(self.longitudes / cell_deg).astype(np.int64)
+        cells, inverse = np.unique(np.stack([rows, cols], axis=1), axis=0,
+                                   return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind='stable')
+        bounds = np.searchsorted(inverse.ravel()[order],
+                                 np.arange(len(cells) + 1))
+        self._cells = {(int(row), int(col)): order[bounds[i]:bounds[i + 1]]
+                       for i, (row, col) in enumerate(cells)}
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def query(self, min_lat, min_lon, max_lat, max_lon) -> np.ndarray:
+        """indexes of the points of the cells intersecting a bounding box"""
+        min_row = math.floor(min_lat / self.cell_deg)
+        max_row = math.floor(max_lat / self.cell_deg)
+        min_col = math.floor(min_lon / self.cell_deg)
+        max_col = math.floor(max_lon / self.cell_deg)
+        found = [self._cells[cell]
+                 for cell in ((row, col)
+                              for row in range(min_row, max_row + 1)
+                              for col in range(min_col, max_col + 1))
+                 if cell in self._cells]
+        return np.concatenate(found) if found else np.empty(0, np.int64)
+
+
+def segment_distances_m(lats, lons, start, end) -> np.ndarray:
+    """
+    distances in metres of points to the segment from start to end
+    ((lat, lon) tuples), on a local plane projection (legs are short)
+    """
+    x_scale = M_BY_DEGREE * math.cos(math.radians((start[0] + end[0]) / 2))
+    x = (np.asarray(lons) - start[1]) * x_scale
+    y = (np.asarray(lats) - start[0]) * M_BY_DEGREE
+    dx = (end[1] - start[1]) * x_scale
+    dy = (end[0] - start[0]) * M_BY_DEGREE
+    length2 = dx * dx + dy * dy
+    t = np.clip((x * dx + y * dy) / length2, 0, 1) if length2 else 0
+    return np.hypot(x - t * dx, y - t * dy)
+
+
+def get_day_legs(itinerary: list) -> dict:
+    """
+    legs ((lat, lon) of start and end) of each day of an itinerary,
+    the leg between 2 days belongs to the next day
+    """
+    points = sorted((p for p in itinerary if p.day is not None),
+                    key=lambda p: (p.day, p.rank))
+    legs = {}
+    previous = None
+    for point in points:
+        location = (float(point.latitude), float(point.longitude))
+        day_legs = legs.setdefault(point.day, [])
+        if previous is not None:
+            day_legs.append((previous, location))
+        elif not day_legs:
+            # a single point is a leg
+            day_legs.append((location, location))
+        previous = location
+    return legs
+
+
+def select_points_along_itinerary(itinerary: list, points: list,
+                                  max_distance_m: float) -> list:
+    """
+    Returns copies of the points within max_distance_m metres of the legs of
+    an itinerary, ordered by day, with the day of the first leg they are
+    close to.
+    """
+    if not points:
+        return []
+    index = GridIndex([float(p.latitude) for p in points],
+                      [float(p.longitude) for p in points],
+                      max_distance_m / M_BY_DEGREE)
+    day_by_point = {}
+    for day, legs in get_day_legs(itinerary).items():
+        for start, end in legs:
+            d_lat = max_distance_m / M_BY_DEGREE
+            d_lon = d_lat / max(math.cos(math.radians(start[0])), 0.01)
+            candidates = index.query(
+                min(start[0], end[0]) - d_lat, min(start[1], end[1]) - d_lon,
+                max(start[0], end[0]) + d_lat, max(start[1], end[1]) + d_lon)
+            candidates = np.array([c for c in candidates
+                                   if c not in day_by_point], dtype=np.int64)
+            if not len(candidates):
+                continue
+            distances = segment_distances_m(index.latitudes[candidates],
+                                            index.longitudes[candidates],
+                                            start, end)
+            for candidate in candidates[distances <= max_distance_m]:
+                day_by_point[int(candidate)] = day
+
+    selected = []
+    for i, day in sorted(day_by_point.items(), key=lambda item: item[::-1]):
+        point = copy.copy(points[i])
+        point.day = day
+        selected.append(point)
+    return selected
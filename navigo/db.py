@@ -1,9 +1,16 @@
 import logging
+import math
+from dataclasses import dataclass
+from functools import lru_cache
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy_utils import database_exists
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload, undefer
+from navigo.communes import get_communes_table, haversine_km
+from navigo.corridor import get_day_legs, select_points_along_itinerary
 from navigo.external import get_nearby_communes
+from navigo.snapshot import SnapshotStore, get_snapshot_store
 from navigo.planner.models_DB_ORM import Poi, Trail, PoiType, PoiTheme
 from navigo.planner.models import InternalNodesData, db_raw_to_poi, \
     db_raw_to_restaurant, db_raw_to_hosting, db_raw_to_trail, db_raw_to_wc
@@ -12,7 +19,9 @@ from navigo.settings import MARIADB_USER, MARIADB_PWD, MARIADB_HOST, \
     MARIADB_WC_TABLE, MIN_FETCHED_POI_BY_ZONE_PER_DAY, \
     MAX_LOOKUP_ITERATIONS_FOR_POINTS, LOOKUP_ITERATIONS_RADIUS_STEP, \
     MIN_FETCHED_RESTAURANT_BY_ZONE_PER_DAY, \
-    MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY, MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY
+    MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY, MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY, \
+    MARIADB_SPATIAL_QUERIES, EXPORT_BATCH_SIZE, ZONE_FILTER_CACHE_SIZE, \
+    WC_CORRIDOR_DISTANCE
 
 logger = logging.getLogger(__name__)
 
@@ -23,23 +32,163 @@ class DBManagerException(Exception):
     pass
 
 
-def get_nearby_communes_as_where_clause(postal_code, rayon=10) -> str:
+# columns needed by db_raw_to_restaurant, db_raw_to_hosting and db_raw_to_wc
+RESTAURANT_COLUMNS = "UUID, NAME, CITY, POSTAL_CODE, TYPE"
+HOSTING_COLUMNS = "UUID, NAME, CITY, POSTAL_CODE, TYPE"
+WC_COLUMNS = "UUID, NAME, CITY, POSTAL_CODE"
+# coordinates are read from MariaDB once tables are migrated
+# (see navigo.migrations), else they are fetched from neo4j
+if MARIADB_SPATIAL_QUERIES:
+    RESTAURANT_COLUMNS += ", LATITUDE, LONGITUDE"
+    HOSTING_COLUMNS += ", LATITUDE, LONGITUDE"
+    WC_COLUMNS += ", LATITUDE, LONGITUDE"
+
+# the bounding box uses the spatial index, the sphere distance refines it
+SPATIAL_WHERE_CLAUSE = (
+    "MBRContains(ST_GeomFromText(:bbox), LOCATION) "
+    "AND ST_Distance_Sphere(LOCATION, ST_GeomFromText(:center)) <= :radius_m"
+)
+# bounding box on the coordinates columns, without spatial index (rows
+# whose coordinates are not backfilled yet are kept)
+BBOX_WHERE_CLAUSE = (
+    "(LATITUDE BETWEEN :min_lat AND :max_lat "
+    "AND LONGITUDE BETWEEN :min_lon AND :max_lon OR LATITUDE IS NULL)"
+)
+KM_BY_DEGREE = 111.32
+
+
+@dataclass(frozen=True)
+class GeoArea:
+    """circle of radius (in km) around a point"""
+    latitude: float
+    longitude: float
+    radius: float
+
+    def bbox_params(self) -> dict:
+        """bound parameters of BBOX_WHERE_CLAUSE"""
+        d_lat = self.radius / KM_BY_DEGREE
+        d_lon = self.radius / (
+            KM_BY_DEGREE * max(math.cos(math.radians(self.latitude)), 0.01))
+        return {
+            "min_lat": self.latitude - d_lat,
+            "max_lat": self.latitude + d_lat,
+            "min_lon": self.longitude - d_lon,
+            "max_lon": self.longitude + d_lon,
+        }
+
+    def sql_params(self) -> dict:
+        """bound parameters of SPATIAL_WHERE_CLAUSE (points are x=lon,
+        y=lat as stored by navigo.migrations)"""
+        bbox = self.bbox_params()
+        min_lon, max_lon = bbox["min_lon"], bbox["max_lon"]
+        min_lat, max_lat = bbox["min_lat"], bbox["max_lat"]
+        return {
+            "center": f"POINT({self.longitude} {self.latitude})",
+            "bbox": f"POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, "
+                    f"{max_lon} {max_lat}, {min_lon} {max_lat}, "
+                    f"{min_lon} {min_lat}))",
+            "radius_m": self.radius * 1000,
+        }
+
+
+def get_zone_area(zone: int, rayon: int) -> GeoArea | None:
     """
-    Returns a list formatted for SQL query of results from get_nearby_communes.
+    Returns the area of rayon km around the centroid of the zone, or None
+    if spatial queries are disabled or the centroid of the zone is unknown.
+    """
+    if not MARIADB_SPATIAL_QUERIES:
+        return None
+    communes_table = get_communes_table()
+    location = communes_table.get_location(zone) if communes_table else None
+    if location is None:
+        logger.warning(f"centroid of zone {zone} unknown, "
+                       f"searching by postal codes")
+        return None
+    return GeoArea(latitude=location[0], longitude=location[1], radius=rayon)
+
+
+def zone_where_clause(zone_filter) -> (str, dict, list):
+    """
+    Returns the WHERE clause restricting points to a zone, its bound
+    parameters and the bindparam objects to attach to the text query.
+
+    Args:
+        zone_filter: a GeoArea or a list of postal codes.
+    """
+    if isinstance(zone_filter, GeoArea):
+        return SPATIAL_WHERE_CLAUSE, zone_filter.sql_params(), []
+    return "POSTAL_CODE IN :postal_codes", \
+        {"postal_codes": list(zone_filter)}, \
+        [bindparam("postal_codes", expanding=True)]
+
+
+def get_nearby_postal_codes(postal_code, rayon=10) -> tuple:
+    """
+    Returns the sorted postal codes from get_nearby_communes,
+    to be used as a bound parameter of SQL queries.
 
     Args:
         postal_code: The postal code of the commune to search for.
         rayon: The search radius in kilometers.
 
     Returns:
-        A list (on SQL format) of postal codes.
+        A tuple of postal codes.
     """
-    communes = get_nearby_communes(postal_code, rayon)
-    # format list in SQL format
-    res = "(" + ",".join(str(n) for n in communes) + ")"
+    communes = tuple(sorted(get_nearby_communes(postal_code, rayon)))
+
+    logger.info(f"restricting search in following communes: {communes}")
+    return communes
+
+
+@lru_cache(maxsize=ZONE_FILTER_CACHE_SIZE)
+def get_zone_filter(zone: int, rayon: int):
+    """the GeoArea of rayon km around the zone when spatial queries are
+    enabled, else the postal codes of the communes within rayon km
+    (cached by zone and rayon, both are immutable)"""
+    return get_zone_area(zone, rayon) or get_nearby_postal_codes(zone, rayon)
+
+
+def expand_zone_search(zone: int, rayon: int, fetch, min_nb: int,
+                       count=len) -> (list, object):
+    """
+    Calls fetch(zone_filter) on zones of growing radius around the zone,
+    from rayon km, until it returns at least min_nb points (as counted by
+    count) or MAX_LOOKUP_ITERATIONS_FOR_POINTS zones have been searched.
+    Returns the last points fetched and their zone filter.
+    """
+    points, zone_filter = [], ()
+    for iteration in range(MAX_LOOKUP_ITERATIONS_FOR_POINTS):
+        radius = rayon + iteration * LOOKUP_ITERATIONS_RADIUS_STEP
+        logger.info(
+            f"running iteration {iteration} to fetch points "
+            f"with radius: {radius}")
+        zone_filter = get_zone_filter(zone, radius)
+        points = fetch(zone_filter)
+        if points and count(points) >= min_nb:
+            break
+    return points, zone_filter
 
-    logger.info(f"restricting search in following communes: {res}")
-    return res
+
+@lru_cache(maxsize=1)
+def get_engine():
+    """engine shared by all queries, to reuse pooled connections"""
+    return create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
+
+
+def order_by_favorites(column: str, favorites: list) -> (str, dict):
+    """
+    Returns an ORDER BY clause ranking rows by the index of their column
+    value in the favorites list (rows out of the list are last), and its
+    bound parameters.
+    """
+    if not favorites:
+        return "", {}
+
+    params = {f"favorite_{i}": f for i, f in enumerate(favorites)}
+    cases = " ".join(f"WHEN :favorite_{i} THEN {i}"
+                     for i in range(len(favorites)))
+    return f"ORDER BY CASE {column} {cases} ELSE {len(favorites)} END", \
+        params
 
 
 def maria_connect(URL=SQLALCHEMY_DATABASE_URI) -> Session:
@@ -51,34 +200,45 @@ def maria_connect(URL=SQLALCHEMY_DATABASE_URI) -> Session:
     return Session(engine)
 
 
+def query_by_zone(session: Session, model, zone_filter):
+    """ORM query of POI or Trail located in a zone filter"""
+    query = session.query(model)
+    if isinstance(zone_filter, GeoArea):
+        return query.options(undefer(model.LATITUDE),
+                             undefer(model.LONGITUDE)).filter(
+            text(SPATIAL_WHERE_CLAUSE)).params(**zone_filter.sql_params())
+    return query.filter(model.POSTAL_CODE.in_(zone_filter))
+
+
+def query_pois_by_zone(session: Session, zone_filter, limit: int) -> list:
+    """
+    Returns the POI rows located in a zone filter with their types and
+    themes eagerly loaded (one SELECT for each relationship whatever the
+    number of POI), as db_raw_to_poi reads them for each POI.
+    """
+    return query_by_zone(session, Poi, zone_filter).options(
+        selectinload(Poi.POI_TYPES),
+        selectinload(Poi.POI_THEMES)).limit(limit).all()
+
+
 def get_poi_by_zone(zone: int, rayon: int, days: int = 1) -> (list, list):
-    """function that return a list of POI and a list of postal codes
+    """function that return a list of POI and the zone filter (a GeoArea
+    when spatial queries are enabled, else the postal codes)
     where POI are located"""
-    iteration = 0
-    poi_list = []
     min_nb_POI = MIN_FETCHED_POI_BY_ZONE_PER_DAY * days
 
     session = maria_connect()
 
-    while iteration < MAX_LOOKUP_ITERATIONS_FOR_POINTS and \
-            len(poi_list) < min_nb_POI:
-
-        radius = rayon + iteration * LOOKUP_ITERATIONS_RADIUS_STEP
-        logger.info(
-            f"running iteration {iteration} to fetch POI with radius: {radius}")
-
-        l_postal_code = get_nearby_communes_as_where_clause(zone, radius)
-        # logger.info(f"l_postal_code = {l_postal_code}")
+    def fetch(zone_filter):
         try:
-            poi_list = session.query(Poi).filter(
-                Poi.POSTAL_CODE.in_(
-                    l_postal_code[1:-1].split(','))).limit(
-                        min_nb_POI * 3).all()
+            return query_pois_by_zone(session, zone_filter, min_nb_POI * 3)
         except Exception as e:
             logger.error(f"error while fetching POI: {e}")
             session.close()
+            return []
 
-        iteration += 1
+    poi_list, l_postal_code = expand_zone_search(zone, rayon, fetch,
+                                                 min_nb_POI)
     logger.info(f"number of POIs find = {len(poi_list)}")
     if poi_list != []:
         res_list = [db_raw_to_poi(x) for x in poi_list]
@@ -90,20 +250,30 @@ def get_poi_by_zone(zone: int, rayon: int, days: int = 1) -> (list, list):
         return [], []
 
 
-def get_restaurants_by_zone(l_postal_code: list, days: int = 1) -> list:
+def get_restaurants_by_zone(l_postal_code: list, days: int = 1,
+                            favorite_categories: list = None) -> list:
+    """
+    Returns the restaurants located in a zone filter (list of postal codes
+    or GeoArea), restaurants of the favorite categories of the user are
+    fetched first.
+    """
     restaurant_list = []
     min_nb_restau = MIN_FETCHED_RESTAURANT_BY_ZONE_PER_DAY * days
-    engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
+    order_by, params = order_by_favorites("TYPE", favorite_categories)
+    where, zone_params, bindparams = zone_where_clause(l_postal_code)
 
-    with engine.begin() as con:
+    with get_engine().begin() as con:
         query = text(
             f"""
-            SELECT * FROM {MARIADB_RESTAURANT_TABLE} WHERE POSTAL_CODE in
-            {l_postal_code} LIMIT {min_nb_restau * 3 }
+            SELECT {RESTAURANT_COLUMNS} FROM {MARIADB_RESTAURANT_TABLE}
+            WHERE {where}
+            {order_by} LIMIT :limit
             """
-        )
+        ).bindparams(*bindparams)
         try:
-            restaurant_list = con.execute(query)
+            restaurant_list = con.execute(
+                query,
+                {"limit": min_nb_restau * 3, **zone_params, **params})
             restaurant_list = restaurant_list.mappings().all()
         except Exception as e:
             logger.error(f"error while fetching Restaurant: {e}")
@@ -115,20 +285,30 @@ def get_restaurants_by_zone(l_postal_code: list, days: int = 1) -> list:
     return restaurant_list
 
 
-def get_hosting_by_zone(l_postal_code: list, days: int = 1) -> list:
+def get_hosting_by_zone(l_postal_code: list, days: int = 1,
+                        favorite_categories: list = None) -> list:
+    """
+    Returns the hostings located in a zone filter (list of postal codes
+    or GeoArea), hostings of the favorite categories of the user are
+    fetched first.
+    """
     hosting_list = []
     min_nb_hosting = MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY * days
-    engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
+    order_by, params = order_by_favorites("TYPE", favorite_categories)
+    where, zone_params, bindparams = zone_where_clause(l_postal_code)
 
-    with engine.begin() as con:
+    with get_engine().begin() as con:
         query = text(
             f"""
-                SELECT * FROM {MARIADB_HOSTING_TABLE} WHERE POSTAL_CODE in
-            {l_postal_code} LIMIT {min_nb_hosting * 3 }
+            SELECT {HOSTING_COLUMNS} FROM {MARIADB_HOSTING_TABLE}
+            WHERE {where}
+            {order_by} LIMIT :limit
             """
-        )
+        ).bindparams(*bindparams)
         try:
-            hosting_list = con.execute(query)
+            hosting_list = con.execute(
+                query,
+                {"limit": min_nb_hosting * 3, **zone_params, **params})
             hosting_list = hosting_list.mappings().all()
         except Exception as e:
             logger.error(f"error while fetching Hosting: {e}")
@@ -147,10 +327,8 @@ def get_trails_by_zone(l_postal_code: list, days: int = 1) -> list:
     session = maria_connect()
 
     try:
-        trail_list = session.query(Trail).filter(
-            Trail.POSTAL_CODE.in_(
-                l_postal_code[1:-1].split(','))).limit(
-                    min_nb_trail * 3).all()
+        trail_list = query_by_zone(session, Trail, l_postal_code).limit(
+            min_nb_trail * 3).all()
     except Exception as e:
         logger.error(f"error while fetching Trail: {e}")
         session.close()
@@ -164,18 +342,30 @@ def get_trails_by_zone(l_postal_code: list, days: int = 1) -> list:
         return []
 
 
-def get_wc_by_zone(l_postal_code: list, days: int = 1) -> list:
+def get_wc_by_zone(l_postal_code: list, days: int = 1,
+                   area: GeoArea = None) -> list:
+    """
+    Returns the toilets of a zone (a GeoArea or a list of postal codes),
+    only those in the bounding box of area when given (it needs the
+    coordinates columns of navigo.migrations, not their spatial index).
+    """
     wc_list = []
-    engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
-
-    with engine.begin() as con:
+    where, zone_params, bindparams = zone_where_clause(l_postal_code)
+    columns = WC_COLUMNS
+    if area is not None:
+        where = f"{where} AND {BBOX_WHERE_CLAUSE}"
+        zone_params = {**zone_params, **area.bbox_params()}
+        if not MARIADB_SPATIAL_QUERIES:
+            columns += ", LATITUDE, LONGITUDE"
+
+    with get_engine().begin() as con:
         query = text(
             f"""
-                SELECT * FROM {MARIADB_WC_TABLE} WHERE POSTAL_CODE in
-                {l_postal_code}
+            SELECT {columns} FROM {MARIADB_WC_TABLE}
+            WHERE {where}
             """
-        )
-        wc_list = con.execute(query)
+        ).bindparams(*bindparams)
+        wc_list = con.execute(query, zone_params)
         wc_list = wc_list.mappings().all()
 
     wc_list = [db_raw_to_wc(x) for x in wc_list]
@@ -184,17 +374,236 @@ def get_wc_by_zone(l_postal_code: list, days: int = 1) -> list:
     return wc_list
 
 
-def get_db_internal_nodes_data_by_zone(zone: int,
-                                       rayon: int,
-                                       days: int = 1) -> InternalNodesData:
+def get_legs_area(legs: list, margin: float) -> GeoArea:
+    """circle holding the legs ((lat, lon) of start and end) of a day
+    and their surroundings of margin km"""
+    lats = [location[0] for leg in legs for location in leg]
+    lons = [location[1] for leg in legs for location in leg]
+    latitude, longitude = sum(lats) / len(lats), sum(lons) / len(lons)
+    radius = float(haversine_km(latitude, longitude, lats, lons).max())
+    return GeoArea(latitude=latitude, longitude=longitude,
+                   radius=radius + margin)
+
+
+def get_wc_along_itinerary(itinerary: list,
+                           max_distance_m: int = WC_CORRIDOR_DISTANCE) -> list:
+    """
+    Returns the toilets within max_distance_m metres of the legs of each day
+    of an itinerary, with the day they are close to.
+    Only the toilets around the legs of each day are fetched: by distance
+    from the snapshot or with spatial queries, else in the communes of the
+    itinerary and the bounding box of the legs (or in the whole communes
+    when the table has no coordinates columns).
+    """
+    day_legs = get_day_legs(itinerary)
+    if not day_legs:
+        return []
+
+    store = get_snapshot_store()
+    postal_codes = sorted({int(p.city_code) for p in itinerary
+                           if p.day is not None})
+    toilets = {}
+    try:
+        for legs in day_legs.values():
+            area = get_legs_area(legs, max_distance_m / 1000)
+            if store is not None:
+                points = store.get_points('wc', area)
+            elif MARIADB_SPATIAL_QUERIES:
+                points = get_wc_by_zone(area)
+            else:
+                points = get_wc_by_zone(postal_codes, area=area)
+            toilets.update((p.uuid, p) for p in points if p is not None)
+        toilets = list(toilets.values())
+    except DBAPIError as e:
+        if store is not None or MARIADB_SPATIAL_QUERIES:
+            raise
+        logger.warning(f"toilets not filtered by coordinates ({e}), "
+                       f"run navigo.migrations")
+        toilets = get_wc_by_zone(postal_codes)
+
+    toilets = select_points_along_itinerary(
+        itinerary, [p for p in toilets if p is not None], max_distance_m)
+    logger.info(f"{len(toilets)} toilets along the itinerary")
+    return toilets
+
+
+# kind of point => (MariaDB table, columns, converter) of points queried
+# with text queries
+TEXT_POINT_QUERIES = {
+    'restaurant': (MARIADB_RESTAURANT_TABLE, RESTAURANT_COLUMNS,
+                   db_raw_to_restaurant),
+    'hosting': (MARIADB_HOSTING_TABLE, HOSTING_COLUMNS, db_raw_to_hosting),
+    'wc': (MARIADB_WC_TABLE, WC_COLUMNS, db_raw_to_wc),
+}
+# kind of point => (ORM model, converter)
+ORM_POINT_QUERIES = {
+    'poi': (Poi, db_raw_to_poi),
+    'trail': (Trail, db_raw_to_trail),
+}
+
+
+def fetch_point_rows_after(kind: str, zone_filter, after: str | None,
+                           limit: int, offset: int = 0) -> (list, callable):
+    """
+    Returns at most limit rows of points of a zone filter ordered by UUID,
+    starting after the UUID after (keyset pagination) and skipping offset
+    rows, as (UUID, row) tuples, and the converter hydrating a row into a
+    point.
+    """
+    after = after or ""
+    store = get_snapshot_store()
+    if store is not None:
+        points = store.get_points_by_uuid(kind, zone_filter, after, offset,
+                                          limit)
+        return [(p.uuid, p) for p in points], lambda p: p
+
+    if kind in ORM_POINT_QUERIES:
+        model, converter = ORM_POINT_QUERIES[kind]
+        with Session(get_engine()) as session:
+            query = query_by_zone(session, model, zone_filter).filter(
+                model.UUID > after).order_by(model.UUID).offset(
+                offset).limit(limit)
+            if model is Poi:
+                query = query.options(selectinload(Poi.POI_TYPES),
+                                      selectinload(Poi.POI_THEMES))
+            return [(row.UUID, row) for row in query.all()], converter
+
+    table, columns, converter = TEXT_POINT_QUERIES[kind]
+    where, zone_params, bindparams = zone_where_clause(zone_filter)
+    with get_engine().begin() as con:
+        rows = con.execute(text(
+            f"""
+            SELECT {columns} FROM {table}
+            WHERE {where} AND UUID > :after
+            ORDER BY UUID LIMIT :limit OFFSET :offset
+            """
+        ).bindparams(*bindparams),
+            {"after": after, "limit": limit, "offset": offset,
+             **zone_params}
+        ).mappings().all()
+    return [(row['UUID'], row) for row in rows], converter
+
+
+def get_points_page(kind: str, zone_filter, size: int,
+                    after: str = None) -> (list, str | None):
+    """
+    Returns a page of size points of a zone filter following the UUID after,
+    and the cursor of the next page (None on the last page).
+    Only the rows of the page are hydrated, points without coordinates are
+    skipped so a page may be shorter.
+    """
+    rows, converter = fetch_point_rows_after(kind, zone_filter, after,
+                                             size + 1)
+    next_cursor = rows[size - 1][0] if len(rows) > size else None
+    points = [converter(row) for _, row in rows[:size]]
+    return [p for p in points if p is not None], next_cursor
+
+
+def count_points(kind: str, zone_filter) -> int:
+    """number of points of a zone filter (rows of the database, some may
+    not be hydrated for lack of coordinates)"""
+    store = get_snapshot_store()
+    if store is not None:
+        return store.count_points(kind, zone_filter)
+
+    if kind in ORM_POINT_QUERIES:
+        model, _ = ORM_POINT_QUERIES[kind]
+        with Session(get_engine()) as session:
+            return query_by_zone(session, model, zone_filter).count()
+
+    table, _, _ = TEXT_POINT_QUERIES[kind]
+    where, zone_params, bindparams = zone_where_clause(zone_filter)
+    with get_engine().begin() as con:
+        return con.execute(text(
+            f"SELECT COUNT(*) FROM {table} WHERE {where}"
+        ).bindparams(*bindparams), zone_params).scalar()
+
+
+def get_points_at(kind: str, zone_filter, offset: int, size: int) -> list:
+    """
+    Returns the size points of a zone filter ordered by UUID from the
+    offset one (LIMIT/OFFSET pagination). Only the rows of the page are
+    hydrated, points without coordinates are skipped.
+    """
+    rows, converter = fetch_point_rows_after(kind, zone_filter, None, size,
+                                             offset)
+    points = [converter(row) for _, row in rows]
+    return [p for p in points if p is not None]
+
+
+def iter_points_by_zone(kind: str, zone_filter,
+                        batch_size: int = EXPORT_BATCH_SIZE):
+    """generates all points of a zone filter, fetched by batches"""
+    after = None
+    while True:
+        rows, converter = fetch_point_rows_after(kind, zone_filter, after,
+                                                 batch_size)
+        for _, row in rows:
+            point = converter(row)
+            if point is not None:
+                yield point
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+def get_db_internal_nodes_data_by_zone(
+        zone: int,
+        rayon: int,
+        days: int = 1,
+        favorite_restaurant_categories: list = None,
+        favorite_hosting_categories: list = None) -> InternalNodesData:
+    store = get_snapshot_store()
+    if store is not None:
+        return get_snapshot_internal_nodes_data_by_zone(
+            store, zone, rayon, days, favorite_restaurant_categories,
+            favorite_hosting_categories)
+
     poi_list, l_postal_code = get_poi_by_zone(zone, rayon, days)
 
     return InternalNodesData(
         poi_list=poi_list,
-        restaurant_list=get_restaurants_by_zone(l_postal_code, days),
-        hosting_list=get_hosting_by_zone(l_postal_code, days),
+        restaurant_list=get_restaurants_by_zone(
+            l_postal_code, days, favorite_restaurant_categories),
+        hosting_list=get_hosting_by_zone(
+            l_postal_code, days, favorite_hosting_categories),
         trail_list=get_trails_by_zone(l_postal_code, days),
-        toilets_list=get_wc_by_zone(l_postal_code, days)
+        # toilets are fetched along the itinerary (see get_wc_along_itinerary)
+        toilets_list=[]
+    )
+
+
+def get_snapshot_internal_nodes_data_by_zone(
+        store: SnapshotStore,
+        zone: int,
+        rayon: int,
+        days: int = 1,
+        favorite_restaurant_categories: list = None,
+        favorite_hosting_categories: list = None) -> InternalNodesData:
+    """same as get_db_internal_nodes_data_by_zone, but read from a snapshot
+    of the databases (see navigo.snapshot), no database is queried"""
+    min_nb_POI = MIN_FETCHED_POI_BY_ZONE_PER_DAY * days
+    poi_list, zone_filter = expand_zone_search(
+        zone, rayon,
+        lambda zone_filter: store.get_points('poi', zone_filter,
+                                             min_nb_POI * 3),
+        min_nb_POI)
+    logger.info(f"number of POIs find in snapshot {store.version} = "
+                f"{len(poi_list)}")
+
+    return InternalNodesData(
+        poi_list=poi_list,
+        restaurant_list=store.get_points(
+            'restaurant', zone_filter,
+            MIN_FETCHED_RESTAURANT_BY_ZONE_PER_DAY * days * 3,
+            favorite_restaurant_categories),
+        hosting_list=store.get_points(
+            'hosting', zone_filter,
+            MIN_FETCHED_HOSTING_BY_ZONE_PER_DAY * days * 3,
+            favorite_hosting_categories),
+        trail_list=store.get_points(
+            'trail', zone_filter, MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY * days * 3),
+        toilets_list=[]
     )
 
 
@@ -231,6 +640,7 @@ def get_poi_categories_of_type() -> list:
 
 
 def get_poi_themes() -> list:
+    res = []
     session = maria_connect()
     try:
         res = session.query(PoiTheme).all()
@@ -260,9 +670,8 @@ def get_poi_categories_of_theme() -> list:
 
 
 def get_restaurants_types() -> list:
-    engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
     rest_type = []
-    with engine.begin() as con:
+    with get_engine().begin() as con:
         query = text(
             f"""SELECT DISTINCT(TYPE) FROM {MARIADB_RESTAURANT_TABLE}"""
         )
@@ -275,9 +684,8 @@ def get_restaurants_types() -> list:
 
 
 def get_hostings_types() -> list:
-    engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
     host_types = []
-    with engine.begin() as con:
+    with get_engine().begin() as con:
         query = text(
             f"""SELECT DISTINCT(TYPE) FROM {MARIADB_HOSTING_TABLE}"""
         )
@@ -1,18 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import json
 import logging
+import time
 
 import pandas as pd
 import requests
 
 import urllib.parse
 
+from navigo.communes import get_communes_table
 from navigo.planner.models import ExternalData, POI, Restaurant
 from navigo.settings import FOURESQUARE_API_CLIENT_ID, \
     FOURESQUARE_API_CLIENT_SECRET, FOURESQUARE_API_URL, \
     FOURESQUARE_POI_CATEGORY_ID, FOURESQUARE_RESTAURANT_CATEGORY_ID, \
-    FOURESQUARE_API_TOKEN
+    FOURESQUARE_API_TOKEN, EXTERNAL_DATA_TIMEOUT
+from navigo.transport import transport
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +28,7 @@ class WeatherRequest:
     end_date: datetime
 
 
-def fetch_weather_data(ville):
+def fetch_weather_data(ville, timeout: float = EXTERNAL_DATA_TIMEOUT):
     '''
     Fetch weather data from OpenWeatherMap API for a given city.
     Returns a DataFrame containing the raw weather data.
@@ -33,7 +37,7 @@ def fetch_weather_data(ville):
     url = f"https://api.openweathermap.org/data/2.5/forecast/daily?q={ville}&cnt=16&appid={KEY}&units=metric"
 
     try:
-        response = requests.get(url)
+        response = transport.get(url, timeout=timeout)
         response.raise_for_status()
         data_dict = response.json()
         normalized_data = pd.json_normalize(data_dict).list[0]
@@ -59,7 +63,8 @@ def preprocess_weather_data(df):
     return df[['date', 'tempRessentie', 'idTemps', 'tempsPrevu', 'condition']]
 
 
-def get_weather_forecast(request: WeatherRequest):
+def get_weather_forecast(request: WeatherRequest,
+                         timeout: float = EXTERNAL_DATA_TIMEOUT):
     '''
     Function that takes a WeatherRequest object with a city name,
     travel start and end dates.
@@ -70,7 +75,7 @@ def get_weather_forecast(request: WeatherRequest):
     temperature between 10 and 30°.
     If weather data is unavailable, returns True.
     '''
-    weather_data = fetch_weather_data(request.ville)
+    weather_data = fetch_weather_data(request.ville, timeout)
     if weather_data is None:
         return True
 
@@ -98,9 +103,12 @@ def get_weather_forecast(request: WeatherRequest):
 
 def get_weather_forecast_by_zone(zone: int,
                                  trip_start: str,
-                                 trip_duration: int) -> bool:
+                                 trip_duration: int,
+                                 city_name: str = None,
+                                 timeout: float = EXTERNAL_DATA_TIMEOUT
+                                 ) -> bool:
     # logger.info(f"get_weather_forecast_by_zone zone: {zone}")
-    ville = get_cityname(zone)
+    ville = city_name or get_cityname(zone, timeout)
     logger.info(f"get_weather_forecast_by_zone ville: {ville}")
     start = datetime.strptime(trip_start, "%Y-%m-%d")
     end = start + timedelta(days=trip_duration)
@@ -110,18 +118,18 @@ def get_weather_forecast_by_zone(zone: int,
             ville=ville,
             start_date=start,
             end_date=end
-        )
+        ),
+        timeout
     )
 
 
 # todo fix category IDs
 # Foursquare APIs
 
-def explore_venues(city_name, category_id, limit, radius) -> list:
-    client = requests.Session()
+def explore_venues(city_name, category_id, limit, radius,
+                   timeout: float = EXTERNAL_DATA_TIMEOUT) -> list:
     # add 'Accept-Language': 'fr' into header of request to get french results
-
-    response = client.get(
+    response = transport.get(
         FOURESQUARE_API_URL,
         headers={
             'Authorization': FOURESQUARE_API_TOKEN,
@@ -137,7 +145,8 @@ def explore_venues(city_name, category_id, limit, radius) -> list:
             # 'radius': radius,
             'sort_field': 'popularity',
             'sort_order': 'DESC',
-        }
+        },
+        timeout=timeout
     )
     if response.status_code == 200:
         data = response.json()
@@ -148,10 +157,12 @@ def explore_venues(city_name, category_id, limit, radius) -> list:
         return []
 
 
-def get_most_popular_poi_by_zone(zip_code, limit=25, radius=50000) -> list:
-    city_name = get_cityname(zip_code)
+def get_most_popular_poi_by_zone(zip_code, limit=25, radius=50000,
+                                 city_name=None,
+                                 timeout=EXTERNAL_DATA_TIMEOUT) -> list:
+    city_name = city_name or get_cityname(zip_code, timeout)
     raw_pois = explore_venues(
-        city_name, FOURESQUARE_POI_CATEGORY_ID, limit, radius)
+        city_name, FOURESQUARE_POI_CATEGORY_ID, limit, radius, timeout)
     # logger.info(f"raw_pois: {raw_pois}")
     pois = [
         POI(
@@ -171,14 +182,17 @@ def get_most_popular_poi_by_zone(zip_code, limit=25, radius=50000) -> list:
 def get_most_popular_restaurant_by_zone(
         zip_code,
         limit=25,
-        radius=50000) -> list:
+        radius=50000,
+        city_name=None,
+        timeout=EXTERNAL_DATA_TIMEOUT) -> list:
 
-    city_name = get_cityname(zip_code)
+    city_name = city_name or get_cityname(zip_code, timeout)
     raw_restaurants = explore_venues(
         city_name,
         FOURESQUARE_RESTAURANT_CATEGORY_ID,
         limit,
-        radius)
+        radius,
+        timeout)
     restaurants = [
         Restaurant(
             longitude=result["geocodes"]["main"]["longitude"],
@@ -198,28 +212,103 @@ def get_most_popular_restaurant_by_zone(
 def get_external_data(zone: int,
                       trip_start: str,
                       trip_duration: int,
-                      sensitivity_to_weather: bool) -> ExternalData:
+                      sensitivity_to_weather: bool,
+                      timeout: float = EXTERNAL_DATA_TIMEOUT) -> ExternalData:
+    """
+    Fetch weather forecast, top POIs and top restaurants concurrently.
+
+    The city name of the zone is resolved once and shared by the three
+    fetches, under the same deadline. Sources which have not answered (or
+    failed) before the deadline are replaced by their neutral value and
+    reported in ExternalData.missing, all of them when the city name could
+    not be resolved. The requests are sent with the time left before the
+    deadline as timeout.
+
+    Args:
+        zone: The zip code of the trip zone.
+        trip_start: The first day of the trip (YYYY-MM-DD).
+        trip_duration: The duration of the trip in days.
+        sensitivity_to_weather: fetch the weather forecast only if True.
+        timeout: overall deadline in seconds for the city name and the
+            three fetches.
+
+    Returns:
+        The (possibly partial) ExternalData of the zone.
+    """
+    deadline = time.monotonic() + timeout
+
+    def remaining() -> float:
+        return max(deadline - time.monotonic(), 0.001)
+
+    names = ['top_poi_list', 'top_restaurant_list']
     if sensitivity_to_weather:
-        return ExternalData(
-            weather_forecast=get_weather_forecast_by_zone(
-                zone, trip_start, trip_duration),
-            top_poi_list=get_most_popular_poi_by_zone(zone),
-            top_restaurant_list=get_most_popular_restaurant_by_zone(zone)
-        )
-    return ExternalData(
-        weather_forecast=None,
-        top_poi_list=get_most_popular_poi_by_zone(zone),
-        top_restaurant_list=get_most_popular_restaurant_by_zone(zone)
-    )
+        names.append('weather_forecast')
+    # neutral values used when a source is missing, weather is considered
+    # favorable when unknown (see get_weather_forecast)
+    results = {
+        'weather_forecast': True if sensitivity_to_weather else None,
+        'top_poi_list': [],
+        'top_restaurant_list': [],
+    }
+    missing = []
+
+    executor = ThreadPoolExecutor(max_workers=len(names))
+    try:
+        # the city name is shared by the fetches, all of them are missing
+        # when it can not be resolved in time
+        city = executor.submit(get_cityname, zone, remaining())
+        done, _ = wait([city], timeout=remaining())
+        try:
+            if city not in done:
+                raise TimeoutError(f"timed out after {timeout}s")
+            city_name = city.result()
+        except Exception as e:
+            logger.error(f"error while resolving the city of {zone}: {e}")
+            return ExternalData(missing=sorted(names), **results)
+
+        fetchers = {
+            'top_poi_list': (get_most_popular_poi_by_zone, (zone,), {}),
+            'top_restaurant_list': (get_most_popular_restaurant_by_zone,
+                                    (zone,), {}),
+            'weather_forecast': (get_weather_forecast_by_zone,
+                                 (zone, trip_start, trip_duration), {}),
+        }
+        futures = {
+            executor.submit(func, *args, city_name=city_name,
+                            timeout=remaining(), **kwargs): name
+            for name, (func, args, kwargs) in fetchers.items()
+            if name in names
+        }
+        done, _ = wait(futures, timeout=remaining())
+    finally:
+        # do not wait for late upstreams, their results are dropped (their
+        # requests end with the deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for future, name in futures.items():
+        if future not in done:
+            logger.warning(
+                f"external source {name} timed out after {timeout}s")
+            missing.append(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.error(f"error while fetching external {name}: {e}")
+            missing.append(name)
+
+    return ExternalData(missing=sorted(missing), **results)
 
 
 ################################################
 # helper APIs to work with cities and zip codes
 ################################################
 
-def get_nearby_communes(postal_code, rayon=10) -> set:
+def get_nearby_communes(postal_code, rayon=10,
+                        timeout: float = EXTERNAL_DATA_TIMEOUT) -> set:
     """
-    Returns a list of city returned by the API villes-voisines.fr
+    Returns a list of city from the local communes table, or returned by
+    the API villes-voisines.fr if the table is not available
 
     Args:
         postal_code: The postal code of the commune to search for.
@@ -228,9 +317,14 @@ def get_nearby_communes(postal_code, rayon=10) -> set:
     Returns:
         A list of postal codes.
     """
+    communes_table = get_communes_table()
+    if communes_table is not None:
+        communes = communes_table.get_nearby_zipcodes(postal_code, rayon)
+        if communes:
+            return communes
 
     url = f"https://www.villes-voisines.fr/getcp.php?cp={postal_code}&rayon={rayon}"
-    response = requests.get(url)
+    response = transport.get(url, timeout=timeout)
     data = json.loads(response.content)
     # logger.info(f"Villes voisines: {json.dumps(data, indent=4)}")
 
@@ -242,9 +336,11 @@ def get_nearby_communes(postal_code, rayon=10) -> set:
     return set([int(commune["code_postal"]) for commune in communes])
 
 
-def get_zipcode(city_name: str) -> int:
+def get_zipcode(city_name: str,
+                timeout: float = EXTERNAL_DATA_TIMEOUT) -> int:
     """
-    Queries the Vicopo API to get the zip code of a given city.
+    Queries the local communes table (or the Vicopo API if not available)
+    to get the zip code of a given city.
 
     Args:
         city_name: The name of the city to look for.
@@ -252,9 +348,14 @@ def get_zipcode(city_name: str) -> int:
     Returns:
         The zip code of the city
     """
+    communes_table = get_communes_table()
+    if communes_table is not None:
+        zipcode = communes_table.get_zipcode(city_name)
+        if zipcode is not None:
+            return zipcode
 
     url = "https://vicopo.selfbuild.fr?city=" + urllib.parse.quote(city_name)
-    response = requests.get(url)
+    response = transport.get(url, timeout=timeout)
 
     if response.status_code != 200:
         msg = f"unable to get zip code of {city_name}: {response}"
@@ -269,9 +370,11 @@ def get_zipcode(city_name: str) -> int:
             return city["code"]
 
 
-def get_cityname(zipcode: int) -> str:
+def get_cityname(zipcode: int,
+                 timeout: float = EXTERNAL_DATA_TIMEOUT) -> str:
     """
-    Queries the Vicopo API to get the city name for a given zipcode.
+    Queries the local communes table (or the Vicopo API if not available)
+    to get the city name for a given zipcode.
 
     Args:
         zipcode: the zipcode to look for.
@@ -279,9 +382,14 @@ def get_cityname(zipcode: int) -> str:
     Returns:
         The name of city of the zipcode
     """
+    communes_table = get_communes_table()
+    if communes_table is not None:
+        city_name = communes_table.get_cityname(zipcode)
+        if city_name is not None:
+            return city_name
 
     url = f"https://vicopo.selfbuild.fr?code={zipcode}"
-    response = requests.get(url)
+    response = transport.get(url, timeout=timeout)
 
     if response.status_code != 200:
         msg = f"unable to get zip code of {zipcode}: {response}"
@@ -297,7 +405,7 @@ def get_cityname(zipcode: int) -> str:
 if __name__ == "__main__":
     print(get_zipcode('bordeaux'))
     from pprint import pprint
-    _external_data_test = get_external_data(33000, '2023-11-17', 7)
+    _external_data_test = get_external_data(33000, '2023-11-17', 7, True)
     print('############\n =====> TOP POI LIST <=====\n############')
     pprint(_external_data_test.top_poi_list)
 
@@ -1,270 +1,13 @@
-from dataclasses import asdict
-from neo4j import GraphDatabase, basic_auth
-from navigo.planner.models import POI, Hosting, Restaurant, Trail
-from navigo.settings import NEO4J_URI, NEO4J_USER, NEO4J_PWD
-import logging
 import copy
+import logging
 
+from navigo.planner.models import POI, Hosting, Restaurant, Trail
+from navigo.planner.routing import PlanDistances, day_slots, \
+    parse_day_template, template_day
+from navigo.settings import DAY_TEMPLATE
 
-logger = logging.getLogger(__name__)
-
-
-def clear_nodes(node_type):
-    query = (f"MATCH (n:{node_type}) DETACH DELETE n;")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            session.run(query)
-
-
-def clear_relationships(relationship_type):
-    query = (f"MATCH ()-[r:{relationship_type}]->() DETACH DELETE r;")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            session.run(query)
-
-
-# for testing purpose (eg using __main__)
-def duplicate_nodes():
-    for type in ['restaurant', 'hosting']:
-        queryDuplicate = (
-            f"MATCH (p:{type}) \
-            CREATE (c:{str.capitalize(type)+'2'}) \
-            SET c += properties(p) \
-            SET c.LATITUDE = toFloat(p.LATITUDE) \
-            SET c.LONGITUDE = toFloat(p.LONGITUDE) \
-            SET c.SCORE = 0 \
-            SET c.TYPE = '{type.upper()}'; \
-            ")
-        with GraphDatabase.driver(NEO4J_URI,
-                                  auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                                  ) as driver:
-            with driver.session() as session:
-                session.run(queryDuplicate)
-
-
-# Create nodes for POIs, Restaurants, Hostings, and Trails
-def create_nodes(poi_list, restaurant_list, hosting_list, trail_list):
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            for node in poi_list + restaurant_list + hosting_list + trail_list:
-                # copy of new nodes and labels in upper
-                # to be consistent with neo4j db
-                node_type = node.type+'2'
-                params_node = {key.upper(): asdict(
-                    node)[key] for key in asdict(node).keys()}
-                query = (
-                    f"CREATE (p:{node_type} $params)\
-                    SET p.LATITUDE = toFloat(p.LATITUDE) \
-                    SET p.LONGITUDE = toFloat(p.LONGITUDE) \
-                    ;"
-                )
-                session.run(query, params=params_node)
-
-# Identify a POI among a list with its uuid, return a POI
-
-
-def find_node_by_uuid(poi_list, uuid):
-    res = next((poi for poi in poi_list if poi.uuid == uuid), None)
-
-    if res is not None:
-        return copy.copy(res)
-    else:
-        return None
-
-
-# Find next POI to visit after a previous POI
-def find_next_poi_from_poi(start_uuid):
-
-    queryCreateToNextPOI = (
-        f"MATCH (start:POI2 {{UUID:'{start_uuid}'}}) \
-        MATCH (m:POI2) WHERE m.UUID <> start.UUID \
-            AND m.CLUSTER = start.CLUSTER \
-            AND NOT EXISTS(()-[]->(m)) AND NOT EXISTS((m)-[]->()) \
-        WITH \
-            min(round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: m.LONGITUDE, latitude: m.LATITUDE}}) \
-            ))) as dist_min, start \
-        MATCH (end:POI2) WHERE end.UUID <> start.UUID \
-            AND end.CLUSTER = start.CLUSTER \
-            AND NOT EXISTS(()-[]->(end)) AND NOT EXISTS((end)-[]->()) \
-            AND round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) = dist_min \
-        WITH start, end \
-        ORDER BY dist_min ASC \
-        LIMIT 1 \
-        MERGE (start)-[r:TO_NEXT_POI]->(end) \
-        SET r.DISTANCE=round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) \
-        RETURN end; \
-    ")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            res = session.run(queryCreateToNextPOI).data()
-    res = res[0]['end']
-    return res['UUID']
-
-
-# Find next POI to visit after a restaurant or a hosting
-def find_next_poi_from_other(start_uuid, start_type, cluster=None):
-
-    # when we have to find a POI after a restaurant,
-    # we have to memorize in which cluster the last POI was
-    if cluster is not None:
-        queryCreateToNextPOI = (
-            f"MATCH (start:{start_type} {{UUID:'{start_uuid}'}}) \
-            MATCH (m:POI2) WHERE m.UUID <> start.UUID \
-                AND NOT EXISTS(()-[]->(m)) AND NOT EXISTS((m)-[]->()) \
-                AND m.CLUSTER = {cluster} \
-            WITH \
-                min(round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: m.LONGITUDE, latitude: m.LATITUDE}}) \
-                ))) as dist_min, start \
-            MATCH (end:POI2) WHERE end.UUID <> start.UUID \
-                AND NOT EXISTS(()-[]->(end)) AND NOT EXISTS((end)-[]->()) \
-                AND round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                    )) = dist_min \
-            WITH start, end \
-            ORDER BY dist_min ASC \
-            LIMIT 1 \
-            MERGE (start)-[r:TO_NEXT_POI]->(end) \
-            SET r.DISTANCE=round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                    )) \
-            RETURN end; \
-        ")
-    # when we have to find a POI after a hosting,
-    # there's no need to know the cluster as it will be
-    # a new one (eg a day after)
-    else:
-        queryCreateToNextPOI = (
-            f"MATCH (start:{start_type} {{UUID:'{start_uuid}'}}) \
-            MATCH (m:POI2) WHERE m.UUID <> start.UUID \
-                AND NOT EXISTS(()-[]->(m)) AND NOT EXISTS((m)-[]->()) \
-            WITH \
-                min(round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: m.LONGITUDE, latitude: m.LATITUDE}}) \
-                ))) as dist_min, start \
-            MATCH (end:POI2) WHERE end.UUID <> start.UUID \
-                AND NOT EXISTS(()-[]->(end)) AND NOT EXISTS((end)-[]->()) \
-                AND round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                    )) = dist_min \
-            WITH start, end \
-            ORDER BY dist_min ASC \
-            LIMIT 1 \
-            MERGE (start)-[r:TO_NEXT_POI]->(end) \
-            SET r.DISTANCE=round(point.distance( \
-                    point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                    point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                    )) \
-            RETURN end; \
-        ")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            res = session.run(queryCreateToNextPOI).data()
-    res = res[0]['end']
-    return res['UUID'], res['CLUSTER']
-
-
-# Find next restaurant to have lunch or dinner after POI
-def find_next_restaurant_from_poi(start_uuid, start_type):
-
-    queryCreateToNextRestaurant = (
-        f"MATCH (start:{start_type} {{UUID:'{start_uuid}'}}) \
-        MATCH (end:Restaurant2) \
-        WITH start, end \
-        ORDER BY round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) \
-        LIMIT 1 \
-        MERGE (start)-[r:TO_NEXT_RESTAURANT]->(end) \
-        SET r.DISTANCE=round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) \
-        RETURN end; \
-    ")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            res = session.run(queryCreateToNextRestaurant).data()
-    res = res[0]['end']
-    return res['UUID']
-
-
-# Find next hosting to stay after a restaurant
-def find_next_hosting_from_restaurant(start_uuid, start_type):
-
-    queryCreateToNextHosting = (
-        f"MATCH (start:{start_type} {{UUID:'{start_uuid}'}}) \
-        MATCH (end:Hosting2) \
-        WITH start, end \
-        ORDER BY round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) \
-        LIMIT 1 \
-        MERGE (start)-[r:TO_NEXT_HOSTING]->(end) \
-        SET r.DISTANCE=round(point.distance( \
-                point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}), \
-                point({{longitude: end.LONGITUDE, latitude: end.LATITUDE}}) \
-                )) \
-        RETURN end; \
-    ")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            res = session.run(queryCreateToNextHosting).data()
-    res = res[0]['end']
-    return res['UUID']
-
-
-# Find the number of potential restaurants or hosting in a defined ray
-# They will be later filtered by the best score within this ray
-def find_stop_around_number(start_uuid, start_type, stop_type, ray):
 
-    queryfindNextStopNumber = (
-        f"MATCH (start:{start_type} {{UUID: '{start_uuid}'}}) \
-        MATCH (stop:{stop_type}) \
-        WITH \
-            point({{longitude: start.LONGITUDE, latitude: start.LATITUDE}}) AS startPoint, \
-            point({{longitude: stop.LONGITUDE, latitude: stop.LATITUDE}}) AS stopPoint, \
-            stop.LONGITUDE as stop_lon, stop.LATITUDE as stop_lat, \
-            start, stop \
-        WHERE stop.LONGITUDE=stop_lon and stop.LATITUDE=stop_lat \
-            and round(point.distance(startPoint, stopPoint))<{ray} \
-        RETURN COUNT(stop) AS nb; \
-    ")
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
-                              ) as driver:
-        with driver.session() as session:
-            res = session.run(queryfindNextStopNumber).data()
-    return res[0]['nb']
+logger = logging.getLogger(__name__)
 
 
 # Function to be called in planner/planner.py
@@ -273,186 +16,65 @@ def compute_itinerary(first_poi: POI,
                       selected_restaurants: list[Restaurant],
                       selected_hostings: list[Hosting],
                       selected_trails: list[Trail],
-                      selected_toilets: list[POI] = []):
-
-    # Clear nodes and relationships
-    for relationship_type in ['TO_NEXT_POI', 'TO_NEXT_RESTAURANT',
-                              'TO_NEXT_HOSTING', 'It_TO_NEXT']:
-        clear_relationships(relationship_type)
-    for node_type in ['POI2', 'Restaurant2', 'Hosting2', 'Trail2']:
-        clear_nodes(node_type)
-
-    # Create new nodes in neo4j, temporarly (POI2, restaurant2, hosting2)
-    create_nodes(selected_pois, selected_restaurants,
-                 selected_hostings, selected_trails)
-
-    logger.info(
-        f"number of nodes created = {len(selected_pois)}, \
-            {len(selected_restaurants)}, {len(selected_hostings)}, \
-                {len(selected_trails)}")
-
-    # Number of POI per cluster
+                      selected_toilets: list[POI] = [],
+                      day_template=DAY_TEMPLATE,
+                      distances: PlanDistances = None):
+    """
+    Itinerary of the selected POIs, a day by cluster: the POIs of the cluster
+    fill the POI slots of the day template (see routing.day_slots) and each
+    slot goes to its nearest point from the previous one (nearest POI of the
+    cluster, nearest restaurant, hosting or trail).
+    The next day starts at the nearest POI left from the end of the day.
+    distances are the ones of the plan, computed here if None.
+
+    Returns copies of the points of the itinerary, with their day and rank,
+    and the selected toilets.
+    """
+    template = parse_day_template(day_template)
+    if distances is None:
+        pois = [first_poi] + [p for p in selected_pois
+                              if p.uuid != first_poi.uuid]
+        distances = PlanDistances(pois, selected_restaurants,
+                                  selected_hostings, selected_trails)
+    dist, candidates = distances.matrix, distances.candidates
+    pois = {i: distances.points[i] for i in distances.pois}
+
+    # POIs to visit per cluster
     clusters = {}
-    for poi in selected_pois:
-        try:
-            clusters[poi.cluster] += 1
-        except KeyError:
-            clusters[poi.cluster] = 1
-
-    logger.info(
-        f"number of POIS to visit per cluster = {clusters}")
-
-    # Begin the research of next nearest point (POI, Restaurant or Hosting)
-    res_pois, res_restaurants, res_hostings, res_trails = [], [], [], []
-    day = 1
-    start_poi = first_poi
-    start_poi.day, start_poi.rank = day, 1
-    res_pois.append(start_poi)
-    start_poi_uuid = start_poi.uuid
-    start_poi_cluster = start_poi.cluster
-
-    while len(clusters) > 0:
-        nb_pois_to_visit_in_day = clusters[start_poi_cluster]
-        match nb_pois_to_visit_in_day:
-            case 4:
-                next_poi_to_visit_uuid = find_next_poi_from_poi(start_poi_uuid)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 2
-                res_pois.append(poi)
-
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    next_poi_to_visit_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 3
-                res_restaurants.append(restaurant)
-
-                next_poi_to_visit_uuid, cluster = find_next_poi_from_other(
-                    next_restaurant_uuid, 'Restaurant2', start_poi_cluster)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 4
-                res_pois.append(poi)
-
-                next_poi_to_visit_uuid = find_next_poi_from_poi(
-                    next_poi_to_visit_uuid)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 5
-                res_pois.append(poi)
-
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    next_poi_to_visit_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 6
-                res_restaurants.append(restaurant)
-
-                next_hosting_uuid = find_next_hosting_from_restaurant(
-                    next_restaurant_uuid, "Restaurant2")
-                hosting = find_node_by_uuid(
-                    selected_hostings, next_hosting_uuid)
-                hosting.day, hosting.rank = day, 7
-                res_hostings.append(hosting)
-            case 3:
-                next_poi_to_visit_uuid = find_next_poi_from_poi(start_poi_uuid)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 2
-                res_pois.append(poi)
-
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    next_poi_to_visit_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 3
-                res_restaurants.append(restaurant)
-
-                next_poi_to_visit_uuid, cluster = find_next_poi_from_other(
-                    next_restaurant_uuid, 'Restaurant2', start_poi_cluster)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 4
-                res_pois.append(poi)
-
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    next_poi_to_visit_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 5
-                res_restaurants.append(restaurant)
-
-                next_hosting_uuid = find_next_hosting_from_restaurant(
-                    next_restaurant_uuid, "Restaurant2")
-                hosting = find_node_by_uuid(
-                    selected_hostings, next_hosting_uuid)
-                hosting.day, hosting.rank = day, 6
-                res_hostings.append(hosting)
-            case 2:
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    start_poi_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 2
-                res_restaurants.append(restaurant)
-
-                next_poi_to_visit_uuid, cluster = find_next_poi_from_other(
-                    next_restaurant_uuid, 'Restaurant2', start_poi_cluster)
-                poi = find_node_by_uuid(selected_pois, next_poi_to_visit_uuid)
-                poi.day, poi.rank = day, 3
-                res_pois.append(poi)
-
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    next_poi_to_visit_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 4
-                res_restaurants.append(restaurant)
-
-                next_hosting_uuid = find_next_hosting_from_restaurant(
-                    next_restaurant_uuid, "Restaurant2")
-                hosting = find_node_by_uuid(
-                    selected_hostings, next_hosting_uuid)
-                hosting.day, hosting.rank = day, 5
-                res_hostings.append(hosting)
-            case 1:
-                next_restaurant_uuid = find_next_restaurant_from_poi(
-                    start_poi_uuid, "POI2")
-                restaurant = find_node_by_uuid(
-                    selected_restaurants, next_restaurant_uuid)
-                restaurant.day, restaurant.rank = day, 2
-                res_restaurants.append(restaurant)
-
-                next_hosting_uuid = find_next_hosting_from_restaurant(
-                    next_restaurant_uuid, "Restaurant2")
-                hosting = find_node_by_uuid(
-                    selected_hostings, next_hosting_uuid)
-                hosting.day, hosting.rank = day, 3
-                res_hostings.append(hosting)
-
-        # delete the cluster
-        del clusters[start_poi_cluster]
-        logger.info(
-            f"Calculation done for day {day}")
+    for i, poi in pois.items():
+        clusters.setdefault(poi.cluster, []).append(i)
+    logger.info(f"number of POIS to visit per cluster = "
+                f"{ {c: len(p) for c, p in clusters.items()} }")
+
+    itinerary = []
+    day, start = 1, distances.index(first_poi)
+    while clusters:
+        day_pois = [i for i in clusters.pop(pois[start].cluster)
+                    if i != start]
+        slots = day_slots(template, len(day_pois) + 1, candidates)
+        nodes = [start] + template_day(start, slots[1:], day_pois,
+                                       candidates, dist)
+        for rank, i in enumerate(nodes, start=1):
+            point = copy.copy(distances.points[i])
+            point.day, point.rank = day, rank
+            itinerary.append(point)
+        logger.info(f"Calculation done for day {day}")
 
         # find next POI to visit on day +1
-        if len(clusters) > 0:
+        if clusters:
             day += 1
+            start = min((i for cluster in clusters.values() for i in cluster),
+                        key=lambda i: dist[nodes[-1], i])
 
-            start_poi_uuid, start_poi_cluster = find_next_poi_from_other(
-                next_hosting_uuid, 'Hosting2')
-            poi = find_node_by_uuid(selected_pois, start_poi_uuid)
-            poi.day, poi.rank = day, 1
-            res_pois.append(poi)
-
-    return res_pois + res_restaurants + res_hostings + res_trails, \
-        selected_toilets
+    # POIs first, then restaurants, hostings and trails
+    kinds = (POI, Restaurant, Hosting, Trail)
+    itinerary.sort(key=lambda p: next(
+        k for k, kind in enumerate(kinds) if isinstance(p, kind)))
+    return itinerary, selected_toilets
 
 
 if __name__ == '__main__':
 
-    for relationship_type in ['TO_NEXT_POI', 'TO_NEXT_RESTAURANT',
-                              'TO_NEXT_HOSTING', 'It_TO_NEXT']:
-        clear_relationships(relationship_type)
-    for node_type in ['POI2', 'Restaurant2', 'Hosting2']:
-        clear_nodes(node_type)
-
     # Temp only, to include the list of selected POIs
     selected_pois = [
         POI(longitude='-0.558869', latitude='44.840617',
@@ -558,13 +180,8 @@ if __name__ == '__main__':
     ]
     selected_restaurants, selected_hostings, selected_trails = [], [], []
     first_poi = selected_pois[0]
-
-    # Create new nodes in neo4j, temporarly
-    create_nodes(selected_pois, selected_restaurants,
-                 selected_hostings, selected_trails)
-    duplicate_nodes()
-
-    selected_restaurants, selected_hostings, selected_trails = [], [], []
-    first_poi = selected_pois[0]
-    compute_itinerary(first_poi, selected_pois,
-                      selected_restaurants, selected_hostings, selected_trails)
+    itinerary, _ = compute_itinerary(first_poi, selected_pois,
+                                     selected_restaurants, selected_hostings,
+                                     selected_trails)
+    for point in itinerary:
+        print(point.day, point.rank, point.name)
@@ -1,6 +1,6 @@
 import dash
 from dash import dcc, html, Dash
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
@@ -53,110 +53,156 @@ def calculate_zoom(df):
     return min(zoom_lat, zoom_lon)
 
 
-def get_symbol(point_type, is_first_point, is_last_point):
-    # logger.info('Adding appropriate symbol to data')
-    if is_first_point:
-        return '🚀' 
-    elif is_last_point:
-        return  '🏁'
-    elif point_type == 'POI':
-        return ' 🏛️'
-    elif point_type == 'Restaurant':
-        return '🍽️'
-    elif point_type == 'Hosting':
-        return "🛏️"  
-    else:
-        return "default" 
-    logger.info('Symbols correctly added')
+# symbol of the points by type
+SYMBOLS = {'POI': ' 🏛️', 'Restaurant': '🍽️', 'Hosting': "🛏️"}
 
-    
-def add_points_to_figure(fig, df, filter_type=None):
+COLORS = ['blue', 'green', 'purple', 'orange', 'cyan', 'magenta',
+          'yellow', 'lime', 'pink', 'teal', 'indigo', 'brown', 'olive',
+          'gray', 'violet', 'azure', 'lavender', 'plum', 'gold', 'maroon']
+
+
+def get_symbols(df):
+    """symbol of each point of df, ordered by day and rank"""
+    position = np.arange(len(df))
+    return np.select(
+        [position == len(df) - 1, position == 0],
+        ['🚀', '🏁'],
+        default=df['type'].map(SYMBOLS).fillna('default').to_numpy())
+
+
+def trace_meta(layer, day=None):
+    """
+    meta of a trace, used to show or hide it:
+    layer is 'points', 'start', 'legs', 'labels' or 'WC'
+    """
+    return {'layer': layer, 'day': None if pd.isna(day) else int(day)}
+
+
+def add_points_to_figure(fig, df, filter_type=None, layer='points', visible=True):
+    """add the points of df with one marker trace by type and day"""
     logger.info(f'Adding {len(df)} points to map')
-    
-    for i, point in df.iterrows():
-        #symbol = 'toilet' if filter_type == 'WC' else point['symbol']
-        symbol = point['symbol']
-        poi_text = f"{symbol} {point['name']}"
-        hover_text = f"{symbol}<br>{point['name']}" if filter_type == 'WC' else f"{symbol}<br>{point['name']}<br>Note: {point['notation']}"
-        marker_size = 30 if filter_type == 'WC' else 15
-        
+    if df.empty:
+        return
+
+    poi_text = df['symbol'] + ' ' + df['name'].astype(str)
+    hover_text = df['symbol'] + '<br>' + df['name'].astype(str)
+    if filter_type != 'WC':
+        hover_text = hover_text + '<br>Note: ' + df['notation'].astype(str)
+    marker_size = 30 if filter_type == 'WC' else 15
+
+    groups = df.groupby(['type', 'day', 'colors'], sort=False, dropna=False).groups
+    for (_, day, color), group in groups.items():
         fig.add_trace(go.Scattermapbox(
             mode="markers+text",
-            lon=[point["longitude"]],
-            lat=[point["latitude"]],
-            marker={'size': marker_size, 
-                    'symbol': symbol,
-                    'color': point['colors'], 
+            lon=df.loc[group, "longitude"].to_numpy(),
+            lat=df.loc[group, "latitude"].to_numpy(),
+            marker={'size': marker_size,
+                    'symbol': df.loc[group, 'symbol'].to_numpy(),
+                    'color': color,
                     'opacity': 0.7},
-            text=poi_text,
-            name=point["name"],
+            text=poi_text[group].to_numpy(),
+            name=filter_type or 'points',
             hoverinfo="text",
             textposition="bottom left",
-            hovertext=hover_text,
-            textfont=dict(color=point['colors'])
+            hovertext=hover_text[group].to_numpy(),
+            textfont=dict(color=color),
+            meta=trace_meta(filter_type or layer, day),
+            visible=visible
         ))
-    #logger.info('Points correctly added')
 
 
 def add_lines_between_days(fig, df, selected_day=None):
-    # logger.info('Adding lines to map')
+    """
+    add the legs between consecutive points of df, by day: one line trace
+    (legs are separated by None) and one text trace for their labels,
+    the leg between 2 days belongs to the next day
+    """
     df = df.sort_values(by=['day', 'rank']).reset_index(drop=True)
-    #logger.info(f'Day points: \n{day_points}')
-    
-    if selected_day:
-        day_df = df[df['day'] == selected_day]
-    else:
-        day_df = df
-    
-    for i in range(len(df) - 1):
-        current_point = df.iloc[i]
-        next_point = df.iloc[i + 1]
-        
-        # filter by day
-        if selected_day is not None and current_point['day'] != selected_day:
-            continue
-        
-        # adapt color and text for lines between 2 days
-        if current_point['day'] == next_point['day']:
-            line_color = current_point['colors']
-            line_text = f"Day : {current_point['day']}<br>From {current_point['name']} to {next_point['name']}"
-        else:
-            line_color = next_point['colors']
-            line_text = f"Day : {next_point['day']}<br>From {current_point['name']} to {next_point['name']}"
-        
-         # add specific point in middle of the line to print text   
-        mid_lon = (current_point['longitude'] + next_point['longitude']) / 2
-        mid_lat = (current_point['latitude'] + next_point['latitude']) / 2
+    if len(df) < 2:
+        return
+
+    current, following = df.iloc[:-1].reset_index(drop=True), \
+        df.iloc[1:].reset_index(drop=True)
+    same_day = (current['day'] == following['day']).to_numpy()
+    line_days = np.where(same_day, current['day'], following['day'])
+    # filter by day
+    if selected_day is not None:
+        keep = current['day'].to_numpy() == selected_day
+        current, following = current[keep].reset_index(drop=True), \
+            following[keep].reset_index(drop=True)
+        line_days = line_days[keep]
+
+    line_colors = np.where(line_days == current['day'], current['colors'],
+                           following['colors'])
+    line_texts = 'Day : ' + pd.Series(line_days).astype(str) + '<br>From ' + \
+        current['name'].astype(str) + ' to ' + following['name'].astype(str)
+
+    for day in pd.unique(line_days):
+        legs = np.flatnonzero(line_days == day)
+        color = line_colors[legs[0]]
+
+        # add specific point in middle of the line to print text
         fig.add_trace(go.Scattermapbox(
             mode='text',
-            lon=[mid_lon],
-            lat=[mid_lat],
-            text=line_text,
+            lon=((current['longitude'] + following['longitude']) / 2).to_numpy()[legs],
+            lat=((current['latitude'] + following['latitude']) / 2).to_numpy()[legs],
+            text=line_texts.to_numpy()[legs],
             hoverinfo='text',
-            showlegend=False
+            showlegend=False,
+            meta=trace_meta('labels', day)
         ))
-        # logger.info('Middle line point added')
-                           
-        # trace lines                        
+
+        # trace lines, legs separated by None
+        lon = np.full(len(legs) * 3, None, dtype=object)
+        lat = np.full(len(legs) * 3, None, dtype=object)
+        lon[0::3] = current['longitude'].to_numpy()[legs]
+        lon[1::3] = following['longitude'].to_numpy()[legs]
+        lat[0::3] = current['latitude'].to_numpy()[legs]
+        lat[1::3] = following['latitude'].to_numpy()[legs]
         fig.add_trace(go.Scattermapbox(
             mode='lines',
-            lon=[current_point['longitude'], next_point['longitude']],
-            lat=[current_point['latitude'], next_point['latitude']],
-            line=dict(color=line_color, width=2),
-            text=[],
-            hoverinfo='none',
-            showlegend=False            
+            lon=lon,
+            lat=lat,
+            line=dict(color=color, width=2),
+            showlegend=False,
+            meta=trace_meta('legs', day)
         ))
-        # logger.info(f"Line {current_point['name']} successfully updated")
-              
 
-def create_figure(df):
+
+def get_day_starts(df):
+    """
+    last point of each day but the last one, as the start of the next
+    day (with the color of the next day)
+    """
+    df = df.sort_values(by=['day', 'rank'])
+    last_points = df.drop_duplicates(subset='day', keep='last').iloc[:-1]
+    next_day_colors = df.drop_duplicates(subset='day')['colors'].iloc[1:]
+    return last_points.assign(day=last_points['day'] + 1,
+                              colors=next_day_colors.to_numpy())\
+        .reset_index(drop=True)
+
+
+def get_day_views(df):
+    """center and zoom of the map for all days and for each day, by day"""
+    views = {'all': [*center_coordinates(df), calculate_zoom(df)]}
+    day_starts = get_day_starts(df)
+    for day in df['day'].unique():
+        day_df = pd.concat([df[df['day'] == day],
+                            day_starts[day_starts['day'] == day]])
+        views[str(day)] = [*center_coordinates(day_df), calculate_zoom(day_df)]
+    return views
+
+
+def create_figure(df, df_toilets=None):
     '''
     Function that creates a Plotly figure for visualizing trip data on a map.
     For each day of the trip, put points on the map, then trace the lines.
+    The start of each day and the toilets are added hidden, to be shown
+    by the callback of the map (see UPDATE_MAP_JS).
 
     Parameters:
         df (pd.DataFrame): The DataFrame containing trip data.
+        df_toilets (pd.DataFrame): The DataFrame containing toilets data.
 
     Returns:
         go.Figure: The Plotly figure for the trip visualization.
@@ -168,6 +214,9 @@ def create_figure(df):
     # adding oblects to map
     add_lines_between_days(fig, df)
     add_points_to_figure(fig, df)
+    add_points_to_figure(fig, get_day_starts(df), layer='start', visible=False)
+    if df_toilets is not None:
+        add_points_to_figure(fig, df_toilets, filter_type='WC', visible=False)
     
     center_lat, center_lon = center_coordinates(df)
     zoom = calculate_zoom(df)
@@ -186,7 +235,33 @@ def create_figure(df):
     return fig
 
 
-def create_dash_app(geospatial_point_list: list, selected_toilets: list = []) -> dash.Dash:
+# visibility of the traces of a figure made by create_figure (see the meta
+# of its traces) for a day (or all) and the toilets, with the center and
+# zoom of the day, computed in the browser
+UPDATE_MAP_JS = """
+function(selectedDay, includeToilets, figure, views) {
+    const day = String(selectedDay);
+    const withToilets = Boolean(includeToilets && includeToilets.length);
+    const data = figure.data.map(trace => {
+        let visible;
+        if (trace.meta.layer === 'WC') {
+            visible = withToilets;
+        } else if (day === 'all') {
+            visible = trace.meta.layer !== 'start';
+        } else {
+            visible = String(trace.meta.day) === day;
+        }
+        return {...trace, visible: visible};
+    });
+    const [lat, lon, zoom] = views[day];
+    const mapbox = {...figure.layout.mapbox, center: {lon: lon, lat: lat}, zoom: zoom};
+    return {...figure, data: data, layout: {...figure.layout, mapbox: mapbox}};
+}
+"""
+
+
+def create_dash_app(geospatial_point_list: list, selected_toilets: list = [],
+                    requests_pathname_prefix: str = '/dash/') -> dash.Dash:
     '''
     Creates a Dash web application layout.
 
@@ -194,22 +269,26 @@ def create_dash_app(geospatial_point_list: list, selected_toilets: list = []) ->
         df (pd.DataFrame): The DataFrame containing trip data.
         fig (go.Figure): The Plotly figure for trip visualization.
         token (str): The Mapbox access token.
+        requests_pathname_prefix (str): The path the app is served at.
 
     Returns:
         dash.Dash: The Dash web application.
     '''
     logger.info('Creating App')
     df = preprocess_geospatial_data(geospatial_point_list)
-    with pd.option_context('display.max_rows', None, 'display.max_columns', None,'display.width', 1000):
-        msg = f'Data for the Trip :\n {df}'
-        logger.info(msg)
-
     df_toilets = get_toilets_data(selected_toilets)
-    logger.info(f'Toilets data\n{df_toilets}')
+    # printing the whole frames is slow for large plans
+    if logger.isEnabledFor(logging.DEBUG):
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None,'display.width', 1000):
+            logger.debug(f'Data for the Trip :\n {df}')
+            logger.debug(f'Toilets data\n{df_toilets}')
     
-    fig = create_figure(df)
+    # the figure is built once with all days and toilets and sent with the
+    # views to the browser, that switches visibility of its traces
+    fig = create_figure(df, df_toilets)
+    views = get_day_views(df)
     
-    app = Dash(__name__, requests_pathname_prefix='/dash/')
+    app = Dash(__name__, requests_pathname_prefix=requests_pathname_prefix)
     app.layout = html.Div([
         dcc.Dropdown(
             id='day-dropdown',
@@ -227,83 +306,50 @@ def create_dash_app(geospatial_point_list: list, selected_toilets: list = []) ->
                 value=False, # checklist not visible
             ),
         ], id='include-toilets-div', style={'width': '48%', 'display': 'inline-block'}),
+        dcc.Store(id='map-views', data=views),
         dcc.Graph(figure=fig, style={'height': '100vh'}, id='map-fig')
     ])
     
-    @app.callback(
+    # map is updated in the browser, without any request to the server
+    app.clientside_callback(
+        UPDATE_MAP_JS,
         Output('map-fig', 'figure'),
         [Input('day-dropdown', 'value'),
-        Input('include-toilets-checkbox', 'value')]
+        Input('include-toilets-checkbox', 'value')],
+        [State('map-fig', 'figure'),
+        State('map-views', 'data')],
+        prevent_initial_call=True
     )
     
-    def update_map(selected_day, include_toilets=False):
-        logger.info(f'Updating map')
-        if selected_day == 'all':
-            filtered_df = df.copy()
-        else:
-            filtered_df = df[df['day'] == int(selected_day)].reset_index(drop=True)
-            if selected_day != '1':
-                logger.info(f'Adding last day point do df')
-                previous_day_last_point = df[(df['day'] == selected_day - 1) & (df['rank'] == df[df['day'] == selected_day - 1]['rank'].max())]
-                
-            if not previous_day_last_point.empty:
-                filtered_df = pd.concat([filtered_df, previous_day_last_point], ignore_index=True)
-                day_color = filtered_df['colors'].iloc[0] # added line in loc|-1]
-                filtered_df.loc[filtered_df.index[-1], 'colors'] = day_color
-                filtered_df
-                logger.info(f'Updating color for last day to {day_color}')
-                
-        logger.info(f"Data :\n {filtered_df}")
-                
-        new_fig = create_figure(filtered_df)
-        
-        if include_toilets:
-            add_points_to_figure(new_fig, df_toilets, filter_type='WC')
-        
-            
-        return new_fig
-    
     logger.info('App successfully created')
     return app
 
 
 def get_toilets_data(selected_toilets):
-    wc_dict = {
-        'longitude': [wc.longitude for wc in selected_toilets],
-        'latitude': [wc.latitude for wc in selected_toilets],
-        'city': [wc.city for wc in selected_toilets],
-        'city_code': [wc.city_code for wc in selected_toilets],
-        'type': ['WC' for wc in selected_toilets],
-        'name': [wc.name for wc in selected_toilets],
-        'colors': ['red' for wc in selected_toilets],
-        'day': [wc.day for wc in selected_toilets],
-        'symbol': ['toilet' for wc in selected_toilets]
-    }
-
-    toilets_df = pd.DataFrame(wc_dict)
-    
+    toilets_df = pd.DataFrame.from_records(
+        [(wc.longitude, wc.latitude, wc.city, wc.city_code, 'WC', wc.name,
+          'red', wc.day, 'toilet') for wc in selected_toilets],
+        columns=['longitude', 'latitude', 'city', 'city_code', 'type',
+                 'name', 'colors', 'day', 'symbol'])
+
     return toilets_df
 
 
 def preprocess_geospatial_data(geospatial_point_list):
     logger.info('Preprocessing data')
-    df = pd.DataFrame(geospatial_point_list)\
+    # fields of the points, without the deep copy of dataclasses.asdict
+    df = pd.DataFrame.from_records([vars(p) for p in geospatial_point_list])\
         .sort_values(by=['day', 'rank'])\
         .drop_duplicates(subset=["day", "rank"])\
         .drop(['uuid', 'cluster'], axis=1)\
         .reset_index(drop=True)
 
-    colors = ['blue', 'green', 'purple', 'orange', 'cyan', 'magenta',
-              'yellow', 'lime', 'pink', 'teal', 'indigo', 'brown', 'olive',
-              'gray', 'violet', 'azure', 'lavender', 'plum', 'gold', 'maroon']
-   
     df['latitude'] = df['latitude'].astype(float)
     df['longitude'] = df['longitude'].astype(float)
-    df['colors'] = df['day'].map(lambda x: colors[x - 1])
-    df['symbol'] = df.apply(lambda row: get_symbol(row['type'], row.name == df.index[-1], row.name == 0), axis=1)
+    df['colors'] = np.asarray(COLORS)[df['day'].to_numpy(dtype=int) - 1]
+    df['symbol'] = get_symbols(df)
     df['normalized_score'] = ((df['score'] / df['score'].max())*5).round(2)
     df['step'] = df['day'].astype(str) + '.' + df['rank'].astype(str)
     
     logger.info('Preprocessing done')
     return df
-
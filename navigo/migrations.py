@@ -0,0 +1,144 @@
+# migration adding coordinates to the MariaDB tables of points
+#
+# adds LATITUDE, LONGITUDE and LOCATION (POINT x=longitude y=latitude)
+# columns, backfills them from neo4j and creates a spatial index (LOCATION
+# is then kept in sync with the coordinates by triggers), so that
+# points can be queried by distance (MARIADB_SPATIAL_QUERIES setting)
+# without any neo4j lookup:
+#   python -m navigo.migrations
+
+import logging
+
+from neo4j import GraphDatabase, basic_auth
+from sqlalchemy import text
+
+from navigo.db import get_engine
+from navigo.settings import NEO4J_URI, NEO4J_USER, NEO4J_PWD, \
+    MARIADB_POI_TABLE, MARIADB_TRAIL_TABLE, MARIADB_RESTAURANT_TABLE, \
+    MARIADB_HOSTING_TABLE, MARIADB_WC_TABLE
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# MariaDB table => neo4j label of its nodes (None: any label)
+GEO_TABLES = {
+    MARIADB_POI_TABLE: None,
+    MARIADB_TRAIL_TABLE: None,
+    MARIADB_RESTAURANT_TABLE: 'restaurant',
+    MARIADB_HOSTING_TABLE: 'hosting',
+    MARIADB_WC_TABLE: 'wc',
+}
+
+
+def add_geo_columns(con, table: str):
+    con.execute(text(
+        f"""
+        ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS LATITUDE DOUBLE DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS LONGITUDE DOUBLE DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS LOCATION POINT DEFAULT NULL
+        """
+    ))
+
+
+def fetch_neo4j_coordinates(session, uuids: list, label: str = None) -> list:
+    query = (
+        f"MATCH (n{':' + label if label else ''}) WHERE n.UUID IN $uuids "
+        "RETURN n.UUID AS uuid, toFloat(n.LATITUDE) AS latitude, "
+        "toFloat(n.LONGITUDE) AS longitude"
+    )
+    return [
+        row for row in session.run(query, uuids=uuids).data()
+        if row['latitude'] is not None and row['longitude'] is not None
+    ]
+
+
+def backfill_coordinates(table: str, label: str = None) -> int:
+    """copy coordinates of neo4j nodes into the MariaDB table,
+    returns the number of updated rows"""
+    engine = get_engine()
+    nb_updated = 0
+    last_uuid = ''
+    with GraphDatabase.driver(NEO4J_URI,
+                              auth=basic_auth(NEO4J_USER, NEO4J_PWD)
+                              ) as driver:
+        with driver.session() as session:
+            while True:
+                with engine.begin() as con:
+                    uuids = con.execute(text(
+                        f"""
+                        SELECT UUID FROM {table}
+                        WHERE LATITUDE IS NULL AND UUID > :last_uuid
+                        ORDER BY UUID LIMIT :limit
+                        """
+                    ), {"last_uuid": last_uuid,
+                        "limit": BACKFILL_BATCH_SIZE}).scalars().all()
+                    if not uuids:
+                        break
+                    last_uuid = uuids[-1]
+
+                    rows = fetch_neo4j_coordinates(session, uuids, label)
+                    if rows:
+                        con.execute(text(
+                            f"""
+                            UPDATE {table}
+                            SET LATITUDE = :latitude, LONGITUDE = :longitude
+                            WHERE UUID = :uuid
+                            """
+                        ), rows)
+                    nb_updated += len(rows)
+                logger.info(f"{table}: {nb_updated} coordinates backfilled")
+    return nb_updated
+
+
+def create_spatial_index(con, table: str):
+    # points without coordinates are located at (0, 0), far from any
+    # zone, as a spatial index needs a NOT NULL geometry
+    con.execute(text(
+        f"""
+        UPDATE {table}
+        SET LOCATION = POINT(IFNULL(LONGITUDE, 0), IFNULL(LATITUDE, 0))
+        """
+    ))
+    con.execute(text(
+        f"ALTER TABLE {table} MODIFY LOCATION POINT NOT NULL"
+    ))
+    create_location_triggers(con, table)
+    con.execute(text(
+        f"""
+        CREATE SPATIAL INDEX IF NOT EXISTS idx_{table}_LOCATION
+        ON {table} (LOCATION)
+        """
+    ))
+
+
+def create_location_triggers(con, table: str):
+    """keep LOCATION in sync with LATITUDE and LONGITUDE on the rows
+    inserted or updated after the migration (inserts do not have to
+    supply LOCATION, the triggers run before the NOT NULL check)"""
+    for event in ('INSERT', 'UPDATE'):
+        con.execute(text(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_LOCATION_{event}
+            BEFORE {event} ON {table} FOR EACH ROW
+            SET NEW.LOCATION = POINT(IFNULL(NEW.LONGITUDE, 0),
+                                     IFNULL(NEW.LATITUDE, 0))
+            """
+        ))
+
+
+def migrate():
+    for table, label in GEO_TABLES.items():
+        logger.info(f"adding coordinates to table {table}")
+        with get_engine().begin() as con:
+            add_geo_columns(con, table)
+        backfill_coordinates(table, label)
+        with get_engine().begin() as con:
+            create_spatial_index(con, table)
+    logger.info("migration done, set MARIADB_SPATIAL_QUERIES=true to "
+                "query points by distance")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,9 +1,10 @@
 from dataclasses import dataclass, field
 from pymongo import MongoClient
 from neo4j import GraphDatabase
+from sqlalchemy import inspect
 from navigo.settings import MONGODB_URI, MONGODB_DB, MONGODB_POI_COLLECTION, \
     NEO4J_URI, NEO4J_USER, NEO4J_PWD
-from navigo.planner.models_DB_ORM import Poi
+from navigo.planner.models_DB_ORM import Base, Poi
 from typing import List
 
 
@@ -61,6 +62,47 @@ class POI(GeospatialPoint):
                    self.uuid, self.cluster, self.type_list, self.theme_list)
 
 
+def get_db_raw_coordinates(db_raw) -> tuple[float, float] | None:
+    """
+    return (latitude, longitude) stored in a MariaDB row (ORM object or
+    mapping), or None if the row has not been loaded with coordinates
+    (in that case, coordinates have to be fetched from neo4j)
+    """
+    if isinstance(db_raw, Base):
+        if 'LATITUDE' in inspect(db_raw).unloaded:
+            return None
+        latitude, longitude = db_raw.LATITUDE, db_raw.LONGITUDE
+    else:
+        latitude = db_raw.get('LATITUDE')
+        longitude = db_raw.get('LONGITUDE')
+    if latitude is None or longitude is None:
+        return None
+    return latitude, longitude
+
+
+def get_neo4j_coordinates(uuid: str, label: str = None) \
+        -> tuple[float, float] | None:
+    """return (latitude, longitude) of a node from neo4j"""
+    with GraphDatabase.driver(NEO4J_URI,
+                              auth=(NEO4J_USER, NEO4J_PWD)) as driver:
+        with driver.session() as session:
+            query = (
+                f"MATCH (n{':' + label if label else ''}) "
+                "WHERE n.UUID = $uuid RETURN n"
+            )
+            result = session.run(query, uuid=uuid).data()
+    if result:
+        return result[0]['n']['LATITUDE'], result[0]['n']['LONGITUDE']
+    return None
+
+
+def get_coordinates(db_raw, uuid: str, label: str = None) \
+        -> tuple[float, float] | None:
+    """coordinates of the row if loaded from MariaDB, else from neo4j"""
+    return get_db_raw_coordinates(db_raw) or \
+        get_neo4j_coordinates(uuid, label)
+
+
 def db_raw_to_poi(db_raw: Poi) -> POI:
     # connect to mongodb
     collection = MongoClient(MONGODB_URI)[
@@ -68,15 +110,8 @@ def db_raw_to_poi(db_raw: Poi) -> POI:
 
     document = collection.find_one({'UUID': db_raw.UUID})
     if document:
-        # connect to neo4j
-        with GraphDatabase.driver(NEO4J_URI,
-                                  auth=(NEO4J_USER, NEO4J_PWD)) as driver:
-            with driver.session() as session:
-                query = (
-                    f"MATCH (n) WHERE n.UUID = '{db_raw.UUID}' RETURN n"
-                )
-                result = session.run(query).data()
-        if result:
+        coordinates = get_coordinates(db_raw, db_raw.UUID)
+        if coordinates:
             # add list of poi types and list of poi themes
             # (it can be several types)
             type_list, theme_list = [], []
@@ -90,8 +125,8 @@ def db_raw_to_poi(db_raw: Poi) -> POI:
                 city=db_raw.CITY,
                 city_code=db_raw.POSTAL_CODE,
                 uuid=db_raw.UUID,
-                latitude=result[0]['n']['LATITUDE'],
-                longitude=result[0]['n']['LONGITUDE'],
+                latitude=coordinates[0],
+                longitude=coordinates[1],
                 type_list=type_list,
                 theme_list=theme_list
             )
@@ -109,18 +144,11 @@ class Restaurant(GeospatialPoint):
 
 
 def db_raw_to_restaurant(db_raw: dict) -> Restaurant:
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=(NEO4J_USER, NEO4J_PWD)) as driver:
-        with driver.session() as session:
-            query = (
-                f"MATCH (n:restaurant) WHERE n.UUID = '{db_raw.UUID}' RETURN n"
-            )
-            result = session.run(query).data()
-    if result:
-        # print(f"neo4j result for rest ({db_raw.UUID}) = {result}")
+    coordinates = get_coordinates(db_raw, db_raw['UUID'], 'restaurant')
+    if coordinates:
         return Restaurant(
-            latitude=result[0]['n']['LATITUDE'],
-            longitude=result[0]['n']['LONGITUDE'],
+            latitude=coordinates[0],
+            longitude=coordinates[1],
             uuid=db_raw['UUID'],
             name=db_raw['NAME'],
             city=db_raw['CITY'],
@@ -141,18 +169,11 @@ class Hosting(GeospatialPoint):
 
 
 def db_raw_to_hosting(db_raw: dict) -> Hosting:
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=(NEO4J_USER, NEO4J_PWD)) as driver:
-        with driver.session() as session:
-            query = (
-                f"MATCH (n:hosting) WHERE n.UUID = '{db_raw.UUID}' RETURN n"
-            )
-            result = session.run(query).data()
-    if result:
-        # print(f"neo4j result for hosting ({db_raw.UUID}) = {result}")
+    coordinates = get_coordinates(db_raw, db_raw['UUID'], 'hosting')
+    if coordinates:
         return Hosting(
-            latitude=result[0]['n']['LATITUDE'],
-            longitude=result[0]['n']['LONGITUDE'],
+            latitude=coordinates[0],
+            longitude=coordinates[1],
             uuid=db_raw['UUID'],
             name=db_raw['NAME'],
             city=db_raw['CITY'],
@@ -179,23 +200,15 @@ def db_raw_to_trail(db_raw: dict) -> Trail:
 
     document = collection.find_one({'UUID': db_raw.UUID})
     if document:
-        # connect to neo4j
-        with GraphDatabase.driver(NEO4J_URI,
-                                  auth=(NEO4J_USER, NEO4J_PWD)) as driver:
-            with driver.session() as session:
-                query = (
-                    f"MATCH (n) WHERE n.UUID = '{db_raw.UUID}' RETURN n"
-                )
-                result = session.run(query).data()
-                # print(f"neo4j result for poi.id ({db_raw.id}) = {result}")
-        if result:
+        coordinates = get_coordinates(db_raw, db_raw.UUID)
+        if coordinates:
             return Trail(
                 name=document['LABEL']['fr'],
                 city=db_raw.CITY,
                 city_code=db_raw.POSTAL_CODE,
                 uuid=db_raw.UUID,
-                latitude=result[0]['n']['LATITUDE'],
-                longitude=result[0]['n']['LONGITUDE'],
+                latitude=coordinates[0],
+                longitude=coordinates[1],
             )
 
 
@@ -212,18 +225,12 @@ class WC(GeospatialPoint):
 
 
 def db_raw_to_wc(db_raw: dict) -> WC:
-    with GraphDatabase.driver(NEO4J_URI,
-                              auth=(NEO4J_USER, NEO4J_PWD)) as driver:
-        with driver.session() as session:
-            query = (
-                f"MATCH (n:wc) WHERE n.UUID = '{db_raw.UUID}' RETURN n"
-            )
-            result = session.run(query).data()
-    if result:
-        # print(f"neo4j result for wc ({db_raw.UUID}) = {result}")
+    coordinates = get_coordinates(db_raw, db_raw['UUID'], 'wc')
+    if coordinates:
         return WC(
-            latitude=result[0]['n']['LATITUDE'],
-            longitude=result[0]['n']['LONGITUDE'],
+            latitude=coordinates[0],
+            longitude=coordinates[1],
+            uuid=db_raw['UUID'],
             name=db_raw['NAME'],
             city=db_raw['CITY'],
             city_code=db_raw['POSTAL_CODE'],
@@ -244,6 +251,8 @@ class UserData:
     # means_of_transport: str = "by foot"
     sensitivity_to_weather: bool = True
     days_on_hiking: float = 0
+    # slots of each day (see routing.parse_day_template), DAY_TEMPLATE if None
+    day_template: list[str] | None = None
 
 
 @dataclass
@@ -252,6 +261,13 @@ class ExternalData:
     weather_forecast: bool
     top_poi_list: list[POI]
     top_restaurant_list: list[Restaurant]
+    # names of the sources which could not be fetched in time
+    # (weather_forecast, top_poi_list, top_restaurant_list)
+    missing: list[str] = field(default_factory=list)
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.missing
 
 
 @dataclass
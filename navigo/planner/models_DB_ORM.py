@@ -1,7 +1,9 @@
 from typing import List
 from sqlalchemy import ForeignKey, String, Column, Table, Integer, \
-    Boolean, Float
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+    Boolean, Float, Double, Index
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, \
+    relationship, deferred
+from sqlalchemy.types import UserDefinedType
 import uuid
 
 
@@ -9,6 +11,30 @@ class Base(DeclarativeBase):
     pass
 
 
+class Point(UserDefinedType):
+    """MariaDB POINT geometry (x = longitude, y = latitude)"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "POINT"
+
+
+# coordinates columns are filled from neo4j by navigo.migrations,
+# they are deferred so that databases which have not been migrated yet
+# can still be queried (see MARIADB_SPATIAL_QUERIES setting)
+def latitude_column():
+    return deferred(Column(Double, default=None))
+
+
+def longitude_column():
+    return deferred(Column(Double, default=None))
+
+
+def location_column():
+    # a spatial index requires a NOT NULL geometry
+    return deferred(Column(Point, nullable=False))
+
+
 association_TourType_Trail = Table(
     "association_TourType_Trail",
     Base.metadata,
@@ -181,6 +207,10 @@ class TrailViz(Base):
 
 class Trail(Base):
     __tablename__ = "TRAIL"
+    __table_args__ = (
+        Index('idx_TRAIL_LOCATION', 'LOCATION', mysql_prefix='SPATIAL',
+              mariadb_prefix='SPATIAL'),
+    )
     UUID: Mapped[str] = mapped_column(
         String(36),
         primary_key=True,
@@ -213,6 +243,9 @@ class Trail(Base):
     POSTAL_CODE: Mapped[int] = Column(Integer, index=True)
     POSTAL_ADDRESS: Mapped[str] = Column(String(255))
     LAST_UPDATE: Mapped[str] = Column(String(12))
+    LATITUDE: Mapped[float] = latitude_column()
+    LONGITUDE: Mapped[float] = longitude_column()
+    LOCATION: Mapped[str] = location_column()
 
     def __repr__(self) -> str:
         return f"Trail(UUID={self.UUID!r},\
@@ -310,6 +343,10 @@ class PoiTheme(Base):
 
 class Poi(Base):
     __tablename__ = "POI"
+    __table_args__ = (
+        Index('idx_POI_LOCATION', 'LOCATION', mysql_prefix='SPATIAL',
+              mariadb_prefix='SPATIAL'),
+    )
     UUID: Mapped[str] = Column(
         String(36),
         primary_key=True,
@@ -336,6 +373,9 @@ class Poi(Base):
         back_populates='POIS')
     DATATOURISME_ID: Mapped[str] = Column(String(255), index=True, unique=True)
     LAST_UPDATE: Mapped[str] = Column(String(12))
+    LATITUDE: Mapped[float] = latitude_column()
+    LONGITUDE: Mapped[float] = longitude_column()
+    LOCATION: Mapped[str] = location_column()
 
     def __repr__(self) -> str:
         return f"Poi(UUID={self.UUID!r}, \
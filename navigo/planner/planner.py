@@ -1,18 +1,34 @@
-from navigo.db import get_db_internal_nodes_data_by_zone
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from navigo.db import get_db_internal_nodes_data_by_zone, \
+    get_wc_along_itinerary
 from navigo.external import get_external_data
 from navigo.itinerary import compute_itinerary
 from navigo.planner.models import UserData, InternalNodesData, ExternalData
 from navigo.planner.scorer import compute_score
 from navigo.planner.clustering import clustering_by_days
-import logging
+from navigo.planner.routing import PlanDistances, optimise_itinerary, \
+    parse_day_template
+from navigo.settings import DAY_TEMPLATE, PLANNING_PROCESSES
+from navigo.walking import get_zone_walking_graph
 
 logger = logging.getLogger(__name__)
 
+# radius (in km) of the first search of points around the trip zone
+rayon = 10
 
-def _plan_trip(_user_input: UserData,
-               internal_nodes_data: InternalNodesData,
-               _external_data: ExternalData):
 
+def select_trip_points(_user_input: UserData,
+                       internal_nodes_data: InternalNodesData,
+                       _external_data: ExternalData) -> tuple:
+    """
+    Scores, clusters by day and selects the points of a trip, returns the
+    arguments of compute_itinerary. Nodes of internal_nodes_data are
+    updated (score, cluster).
+    """
     logger.info("start planning trip")
     # Step 3: Scoring nodes based on user criteria
     for node in internal_nodes_data.get_all_nodes():
@@ -29,7 +45,8 @@ def _plan_trip(_user_input: UserData,
     logger.info("clustering done")
 
     # Step 4: Compute the maximum points that can be visited
-    max_points_by_day = 4
+    max_points_by_day = parse_day_template(
+        _user_input.day_template or DAY_TEMPLATE).count('POI')
     # max_restaurants = 2 * _user_input.trip_duration
     # max_hostings = 1 * _user_input.trip_duration
     # max_trails = 2 * _user_input.trip_duration
@@ -47,6 +64,38 @@ def _plan_trip(_user_input: UserData,
         selected_hosting, selected_trail, \
         selected_toilets = internal_nodes_data.get_sorted_points()
 
+    return first_poi, selected_poi, selected_restaurant, selected_hosting, \
+        selected_trail, selected_toilets
+
+
+def plan_trip_itinerary(_user_input: UserData,
+                        internal_nodes_data: InternalNodesData,
+                        _external_data: ExternalData) -> list:
+    """itinerary of a trip following the day template of the user, with
+    the route of each day optimised"""
+    selected_points = select_trip_points(_user_input, internal_nodes_data,
+                                         _external_data)
+    _, selected_poi, selected_restaurant, selected_hosting, selected_trail, \
+        _ = selected_points
+    day_template = _user_input.day_template or DAY_TEMPLATE
+    # distances between the selected points, shared by the steps below
+    distances = PlanDistances(
+        selected_poi, selected_restaurant, selected_hosting, selected_trail,
+        get_zone_walking_graph(_user_input.trip_zone))
+    itinerary, _ = compute_itinerary(*selected_points,
+                                     day_template=day_template,
+                                     distances=distances)
+    itinerary, day_km = optimise_itinerary(
+        itinerary, selected_restaurant, selected_hosting, selected_trail,
+        day_template, distances)
+    logger.info(f"distance by day (km): {day_km}")
+    return itinerary
+
+
+def _plan_trip(_user_input: UserData,
+               internal_nodes_data: InternalNodesData,
+               _external_data: ExternalData):
+
     # Step 6: compute itinary for each days
     # itinerary, selected_toilets = compute_itinerary(
     #     first_poi, selected_poi,
@@ -55,24 +104,20 @@ def _plan_trip(_user_input: UserData,
     #     selected_trail[:max_trails],
     #     selected_toilets
     #     )
-    itinerary, selected_toilets = compute_itinerary(
-        first_poi, selected_poi,
-        selected_restaurant,
-        selected_hosting,
-        selected_trail,
-        selected_toilets
-    )
+    itinerary = plan_trip_itinerary(_user_input, internal_nodes_data,
+                                    _external_data)
     # after this step, itinerary is composed of POI, Restaurants, Hostings,
     # Trails List where day and rank are used to map by day, as the order rank)
 
-    return itinerary, selected_toilets
+    return itinerary, get_wc_along_itinerary(itinerary)
 
 
 def plan_trip(_user_input: UserData):
 
-    rayon = 10
     internal_nodes_data = get_db_internal_nodes_data_by_zone(
-        _user_input.trip_zone, rayon, _user_input.trip_duration)
+        _user_input.trip_zone, rayon, _user_input.trip_duration,
+        _user_input.favorite_restaurant_categories,
+        _user_input.favorite_hosting_categories)
 
     # Step 2: Fetch needed external Data
     _external_data = get_external_data(
@@ -84,6 +129,100 @@ def plan_trip(_user_input: UserData):
     return _plan_trip(_user_input, internal_nodes_data, _external_data)
 
 
+@lru_cache(maxsize=1)
+def get_planning_pool() -> ProcessPoolExecutor:
+    """pool of processes shared by batches of trips"""
+    return ProcessPoolExecutor(max_workers=PLANNING_PROCESSES or None)
+
+
+def reset_planning_pool(pool: ProcessPoolExecutor):
+    """drops a broken pool (eg a process killed), the next call of
+    get_planning_pool creates a new one"""
+    logger.error("planning pool is broken, it will be recreated")
+    pool.shutdown(wait=False, cancel_futures=True)
+    get_planning_pool.cache_clear()
+
+
+def merge_favorites(lists) -> list:
+    """favorites of several users, in order of first appearance"""
+    return list(dict.fromkeys(f for favorites in lists
+                              for f in favorites or []))
+
+
+def plan_trips(user_inputs: list[UserData]) -> list:
+    """
+    Plans a batch of trips. Trips of a same zone share the fetch of their
+    candidate points and, when their dates and weather sensitivity are the
+    same, their external data. Scoring, clustering, selection and routing
+    of the trips run in a pool of processes.
+
+    Returns, for each trip, its (itinerary, selected_toilets) or the
+    exception raised while planning it.
+    """
+    results = [None] * len(user_inputs)
+    by_zone = {}
+    for index, user_input in enumerate(user_inputs):
+        by_zone.setdefault(user_input.trip_zone, []).append(index)
+
+    jobs = {}
+    external_data = {}
+    pool = get_planning_pool()
+    for zone, indexes in by_zone.items():
+        group = [user_inputs[i] for i in indexes]
+        try:
+            # candidates of the longest trip, favorites of the whole group
+            # are fetched first
+            internal_nodes_data = get_db_internal_nodes_data_by_zone(
+                zone, rayon, max(u.trip_duration for u in group),
+                merge_favorites(u.favorite_restaurant_categories
+                                for u in group),
+                merge_favorites(u.favorite_hosting_categories
+                                for u in group))
+        except Exception as e:
+            logger.error(f"error while fetching points of zone {zone}: {e}")
+            for i in indexes:
+                results[i] = e
+            continue
+        logger.info(f"planning {len(indexes)} trips in zone {zone}")
+
+        for i in indexes:
+            user_input = user_inputs[i]
+            key = (zone, user_input.trip_start, user_input.trip_duration,
+                   user_input.sensitivity_to_weather)
+            if key not in external_data:
+                try:
+                    external_data[key] = get_external_data(*key)
+                except Exception as e:
+                    logger.error(f"error while fetching external data "
+                                 f"{key}: {e}")
+                    external_data[key] = e
+            if isinstance(external_data[key], Exception):
+                results[i] = external_data[key]
+                continue
+            # each process gets its own copy of the points
+            args = (plan_trip_itinerary, user_input, internal_nodes_data,
+                    external_data[key])
+            try:
+                jobs[i] = pool.submit(*args)
+            except BrokenProcessPool:
+                reset_planning_pool(pool)
+                pool = get_planning_pool()
+                jobs[i] = pool.submit(*args)
+
+    broken = False
+    for i, job in jobs.items():
+        try:
+            itinerary = job.result()
+            results[i] = itinerary, get_wc_along_itinerary(itinerary)
+        except Exception as e:
+            logger.error(f"error while planning trip {i}: {e}")
+            results[i] = e
+            broken = broken or isinstance(e, BrokenProcessPool)
+    if broken:
+        reset_planning_pool(pool)
+    return results
+
+
 # Usage example with custom weights:
 
 if __name__ == "__main__":
@@ -0,0 +1,485 @@
+import copy
+import itertools
+import logging
+import math
+
+import numpy as np
+
+from navigo.communes import haversine_km
+from navigo.planner.models import POI, Restaurant, Hosting, Trail
+from navigo.settings import DAY_TEMPLATE, HOSTING_CHANGE_PENALTY
+
+logger = logging.getLogger(__name__)
+
+POI_SLOT = 'POI'
+# kind of the candidates of the other slots of a day template
+SLOT_KINDS = {'LUNCH': 'restaurant', 'DINNER': 'restaurant',
+              'TRAIL': 'trail', 'HOSTING': 'hosting'}
+MEAL_SLOTS = ('LUNCH', 'DINNER')
+
+
+def distance_matrix(points: list) -> np.ndarray:
+    """haversine distances in km between all points"""
+    lats = np.array([float(p.latitude) for p in points])
+    lons = np.array([float(p.longitude) for p in points])
+    return haversine_km(lats[:, None], lons[:, None],
+                        lats[None, :], lons[None, :])
+
+
+class PlanDistances:
+    """
+    Distances in km between the selected points of a plan, computed once
+    and shared by the planning of its days and the optimisation of their
+    routes. Points are indexed in order: POIs, restaurants, hostings, trails.
+
+    Args:
+        pois, restaurants, hostings, trails: selected points of the plan.
+        graph: walking graph of the plan (see navigo.walking), distances
+            are in straight line if None.
+    """
+
+    def __init__(self, pois: list, restaurants: list, hostings: list,
+                 trails: list = (), graph=None):
+        self.points = [*pois, *restaurants, *hostings, *trails]
+        self.matrix = graph.distance_matrix(self.points) if graph \
+            else distance_matrix(self.points)
+        # indexes of the candidates of the slots other than POIs, by kind
+        self.candidates, first = {}, len(pois)
+        for kind, kind_points in (('restaurant', restaurants),
+                                  ('hosting', hostings), ('trail', trails)):
+            self.candidates[kind] = list(
+                range(first, first + len(kind_points)))
+            first += len(kind_points)
+        self.pois = list(range(len(pois)))
+        self._indexes = {}
+        for i, point in enumerate(self.points):
+            self._indexes.setdefault(point_key(point), i)
+
+    def index(self, point) -> int:
+        """index of a point of the plan (or of a copy of it)"""
+        return self._indexes[point_key(point)]
+
+
+def point_key(point) -> tuple:
+    return type(point).__name__, point.uuid
+
+
+def path_length(path: list, dist: np.ndarray) -> float:
+    return float(sum(dist[a, b] for a, b in zip(path, path[1:])))
+
+
+def nearest_neighbour_path(start: int, nodes: list,
+                           dist: np.ndarray) -> list:
+    """path from start visiting nodes, always to the nearest one"""
+    path, left = [start], list(nodes)
+    while left:
+        nearest = min(left, key=lambda node: dist[path[-1], node])
+        path.append(nearest)
+        left.remove(nearest)
+    return path
+
+
+def two_opt(path: list, dist: np.ndarray, fixed_end: bool = False) -> bool:
+    """
+    Improves a path (its first node and, if fixed_end, its last one stay in
+    place) by reversing the sections that shorten it. Returns True if the
+    path was changed.
+    """
+    changed = False
+    last = len(path) - 2 if fixed_end else len(path) - 1
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last):
+            for j in range(i + 1, last + 1):
+                delta = dist[path[i - 1], path[j]] - dist[path[i - 1], path[i]]
+                if j + 1 < len(path):
+                    delta += dist[path[i], path[j + 1]] - \
+                        dist[path[j], path[j + 1]]
+                if delta < -1e-9:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = changed = True
+    return changed
+
+
+def or_opt(path: list, dist: np.ndarray, fixed_end: bool = False) -> bool:
+    """
+    Improves a path by moving sections of 1 to 3 nodes elsewhere in it.
+    Returns True if the path was changed.
+    """
+    changed = False
+    last = len(path) - 2 if fixed_end else len(path) - 1
+    improved = True
+    while improved:
+        improved = False
+        for length in (1, 2, 3):
+            for i in range(1, last - length + 2):
+                section = path[i:i + length]
+                before, after = path[i - 1], \
+                    path[i + length] if i + length < len(path) else None
+                removed = dist[before, section[0]] - \
+                    (dist[before, after] if after is not None else 0) + \
+                    (dist[section[-1], after] if after is not None else 0)
+                rest = path[:i] + path[i + length:]
+                best, best_delta = None, -1e-9
+                for k in range(len(rest)):
+                    if k == i - 1 or (fixed_end and k == len(rest) - 1):
+                        continue
+                    a = rest[k]
+                    b = rest[k + 1] if k + 1 < len(rest) else None
+                    for s in (section, section[::-1]):
+                        added = dist[a, s[0]] + \
+                            (dist[s[-1], b] - dist[a, b] if b is not None
+                             else 0)
+                        if added - removed < best_delta:
+                            best, best_delta = (k, s), added - removed
+                if best is not None:
+                    k, s = best
+                    path[:] = rest[:k + 1] + s + rest[k + 1:]
+                    improved = changed = True
+                    break
+            if improved:
+                break
+    return changed
+
+
+def optimise_path(start: int, nodes: list, dist: np.ndarray) -> list:
+    """short path from start visiting nodes: nearest neighbour path
+    improved by 2-opt and or-opt moves"""
+    path = nearest_neighbour_path(start, nodes, dist)
+    while two_opt(path, dist) | or_opt(path, dist):
+        pass
+    return path
+
+
+def parse_day_template(template) -> tuple:
+    """
+    slots of a day template, given as a list or a comma separated string
+    of POI, LUNCH, DINNER, TRAIL and HOSTING, starting with a POI
+    """
+    if isinstance(template, str):
+        template = template.split(',')
+    slots = tuple(slot.strip().upper() for slot in template if slot.strip())
+    unknown = set(slots) - {POI_SLOT, *SLOT_KINDS}
+    if unknown:
+        raise ValueError(f"unknown slots in day template: {sorted(unknown)}")
+    if not slots or slots[0] != POI_SLOT:
+        raise ValueError("a day template starts with a POI slot")
+    return slots
+
+
+def day_slots(template: tuple, nb_pois: int, candidates: dict) -> list:
+    """
+    Slots of a day of nb_pois POIs: the POIs are spread over the runs of POI
+    slots of the template (the first runs the fullest), evenly when there are
+    more POIs than POI slots. Slots without candidates are dropped, as well
+    as meals without any POI visited since the previous one.
+    """
+    runs = [len(list(group)) for is_poi, group in
+            itertools.groupby(template, key=lambda slot: slot == POI_SLOT)
+            if is_poi]
+    counts, left = [], nb_pois
+    for i, capacity in enumerate(runs):
+        count = math.ceil(left / (len(runs) - i))
+        if nb_pois <= sum(runs):
+            count = min(max(count, left - sum(runs[i + 1:])), capacity)
+        counts.append(count)
+        left -= count
+
+    slots, run, visited = [], 0, False
+    for is_poi, group in itertools.groupby(
+            template, key=lambda slot: slot == POI_SLOT):
+        if is_poi:
+            slots += [POI_SLOT] * counts[run]
+            visited = visited or counts[run] > 0
+            run += 1
+            continue
+        for slot in group:
+            if not candidates.get(SLOT_KINDS[slot]):
+                continue
+            if slot in MEAL_SLOTS:
+                if not visited:
+                    continue
+                visited = False
+            slots.append(slot)
+    return slots
+
+
+def slot_options(slots: list, nodes: list, i: int, candidates: dict) -> list:
+    """candidates of the slot i of a day, without those of the other slots
+    of the day (unless all of them are)"""
+    options = candidates[SLOT_KINDS[slots[i]]]
+    used = {node for j, node in enumerate(nodes) if j != i}
+    return [c for c in options if c not in used] or list(options)
+
+
+def template_day(start: int, slots: list, pois: list, candidates: dict,
+                 dist: np.ndarray) -> list:
+    """
+    Nodes of the slots of a day following start: each slot goes to the
+    nearest of its candidates not visited yet in the day, POI slots to the
+    nearest of pois.
+    """
+    nodes, left = [], list(pois)
+    for i, slot in enumerate(slots):
+        previous = nodes[-1] if nodes else start
+        if slot == POI_SLOT:
+            options = left
+        else:
+            options = slot_options(slots, nodes + [None], i, candidates)
+        nearest = min(options, key=lambda node: dist[previous, node])
+        nodes.append(nearest)
+        if slot == POI_SLOT:
+            left.remove(nearest)
+    return nodes
+
+
+def choose_anchors(start: int, slots: list, nodes: list, candidates: dict,
+                   dist: np.ndarray):
+    """
+    best candidates of the slots other than POIs, given their neighbours,
+    2 such slots in a row (eg dinner and hosting) are chosen together
+    """
+    i = 0
+    while i < len(slots):
+        if slots[i] == POI_SLOT:
+            i += 1
+            continue
+        previous = nodes[i - 1] if i > 0 else start
+        pair = i + 1 < len(slots) and slots[i + 1] != POI_SLOT
+        j = i + 1 if pair else i
+        following = nodes[j + 1] if j + 1 < len(nodes) else None
+        options = slot_options(slots, nodes, i, candidates)
+        if pair:
+            seconds = slot_options(slots, nodes, j, candidates)
+            costs = dist[previous, options][:, None] + \
+                dist[np.ix_(options, seconds)]
+            if following is not None:
+                costs = costs + dist[seconds, following][None, :]
+            first, second = np.unravel_index(np.argmin(costs), costs.shape)
+            nodes[i], nodes[j] = options[first], seconds[second]
+        else:
+            nodes[i] = min(options, key=lambda c: dist[previous, c] + (
+                dist[c, following] if following is not None else 0))
+        i = j + 1
+
+
+def insertion_day(start: int, slots: list, pois: list, candidates: dict,
+                  dist: np.ndarray) -> list:
+    """day visiting the POIs on their optimised path, with the best
+    candidates of the other slots"""
+    path = iter(optimise_path(start, pois, dist)[1:])
+    nodes = [next(path) if slot == POI_SLOT else None for slot in slots]
+    for i, slot in enumerate(slots):
+        if slot != POI_SLOT:
+            nodes[i] = candidates[SLOT_KINDS[slot]][0]
+    choose_anchors(start, slots, nodes, candidates, dist)
+    return nodes
+
+
+def improve_section(section: list, before: int, after: int | None,
+                    dist: np.ndarray) -> list:
+    """section of POIs between 2 fixed points (after may be None) improved
+    by 2-opt and or-opt moves"""
+    path = [before, *section] + ([after] if after is not None else [])
+    fixed_end = after is not None
+    while two_opt(path, dist, fixed_end) | or_opt(path, dist, fixed_end):
+        pass
+    return path[1:len(section) + 1]
+
+
+def improve_day(start: int, slots: list, nodes: list, candidates: dict,
+                dist: np.ndarray) -> float:
+    """
+    Improves the nodes of a day until no move shortens it: order of the POIs
+    of each run of POI slots, exchange of POIs between runs, choice of the
+    candidates of the other slots. Returns its distance.
+    """
+    runs = [[i for i, _ in group] for is_poi, group in itertools.groupby(
+        enumerate(slots), key=lambda item: item[1] == POI_SLOT) if is_poi]
+    length = path_length([start, *nodes], dist)
+    while True:
+        for run in runs:
+            before = nodes[run[0] - 1] if run[0] > 0 else start
+            after = nodes[run[-1] + 1] if run[-1] + 1 < len(nodes) else None
+            nodes[run[0]:run[-1] + 1] = improve_section(
+                nodes[run[0]:run[-1] + 1], before, after, dist)
+
+        # exchange POIs of different runs
+        best = path_length([start, *nodes], dist)
+        for first_run, second_run in itertools.combinations(runs, 2):
+            for i in first_run:
+                for j in second_run:
+                    nodes[i], nodes[j] = nodes[j], nodes[i]
+                    swapped = path_length([start, *nodes], dist)
+                    if swapped < best - 1e-9:
+                        best = swapped
+                    else:
+                        nodes[i], nodes[j] = nodes[j], nodes[i]
+
+        choose_anchors(start, slots, nodes, candidates, dist)
+        new_length = path_length([start, *nodes], dist)
+        if new_length > length - 1e-9:
+            return min(new_length, length)
+        length = new_length
+
+
+def plan_day(start: int, slots: list, pois: list, candidates: dict,
+             dist: np.ndarray) -> (list, float):
+    """
+    Nodes of the slots of a day (see day_slots) following start, the first
+    POI of the day or the hosting of the previous day: pois are the indexes
+    of the POIs to visit and candidates the indexes of the candidates of the
+    other slots by kind (restaurant, hosting, trail).
+    The day is seeded with template_day and with the optimised path of the
+    POIs, both improved by improve_day, the shortest is kept.
+
+    Returns the nodes of the day and its distance in km from start.
+    """
+    days = [seed(start, slots, pois, candidates, dist)
+            for seed in (template_day, insertion_day)]
+    distances = [improve_day(start, slots, nodes, candidates, dist)
+                 for nodes in days]
+    best = int(np.argmin(distances))
+    return days[best], distances[best]
+
+
+def day_slots_after(start: int, pois: list, candidates: dict,
+                    day_template=DAY_TEMPLATE) -> list:
+    """slots of a day of the template starting at the POI start, without
+    it"""
+    template = parse_day_template(day_template)
+    return day_slots(template, len(pois) + 1, candidates)[1:]
+
+
+def greedy_day(start: int, pois: list, candidates: dict,
+               dist: np.ndarray) -> list:
+    """nodes of a day starting at the POI start in the order of the greedy
+    chain of compute_itinerary, each step going to the nearest point (the
+    baseline of plan_day)"""
+    slots = day_slots_after(start, pois, candidates)
+    return [start] + template_day(start, slots, pois, candidates, dist)
+
+
+def choose_hostings(befores: list, afters: list, hostings: list,
+                    dist: np.ndarray, penalty: float) -> list:
+    """
+    Hostings of consecutive nights minimising the distances from the step
+    before each night and to the step after it (None after the last night),
+    plus penalty for each change of hosting: dynamic programming over the
+    nights and the hostings, in O(nights x hostings).
+    """
+    hostings = np.asarray(hostings)
+    costs = dist[np.asarray(befores)][:, hostings]
+    for night, after in enumerate(afters):
+        if after is not None:
+            costs[night] += dist[hostings, after]
+
+    # total[h]: least cost of the nights so far, the last one in hosting h
+    total = costs[0].copy()
+    previous_hostings = []
+    for night in range(1, len(costs)):
+        best = int(np.argmin(total))
+        stay = total <= total[best] + penalty
+        previous_hostings.append(np.where(stay, np.arange(len(hostings)),
+                                          best))
+        total = np.where(stay, total, total[best] + penalty) + costs[night]
+
+    chosen = [int(np.argmin(total))]
+    for previous in reversed(previous_hostings):
+        chosen.append(int(previous[chosen[-1]]))
+    return [int(hostings[h]) for h in reversed(chosen)]
+
+
+def keep_hostings(days: list, candidates: dict, dist: np.ndarray,
+                  penalty: float):
+    """
+    Hostings of the days planned by plan_day ([start, slots, nodes] of each
+    day, in order, start of the first day being its first POI) chosen again
+    by choose_hostings, to avoid changing of hosting every night when a
+    hosting is close to several days. Days are then improved with their
+    hosting, the next day starting from it.
+    """
+    nights = [(day, day[1].index('HOSTING')) for day in days
+              if 'HOSTING' in day[1]]
+    if len(nights) < 2:
+        return
+    befores, afters = [], []
+    for day, k in nights:
+        start, _, nodes = day
+        befores.append(nodes[k - 1] if k > 0 else start)
+        if k + 1 < len(nodes):
+            afters.append(nodes[k + 1])
+        else:
+            following = days[days.index(day) + 1:]
+            afters.append(next((nodes[0] for _, _, nodes in following
+                                if nodes), None))
+    hostings = choose_hostings(befores, afters, candidates['hosting'], dist,
+                               penalty)
+
+    chosen = {id(day): hosting for (day, k), hosting in zip(nights, hostings)}
+    for d, day in enumerate(days):
+        if d > 0:
+            day[0] = days[d - 1][2][-1] if days[d - 1][2] else days[d - 1][0]
+        if id(day) in chosen:
+            day[2][day[1].index('HOSTING')] = chosen[id(day)]
+            improve_day(day[0], day[1], day[2],
+                        {**candidates, 'hosting': [chosen[id(day)]]}, dist)
+
+
+def optimise_itinerary(itinerary: list, restaurants: list, hostings: list,
+                       trails: list = (), day_template=DAY_TEMPLATE,
+                       distances: PlanDistances = None,
+                       hosting_change_penalty: float = HOSTING_CHANGE_PENALTY
+                       ) -> (list, dict):
+    """
+    Re-plans each day of an itinerary with plan_day: its POIs are kept,
+    the points of its other slots are chosen again among the candidates,
+    the hostings of the nights by keep_hostings.
+    distances are the ones of the plan, computed here if None.
+    Returns the new itinerary (copies of the points with their day and rank)
+    and the distance in km of each day, the leg from the hosting of the
+    previous day included.
+    """
+    template = parse_day_template(day_template)
+    days = {}
+    others = []
+    for point in itinerary:
+        if isinstance(point, POI) and point.day is not None:
+            days.setdefault(point.day, []).append(point)
+        elif not isinstance(point, (Restaurant, Hosting, Trail)):
+            others.append(point)
+    if not days:
+        return itinerary, {}
+
+    if distances is None:
+        distances = PlanDistances([p for day in days.values() for p in day],
+                                  restaurants, hostings, trails)
+    dist, candidates = distances.matrix, distances.candidates
+
+    # [start, slots, nodes] of each day, the start of the first day is its
+    # first POI, the one of the next days the last node of the previous one
+    planned = []
+    for day in sorted(days):
+        indexes = [distances.index(p)
+                   for p in sorted(days[day], key=lambda p: p.rank or 0)]
+        slots = day_slots(template, len(indexes), candidates)
+        if not planned:
+            start, slots, indexes = indexes[0], slots[1:], indexes[1:]
+        else:
+            start = planned[-1][2][-1] if planned[-1][2] else planned[-1][0]
+        nodes, _ = plan_day(start, slots, indexes, candidates, dist)
+        planned.append([start, slots, nodes])
+    keep_hostings(planned, candidates, dist, hosting_change_penalty)
+
+    result, day_km = [], {}
+    for day, (start, _, nodes) in zip(sorted(days), planned):
+        day_km[day] = path_length([start, *nodes], dist)
+        if day == min(days):
+            nodes = [start] + nodes
+        for rank, i in enumerate(nodes, start=1):
+            point = copy.copy(distances.points[i])
+            point.day, point.rank = day, rank
+            result.append(point)
+        logger.info(f"day {day}: {len(nodes)} steps, {day_km[day]:.2f} km")
+    return result + others, day_km
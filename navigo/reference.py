@@ -0,0 +1,127 @@
+# in-memory cache of reference data (POI types and themes by category,
+# restaurant and hosting types) used by the home form and to expand
+# the favorite categories of the user into POI types and themes
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from navigo.db import get_poi_types, get_poi_themes, \
+    get_restaurants_types, get_hostings_types
+from navigo.settings import REFERENCE_DATA_TTL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReferenceData:
+    # category => names of POI types (or themes) of this category
+    poi_types_by_category: dict[str, list[str]] = field(default_factory=dict)
+    poi_themes_by_category: dict[str, list[str]] = field(
+        default_factory=dict)
+    restaurant_types: list[str] = field(default_factory=list)
+    hosting_types: list[str] = field(default_factory=list)
+    loaded_at: float = 0
+
+    @property
+    def poi_type_categories(self) -> list[str]:
+        return sorted(c for c in self.poi_types_by_category if c != 'Other')
+
+    @property
+    def poi_theme_categories(self) -> list[str]:
+        return sorted(c for c in self.poi_themes_by_category if c != 'Other')
+
+    def expand_poi_type_categories(self, categories: list) -> list[str]:
+        """names of the POI types of a list of categories"""
+        return [name for category in categories
+                for name in self.poi_types_by_category.get(category, [])]
+
+    def expand_poi_theme_categories(self, categories: list) -> list[str]:
+        """names of the POI themes of a list of categories"""
+        return [name for category in categories
+                for name in self.poi_themes_by_category.get(category, [])]
+
+
+def group_by_category(rows) -> dict[str, list[str]]:
+    res = {}
+    for row in rows:
+        res.setdefault(row.CATEGORY, []).append(row.NAME)
+    return res
+
+
+class ReferenceDataError(Exception):
+    pass
+
+
+def load_reference_data() -> ReferenceData:
+    """
+    Loads the reference data, raises ReferenceDataError if some of them are
+    empty (the get_*_types helpers return [] on database errors).
+    """
+    data = ReferenceData(
+        poi_types_by_category=group_by_category(get_poi_types()),
+        poi_themes_by_category=group_by_category(get_poi_themes()),
+        restaurant_types=[r['TYPE'] for r in get_restaurants_types()],
+        hosting_types=[h['TYPE'] for h in get_hostings_types()],
+        loaded_at=time.time(),
+    )
+    empty = [name for name in ('poi_types_by_category',
+                               'poi_themes_by_category',
+                               'restaurant_types', 'hosting_types')
+             if not getattr(data, name)]
+    if empty:
+        raise ReferenceDataError(f"empty reference data: {', '.join(empty)}")
+    return data
+
+
+class ReferenceDataCache:
+    """
+    Reference data loaded once and reloaded when older than ttl seconds
+    (0 to never expire) or on demand with refresh().
+    When a reload fails, the previous data are kept and the reload is tried
+    again on the next get().
+    """
+
+    def __init__(self, loader=load_reference_data, ttl=REFERENCE_DATA_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self._data = None
+        self._lock = threading.Lock()
+
+    def is_expired(self) -> bool:
+        return self._data is None or (
+            self.ttl > 0 and time.time() - self._data.loaded_at > self.ttl)
+
+    def get(self) -> ReferenceData:
+        if self.is_expired():
+            with self._lock:
+                # another thread may have refreshed it meanwhile
+                if self.is_expired():
+                    try:
+                        self._refresh()
+                    except Exception as e:
+                        if self._data is None:
+                            raise
+                        logger.error(f"unable to reload reference data, "
+                                     f"keeping those loaded at "
+                                     f"{self._data.loaded_at}: {e}")
+        return self._data
+
+    def refresh(self) -> ReferenceData:
+        with self._lock:
+            self._refresh()
+        return self._data
+
+    def _refresh(self):
+        data = self.loader()
+        logger.info(
+            f"reference data loaded: "
+            f"{len(data.poi_types_by_category)} categories of POI types, "
+            f"{len(data.poi_themes_by_category)} categories of POI themes, "
+            f"{len(data.restaurant_types)} restaurant types, "
+            f"{len(data.hosting_types)} hosting types")
+        self._data = data
+
+
+reference_data = ReferenceDataCache()
@@ -1,3 +1,5 @@
+import os
+
 from decouple import config
 
 DEBUG = config('DEBUG', default=True, cast=bool)
@@ -22,6 +24,17 @@ MARIADB_POI_TABLE = config('MARIADB_POI_TABLE', default="POI", cast=str)
 MARIADB_POI_TYPE_TABLE = config('MARIADB_POI_TYPE_TABLE', default="POI_TYPE", cast=str)
 MARIADB_POI_THEME_TABLE = config('MARIADB_POI_THEME_TABLE', default="POI_THEME", cast=str)
 MARIADB_TRAIL_TABLE = config('MARIADB_TRAIL_TABLE', default="TRAIL", cast=str)
+# query points by distance using coordinates stored in MariaDB
+# (needs the migration of navigo/migrations.py), else by postal codes
+# with coordinates fetched from neo4j
+MARIADB_SPATIAL_QUERIES = config('MARIADB_SPATIAL_QUERIES', default=False, cast=bool)
+
+# reload reference data (types and themes) after this number of seconds
+# (0 to load them once)
+REFERENCE_DATA_TTL = config('REFERENCE_DATA_TTL', default=3600, cast=int)
+# token expected in the X-Refresh-Token header of POST
+# /data/reference/refresh (the endpoint is disabled when empty)
+REFERENCE_REFRESH_TOKEN = config('REFERENCE_REFRESH_TOKEN', default="", cast=str)
 
 
 # mongodb settings
@@ -42,6 +55,28 @@ MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY = config('MIN_FETCHED_TRAIL_BY_ZONE_PER_DAY',
 MAX_LOOKUP_ITERATIONS_FOR_POINTS = config('MAX_LOOKUP_ITERATIONS_FOR_POINTS', default=5, cast=int)
 LOOKUP_ITERATIONS_RADIUS_INIT = config('LOOKUP_ITERATIONS_RADIUS_INIT', default=10, cast=int)
 LOOKUP_ITERATIONS_RADIUS_STEP = config('LOOKUP_ITERATIONS_RADIUS_STEP', default=5, cast=int)
+# slots of each day of a trip (POI, LUNCH, DINNER, TRAIL, HOSTING), the
+# POIs of a day are spread over its POI slots
+DAY_TEMPLATE = config('DAY_TEMPLATE', default='POI,POI,LUNCH,POI,POI,DINNER,HOSTING', cast=str)
+# cost (in km of travel) of changing of hosting between 2 nights of a trip
+HOSTING_CHANGE_PENALTY = config('HOSTING_CHANGE_PENALTY', default=2.0, cast=float)
+# directory of the walking graphs by department (see navigo/walking.py),
+# legs are measured in straight line when empty
+WALKING_GRAPH_DIR = config('WALKING_GRAPH_DIR', default='', cast=str)
+# max distance (in metres) from a point to the walking graph, and max length
+# of the legs searched on it, longer legs keep their straight line
+WALKING_SNAP_DISTANCE = config('WALKING_SNAP_DISTANCE', default=250, cast=int)
+WALKING_MAX_LEG = config('WALKING_MAX_LEG', default=5000, cast=int)
+# number of legs whose length is kept in memory by walking graph
+WALKING_LEG_CACHE_SIZE = config('WALKING_LEG_CACHE_SIZE', default=200000, cast=int)
+# toilets of a trip are the ones within this distance (in metres) of its legs
+WC_CORRIDOR_DISTANCE = config('WC_CORRIDOR_DISTANCE', default=300, cast=int)
+# number of processes planning the trips of a batch (0: number of CPUs)
+PLANNING_PROCESSES = config('PLANNING_PROCESSES', default=0, cast=int)
+# number of (zone, radius) whose postal codes (or area) are kept in memory
+ZONE_FILTER_CACHE_SIZE = config('ZONE_FILTER_CACHE_SIZE', default=1024, cast=int)
+# number of points fetched by query when streaming an export of points
+EXPORT_BATCH_SIZE = config('EXPORT_BATCH_SIZE', default=500, cast=int)
 
 
 FOURESQUARE_API_CLIENT_ID = config('FOURESQUARE_API_CLIENT_ID', default="5NDRMZN5GUYKQHV0IBZDAFCQRPISIKXG1BNL2KF4UVSG421X", cast=str)
@@ -53,4 +88,35 @@ FOURESQUARE_POI_CATEGORY_ID = config('FOURESQUARE_POI_CATEGORY_ID', default="100
 # Dining and Drinking
 FOURESQUARE_RESTAURANT_CATEGORY_ID = config('FOURESQUARE_RESTAURANT_CATEGORY_ID', default="13000", cast=str)
 
+# overall deadline (in seconds) to fetch weather and top POI / restaurants
+EXTERNAL_DATA_TIMEOUT = config('EXTERNAL_DATA_TIMEOUT', default=10, cast=float)
+
+# external APIs transport: live, record (live + store responses on disk)
+# or replay (serve stored responses, no network)
+EXTERNAL_API_MODE = config('EXTERNAL_API_MODE', default="live", cast=str)
+EXTERNAL_API_FIXTURES_DIR = config('EXTERNAL_API_FIXTURES_DIR', default="fixtures/external", cast=str)
+# latency (in milliseconds) injected on each external API response
+EXTERNAL_API_LATENCY_MS = config('EXTERNAL_API_LATENCY_MS', default=0, cast=int)
+
+# local table of communes (see navigo/communes.py), remote APIs are used
+# when it has not been built
+COMMUNES_DATA_DIR = config('COMMUNES_DATA_DIR', default=os.path.join(os.path.dirname(__file__), 'data', 'communes'), cast=str)
+# directory of the denormalised snapshots of points (see navigo/snapshot.py),
+# the databases are queried when empty or when no snapshot is published
+SNAPSHOT_DIR = config('SNAPSHOT_DIR', default='', cast=str)
+# seconds between two reads of the CURRENT version of the snapshots by a
+# worker, a published snapshot is served after at most this delay
+SNAPSHOT_CHECK_INTERVAL = config('SNAPSHOT_CHECK_INTERVAL', default=10, cast=float)
+# server side cache of the responses of the home page and /data/* endpoints
+RESPONSE_CACHE_MAX_BYTES = config('RESPONSE_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=300, cast=int)
+# max-age of responses built from a published snapshot (responses of live
+# databases have to be revalidated with their ETag)
+RESPONSE_CACHE_MAX_AGE = config('RESPONSE_CACHE_MAX_AGE', default=3600, cast=int)
+# number of plans kept in memory, with their Dash map once requested
+# (by the process which planned them: run the API in a single worker)
+PLAN_STORE_SIZE = config('PLAN_STORE_SIZE', default=100, cast=int)
+# responses larger than this size (in bytes) are compressed (gzip or brotli)
+COMPRESSION_MINIMUM_SIZE = config('COMPRESSION_MINIMUM_SIZE', default=1000, cast=int)
+
 DASH_TOKEN = config('DASH_TOKEN', default="pk.eyJ1IjoiaGF6ZW1hbWFyYSIsImEiOiJjbGt2cmV6YXAwMGRlM3BwcGV0dHVjNW5kIn0.9ZSlxSY240CuAUQ1btlWuw", cast=str)
\ No newline at end of file
@@ -0,0 +1,500 @@
+# denormalised snapshot of the points of interest, by department
+#
+# a snapshot joins MariaDB rows, MongoDB labels and neo4j coordinates into
+# files by department, so that planning does not need any database:
+#   <SNAPSHOT_DIR>/<version>/dept-<department>.sqlite
+#   <SNAPSHOT_DIR>/<version>/dept-<department>/  (fixed layout, see below)
+#   <SNAPSHOT_DIR>/CURRENT  (name of the version to serve)
+#
+# the fixed layout directory holds numpy arrays memory-mapped on first use,
+# so that all workers share the same pages and start without loading data:
+#   kinds.npy          uint8   index of the kind in KINDS, rows sorted by kind
+#   latitudes.npy      float64
+#   longitudes.npy     float64
+#   postal_codes.npy   int32
+#   string_ids.npy     int32   (n, len(STRING_FIELDS)) ids in the string table
+#   string_offsets.npy uint32  offsets (m + 1) of the strings in strings.bin
+#   strings.bin        utf-8 string table (deduplicated)
+# the SQLite file is read when the directory is missing
+#
+# snapshots are built with navigo.build_snapshot
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from navigo.communes import haversine_km
+from navigo.planner.models import POI, Restaurant, Hosting, Trail, WC
+from navigo.settings import SNAPSHOT_CHECK_INTERVAL, SNAPSHOT_DIR
+
+logger = logging.getLogger(__name__)
+
+# kind of point => dataclass
+POINT_CLASSES = {
+    'poi': POI,
+    'restaurant': Restaurant,
+    'hosting': Hosting,
+    'trail': Trail,
+    'wc': WC,
+}
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE points (
+    kind TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    name TEXT,
+    city TEXT,
+    postal_code INTEGER,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    category TEXT,
+    type_list TEXT,
+    theme_list TEXT
+);
+CREATE INDEX idx_points_kind_postal_code ON points (kind, postal_code);
+CREATE INDEX idx_points_kind_latitude ON points (kind, latitude);
+"""
+
+COLUMNS = ("kind", "uuid", "name", "city", "postal_code", "latitude",
+           "longitude", "category", "type_list", "theme_list")
+
+KINDS = tuple(POINT_CLASSES)
+STRING_FIELDS = ("uuid", "name", "city", "category", "type_list",
+                 "theme_list")
+UUID_FIELD = STRING_FIELDS.index("uuid")
+
+
+def get_department(postal_code: int) -> str:
+    """department of a postal code (3 digits for overseas departments)"""
+    code = f"{int(postal_code):05d}"
+    return code[:3] if code.startswith(('97', '98')) else code[:2]
+
+
+def point_to_row(kind: str, point) -> tuple:
+    return (
+        kind,
+        point.uuid,
+        point.name,
+        point.city,
+        point.city_code,
+        float(point.latitude),
+        float(point.longitude),
+        point.category,
+        json.dumps(getattr(point, 'type_list', None)),
+        json.dumps(getattr(point, 'theme_list', None)),
+    )
+
+
+def row_to_point(row: sqlite3.Row):
+    cls = POINT_CLASSES[row['kind']]
+    kwargs = dict(
+        uuid=row['uuid'],
+        name=row['name'],
+        city=row['city'],
+        city_code=row['postal_code'],
+        latitude=row['latitude'],
+        longitude=row['longitude'],
+        category=row['category'],
+    )
+    if cls is POI:
+        kwargs['type_list'] = json.loads(row['type_list'])
+        kwargs['theme_list'] = json.loads(row['theme_list'])
+    return cls(**kwargs)
+
+
+def get_bbox(points_by_kind: dict) -> list | None:
+    """[min_lat, min_lon, max_lat, max_lon] of points, None without points"""
+    points = [p for points in points_by_kind.values() for p in points
+              if p is not None]
+    if not points:
+        return None
+    lats = [float(p.latitude) for p in points]
+    lons = [float(p.longitude) for p in points]
+    return [min(lats), min(lons), max(lats), max(lons)]
+
+
+def write_department(path, version: str, department: str,
+                     points_by_kind: dict):
+    """write the snapshot files (SQLite and fixed layout) of a department
+    from lists of points by kind"""
+    write_department_sqlite(path, version, department, points_by_kind)
+    write_points_table(Path(path).with_suffix(''), points_by_kind)
+
+
+def write_department_sqlite(path, version: str, department: str,
+                            points_by_kind: dict):
+    """the file is written aside and then renamed"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    con = sqlite3.connect(tmp_path)
+    try:
+        con.executescript(SCHEMA)
+        con.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('version', version), ('department', department),
+            ('bbox', json.dumps(get_bbox(points_by_kind)))])
+        for kind, points in points_by_kind.items():
+            con.executemany(
+                f"INSERT INTO points ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [point_to_row(kind, p) for p in points if p is not None])
+        con.commit()
+    finally:
+        con.close()
+    os.replace(tmp_path, path)
+
+
+def write_points_table(output_dir, points_by_kind: dict):
+    """write the fixed layout arrays of a department"""
+    rows = [dict(zip(COLUMNS, point_to_row(kind, p)))
+            for kind in KINDS for p in points_by_kind.get(kind, [])
+            if p is not None]
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    string_ids = {}
+    ids = np.array(
+        [[string_ids.setdefault(r[f] or '', len(string_ids))
+          for f in STRING_FIELDS] for r in rows],
+        dtype=np.int32).reshape(len(rows), len(STRING_FIELDS))
+    encoded = [string.encode('utf-8') for string in string_ids]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+    np.save(output_dir / 'kinds.npy', np.array(
+        [KINDS.index(r['kind']) for r in rows], dtype=np.uint8))
+    np.save(output_dir / 'latitudes.npy', np.array(
+        [r['latitude'] for r in rows], dtype=np.float64))
+    np.save(output_dir / 'longitudes.npy', np.array(
+        [r['longitude'] for r in rows], dtype=np.float64))
+    np.save(output_dir / 'postal_codes.npy', np.array(
+        [r['postal_code'] or 0 for r in rows], dtype=np.int32))
+    np.save(output_dir / 'string_ids.npy', ids)
+    np.save(output_dir / 'string_offsets.npy', offsets)
+    with open(output_dir / 'strings.bin', 'wb') as f:
+        f.write(b''.join(encoded))
+
+
+class PointsTable:
+    """
+    Points of a department memory-mapped from the fixed layout arrays.
+
+    Args:
+        data_dir: directory holding the arrays written by write_points_table.
+    """
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self.kinds = np.load(data_dir / 'kinds.npy', mmap_mode='r')
+        self.latitudes = np.load(data_dir / 'latitudes.npy', mmap_mode='r')
+        self.longitudes = np.load(data_dir / 'longitudes.npy', mmap_mode='r')
+        self.postal_codes = np.load(data_dir / 'postal_codes.npy',
+                                    mmap_mode='r')
+        self.string_ids = np.load(data_dir / 'string_ids.npy', mmap_mode='r')
+        self.string_offsets = np.load(data_dir / 'string_offsets.npy',
+                                      mmap_mode='r')
+        # np.memmap can not map an empty file
+        strings_path = data_dir / 'strings.bin'
+        self.strings = np.memmap(strings_path, dtype=np.uint8, mode='r') \
+            if strings_path.stat().st_size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def string_at(self, string_id: int) -> str:
+        start = self.string_offsets[string_id]
+        end = self.string_offsets[string_id + 1]
+        return self.strings[start:end].tobytes().decode('utf-8')
+
+    def kind_range(self, kind: str) -> (int, int):
+        """rows of a kind (rows are sorted by kind)"""
+        code = KINDS.index(kind)
+        return int(np.searchsorted(self.kinds, code, side='left')), \
+            int(np.searchsorted(self.kinds, code, side='right'))
+
+    def select(self, kind: str, zone_filter) -> np.ndarray:
+        """indices of the points of a kind located in a zone filter"""
+        start, end = self.kind_range(kind)
+        if hasattr(zone_filter, 'radius'):
+            distances = haversine_km(
+                zone_filter.latitude, zone_filter.longitude,
+                self.latitudes[start:end], self.longitudes[start:end])
+            mask = distances <= zone_filter.radius
+        else:
+            mask = np.isin(self.postal_codes[start:end],
+                           np.fromiter(zone_filter, dtype=np.int64))
+        return np.flatnonzero(mask) + start
+
+    def uuid_at(self, index: int) -> str:
+        return self.string_at(self.string_ids[index, UUID_FIELD])
+
+    def row_at(self, index: int) -> dict:
+        row = {f: self.string_at(i)
+               for f, i in zip(STRING_FIELDS, self.string_ids[index])}
+        row.update(
+            kind=KINDS[self.kinds[index]],
+            postal_code=int(self.postal_codes[index]),
+            latitude=float(self.latitudes[index]),
+            longitude=float(self.longitudes[index]),
+        )
+        return row
+
+
+class SnapshotStore:
+    """
+    Read only access to a version of the snapshot.
+
+    Args:
+        snapshot_dir: the root directory of snapshots.
+        version: the version to read, default to the CURRENT one.
+    """
+
+    def __init__(self, snapshot_dir, version: str = None):
+        self.snapshot_dir = Path(snapshot_dir)
+        if version is None:
+            version = (self.snapshot_dir / 'CURRENT').read_text().strip()
+        self.version = version
+        self.path = self.snapshot_dir / version
+        # department => PointsTable (None without fixed layout)
+        self._tables = {}
+        # department => bbox of its points, read once
+        self._bboxes = None
+        self._lock = threading.Lock()
+
+    def department_path(self, department: str) -> Path:
+        return self.path / f"dept-{department}.sqlite"
+
+    def departments(self) -> list[str]:
+        return sorted(p.stem[len('dept-'):]
+                      for p in self.path.glob('dept-*.sqlite'))
+
+    def get_bboxes(self) -> dict:
+        """bbox ([min_lat, min_lon, max_lat, max_lon], None without points)
+        of the points of each department, read once from the meta of the
+        files (computed for snapshots written without it)"""
+        if self._bboxes is None:
+            with self._lock:
+                if self._bboxes is None:
+                    self._bboxes = {d: self._read_bbox(d)
+                                    for d in self.departments()}
+        return self._bboxes
+
+    def _read_bbox(self, department: str) -> list | None:
+        con = self._connect(department)
+        try:
+            row = con.execute(
+                "SELECT value FROM meta WHERE key = 'bbox'").fetchone()
+            if row is not None:
+                return json.loads(row['value'])
+            bbox = con.execute(
+                "SELECT MIN(latitude), MIN(longitude), MAX(latitude), "
+                "MAX(longitude) FROM points").fetchone()
+            return list(bbox) if bbox[0] is not None else None
+        finally:
+            con.close()
+
+    def get_table(self, department: str) -> PointsTable | None:
+        """the memory-mapped points of a department, mapped on first use"""
+        if department not in self._tables:
+            with self._lock:
+                if department not in self._tables:
+                    data_dir = self.department_path(department).with_suffix('')
+                    self._tables[department] = PointsTable(data_dir) \
+                        if (data_dir / 'kinds.npy').exists() else None
+        return self._tables[department]
+
+    def _connect(self, department: str) -> sqlite3.Connection | None:
+        path = self.department_path(department)
+        if not path.exists():
+            return None
+        # immutable: no locking, files are never modified once published
+        con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def get_points(self, kind: str, zone_filter, limit: int = None,
+                   favorite_categories: list = None) -> list:
+        """
+        Returns the points of a kind located in a zone filter, points of
+        the favorite categories first.
+
+        Args:
+            kind: one of POINT_CLASSES keys.
+            zone_filter: a list of postal codes or an object with latitude,
+                longitude and radius (in km) attributes (see db.GeoArea).
+            limit: maximum number of points.
+            favorite_categories: ordered favorite categories.
+        """
+        rows = self._select(kind, zone_filter)
+        if favorite_categories:
+            rows = [self._row(r) for r in rows]
+            rank = {c: i for i, c in enumerate(favorite_categories)}
+            rows.sort(key=lambda r: rank.get(r['category'],
+                                             len(favorite_categories)))
+        if limit is not None:
+            rows = rows[:limit]
+        return [row_to_point(self._row(r)) for r in rows]
+
+    def count_points(self, kind: str, zone_filter) -> int:
+        """number of points of a kind located in a zone filter, without
+        reading them from the fixed layout"""
+        return len(self._select(kind, zone_filter))
+
+    def get_points_by_uuid(self, kind: str, zone_filter, after: str = "",
+                           offset: int = 0, limit: int = None) -> list:
+        """
+        Returns the points of a kind located in a zone filter ordered by
+        UUID, starting after the UUID after and skipping offset points:
+        only the points returned are read from the fixed layout.
+        """
+        selected = sorted(((self._uuid(r), r)
+                           for r in self._select(kind, zone_filter)),
+                          key=lambda selected: selected[0])
+        selected = [r for uuid, r in selected if uuid > after]
+        end = None if limit is None else offset + limit
+        return [row_to_point(self._row(r)) for r in selected[offset:end]]
+
+    @staticmethod
+    def _row(selected):
+        """row of a selected point, a (table, index) of the fixed layout
+        or a row of the SQLite file"""
+        if isinstance(selected, tuple):
+            return selected[0].row_at(selected[1])
+        return selected
+
+    @staticmethod
+    def _uuid(selected) -> str:
+        if isinstance(selected, tuple):
+            return selected[0].uuid_at(selected[1])
+        return selected['uuid']
+
+    def _select(self, kind: str, zone_filter) -> list:
+        if hasattr(zone_filter, 'radius'):
+            return self._get_rows_in_area(kind, zone_filter)
+        return self._get_rows_in_postal_codes(kind, zone_filter)
+
+    def _get_rows_in_postal_codes(self, kind, l_postal_code) -> list:
+        by_department = {}
+        for postal_code in l_postal_code:
+            by_department.setdefault(
+                get_department(postal_code), []).append(int(postal_code))
+
+        rows = []
+        for department, postal_codes in sorted(by_department.items()):
+            table = self.get_table(department)
+            if table is not None:
+                rows.extend((table, int(i))
+                            for i in table.select(kind, postal_codes))
+                continue
+            con = self._connect(department)
+            if con is None:
+                logger.warning(f"no snapshot for department {department}")
+                continue
+            try:
+                rows.extend(con.execute(
+                    f"SELECT * FROM points WHERE kind = ? AND postal_code "
+                    f"IN ({', '.join('?' * len(postal_codes))}) "
+                    f"ORDER BY rowid",
+                    [kind, *postal_codes]).fetchall())
+            finally:
+                con.close()
+        return rows
+
+    def _get_rows_in_area(self, kind, area) -> list:
+        d_lat = area.radius / 111.32
+        d_lon = area.radius / (
+            111.32 * max(math.cos(math.radians(area.latitude)), 0.01))
+        min_lat, max_lat = area.latitude - d_lat, area.latitude + d_lat
+        min_lon, max_lon = area.longitude - d_lon, area.longitude + d_lon
+        rows = []
+        for department, bbox in sorted(self.get_bboxes().items()):
+            # only the departments with points around the area are read
+            if bbox is None or bbox[0] > max_lat or bbox[2] < min_lat or \
+                    bbox[1] > max_lon or bbox[3] < min_lon:
+                continue
+            table = self.get_table(department)
+            if table is not None:
+                # the fixed layout selects points by distance
+                rows.extend((table, int(i))
+                            for i in table.select(kind, area))
+                continue
+            con = self._connect(department)
+            try:
+                rows.extend(r for r in con.execute(
+                    "SELECT * FROM points WHERE kind = ? "
+                    "AND latitude BETWEEN ? AND ? "
+                    "AND longitude BETWEEN ? AND ? ORDER BY rowid",
+                    [kind, min_lat, max_lat, min_lon, max_lon]
+                ).fetchall() if haversine_km(
+                    area.latitude, area.longitude,
+                    r['latitude'], r['longitude']) <= area.radius)
+            finally:
+                con.close()
+        return rows
+
+
+class CurrentSnapshot:
+    """
+    Store of the CURRENT snapshot of a directory: CURRENT is read again
+    when older than check_interval seconds, and the store is swapped when
+    another version has been published.
+    """
+
+    def __init__(self, snapshot_dir, check_interval: float):
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self._store = None
+        self._checked_at = -math.inf
+        self._lock = threading.Lock()
+
+    def get(self) -> SnapshotStore | None:
+        if not self.snapshot_dir:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                # another thread may have checked it meanwhile
+                if time.monotonic() - self._checked_at >= \
+                        self.check_interval:
+                    self._store = self._read_current()
+                    self._checked_at = time.monotonic()
+        return self._store
+
+    def _read_current(self) -> SnapshotStore | None:
+        try:
+            version = Path(self.snapshot_dir, 'CURRENT').read_text().strip()
+        except FileNotFoundError:
+            return None
+        if self._store is not None and self._store.version == version:
+            return self._store
+        store = SnapshotStore(self.snapshot_dir, version)
+        logger.info(f"serving points from snapshot {store.path}")
+        return store
+
+
+current_snapshot = CurrentSnapshot(SNAPSHOT_DIR, SNAPSHOT_CHECK_INTERVAL)
+
+
+def get_snapshot_store() -> SnapshotStore | None:
+    """the store of the CURRENT snapshot of SNAPSHOT_DIR, None if no
+    snapshot has been published (a new CURRENT is served after at most
+    SNAPSHOT_CHECK_INTERVAL seconds)"""
+    return current_snapshot.get()
+
+
+def publish(snapshot_dir, version: str):
+    """make a version the CURRENT one"""
+    current = Path(snapshot_dir, 'CURRENT')
+    tmp = current.with_suffix('.tmp')
+    tmp.write_text(version)
+    os.replace(tmp, current)
@@ -1,13 +1,34 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from navigo.planner.models import POI, Restaurant, Hosting, Trail, WC
 
-from navigo.app.main import app
+from navigo.app.main import app, response_cache
 from faker import Faker
 
 client = TestClient(app)
 
 
+@contextmanager
+def mock_zone_points(points):
+    """mocks the count and the pages of the points of the zones"""
+    with patch("navigo.app.main.count_points",
+               return_value=len(points)) as mock_count_points, \
+            patch("navigo.app.main.get_points_at",
+                  side_effect=lambda kind, zone_filter, offset, size:
+                  points[offset:offset + size]) as mock_get_points_at:
+        yield mock_count_points, mock_get_points_at
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    response_cache.clear()
+
+
 fake = Faker()
 
 # ####################### POIS ###################################
@@ -39,9 +60,11 @@ for _ in range(100):
 
 
 def test_get_pois_with_non_int_params():
-    # mock get_poi_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_poi_by_zone") as mock_get_poi_by_zone:
-        mock_get_poi_by_zone.return_value = mock_POIs
+    # mock the POIs of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)) \
+            as mock_get_zone_filter, \
+            mock_zone_points(mock_POIs) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get("/data/pois?zip_code=balbla&rayon=10")
         # check results
@@ -52,9 +75,11 @@ def test_get_pois_with_non_int_params():
 
 
 def test_get_pois():
-    # mock get_poi_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_poi_by_zone") as mock_get_poi_by_zone:
-        mock_get_poi_by_zone.return_value = mock_POIs
+    # mock the POIs of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)) \
+            as mock_get_zone_filter, \
+            mock_zone_points(mock_POIs) \
+            as (mock_count_points, mock_get_points_at):
 
         # call get_pois with mocked db
         # (zip_code and rayon values haven't importance here)
@@ -70,13 +95,16 @@ def test_get_pois():
         assert len(response['results']) == 10
         assert response['results'][0]['name'] == mock_POIs_result[0]['name']
 
-        # check that get_poi_by_zone has been called once
-        mock_get_poi_by_zone.assert_called_once_with(12345, 10)
+        # check that only the POIs of the page have been fetched
+        mock_count_points.assert_called_once_with('poi', (12345,))
+        mock_get_points_at.assert_called_once_with('poi', (12345,), 0, 10)
+        mock_get_zone_filter.assert_called_once_with(12345, 10)
 
         # closed mock of BDD
         # Simule une base de données vide
-        mock_get_poi_by_zone.return_value = None
-        mock_get_poi_by_zone.reset_mock()  # Réinitialise l'appel précédent
+        mock_count_points.return_value = 0
+        # the previous response is cached by the server
+        response_cache.clear()
         assert client.get(
             "/data/pois?zip_code=12345&rayon=10").status_code == 404
 
@@ -84,9 +112,11 @@ def test_get_pois():
 # ####### Pagination tests, will be done just once as it's generic function ##
 #  test pagination with page and size setted
 def test_get_pois_with_page_and_size():
-    # mock get_poi_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_poi_by_zone") as mock_get_poi_by_zone:
-        mock_get_poi_by_zone.return_value = mock_POIs
+    # mock the POIs of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)) \
+            as mock_get_zone_filter, \
+            mock_zone_points(mock_POIs) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get(
             "/data/pois?zip_code=33000&rayon=5&page=2&size=5")
@@ -105,9 +135,11 @@ def test_get_pois_with_page_and_size():
 
 # test pagination with page out of range
 def test_get_pois_with_page_out_of_range():
-    # mock get_poi_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_poi_by_zone") as mock_get_poi_by_zone:
-        mock_get_poi_by_zone.return_value = mock_POIs
+    # mock the POIs of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)) \
+            as mock_get_zone_filter, \
+            mock_zone_points(mock_POIs) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get(
             "/data/pois?zip_code=33000&rayon=5&page=1000&size=5")
@@ -140,10 +172,9 @@ for _ in range(100):
 
 
 def test_get_restaurants_with_non_int_params():
-    # mock get_restaurants_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_restaurants_by_zone") \
-            as mock_get_restaurants_by_zone:
-        mock_get_restaurants_by_zone.return_value = mock_restaurants
+    # mock the restaurants of the zone to be independant to BDD
+    with mock_zone_points(mock_restaurants) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get("/data/restaurants?zip_code=balbla&rayon=10")
         # check results
@@ -156,10 +187,11 @@ def test_get_restaurants_with_non_int_params():
 
 # check get_restaurants
 def test_get_restaurants():
-    # mock get_restaurants_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_restaurants_by_zone")\
-            as mock_get_restaurants_by_zone:
-        mock_get_restaurants_by_zone.return_value = mock_restaurants
+    # mock the restaurants of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter",
+               return_value=(12345, 12346)) as mock_get_zone_filter, \
+            mock_zone_points(mock_restaurants) \
+            as (mock_count_points, mock_get_points_at):
 
         # call get_restaurants with mocked db
         # (zip_code and rayon values haven't importance here)
@@ -175,14 +207,19 @@ def test_get_restaurants():
         assert len(response['results']) == 10
         assert response['results'][0]['name'] == mock_restaurants_result[0]['name']
 
-        # check that get_restaurants_by_zone has been called once
-        mock_get_restaurants_by_zone.assert_called_once_with(12345, 10)
+        # check that only the restaurants of the page have been fetched
+        mock_count_points.assert_called_once_with(
+            'restaurant', (12345, 12346))
+        mock_get_points_at.assert_called_once_with(
+            'restaurant', (12345, 12346), 0, 10)
+        mock_get_zone_filter.assert_called_once_with(12345, 10)
 
         # closed mock of BDD
         # Simule une base de données vide
-        mock_get_restaurants_by_zone.return_value = None
+        mock_count_points.return_value = 0
         # Réinitialise l'appel précédent
-        mock_get_restaurants_by_zone.reset_mock()
+        # the previous response is cached by the server
+        response_cache.clear()
         assert client.get(
             "/data/restaurants?zip_code=12345&rayon=10").status_code == 404
 
@@ -212,10 +249,9 @@ for _ in range(100):
 
 
 def test_get_hostings_with_non_int_params():
-    # mock get_hostings_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_hosting_by_zone")\
-            as mock_get_hosting_by_zone:
-        mock_get_hosting_by_zone.return_value = mock_hostings
+    # mock the hostings of the zone to be independant to BDD
+    with mock_zone_points(mock_hostings) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get("/data/hostings?zip_code=balbla&rayon=10")
         # check results
@@ -227,10 +263,11 @@ def test_get_hostings_with_non_int_params():
 
 # check get_hostings
 def test_get_hostings():
-    # mock get_hostings_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_hosting_by_zone")\
-            as mock_get_hosting_by_zone:
-        mock_get_hosting_by_zone.return_value = mock_hostings
+    # mock the hostings of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter",
+               return_value=(12345, 12346)) as mock_get_zone_filter, \
+            mock_zone_points(mock_hostings) \
+            as (mock_count_points, mock_get_points_at):
 
         # call get_hostings with mocked db
         # (zip_code and rayon values haven't importance here)
@@ -246,12 +283,17 @@ def test_get_hostings():
         assert len(response['results']) == 10
         assert response['results'][0]['name'] == mock_hostings_result[0]['name']
 
-        # check that get_hostings_by_zone has been called once
-        mock_get_hosting_by_zone.assert_called_once_with(12345, 10)
+        # check that only the hostings of the page have been fetched
+        mock_count_points.assert_called_once_with(
+            'hosting', (12345, 12346))
+        mock_get_points_at.assert_called_once_with(
+            'hosting', (12345, 12346), 0, 10)
+        mock_get_zone_filter.assert_called_once_with(12345, 10)
 
         # closed mock of BDD
-        mock_get_hosting_by_zone.return_value = None
-        mock_get_hosting_by_zone.reset_mock()  # Réinitialise l'appel précédent
+        mock_count_points.return_value = 0
+        # the previous response is cached by the server
+        response_cache.clear()
         assert client.get(
             "/data/hostings?zip_code=12345&rayon=10").status_code == 404
 
@@ -281,10 +323,9 @@ for _ in range(100):
 
 
 def test_get_trails_with_non_int_params():
-    # mock get_trails_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_trails_by_zone")\
-            as mock_get_trails_by_zone:
-        mock_get_trails_by_zone.return_value = mock_trails
+    # mock the trails of the zone to be independant to BDD
+    with mock_zone_points(mock_trails) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get("/data/trails?zip_code=balbla&rayon=10")
         # check results
@@ -296,10 +337,11 @@ def test_get_trails_with_non_int_params():
 
 # check get_trails
 def test_get_trails():
-    # mock get_trails_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_trails_by_zone")\
-            as mock_get_trails_by_zone:
-        mock_get_trails_by_zone.return_value = mock_trails
+    # mock the trails of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter",
+               return_value=(12345, 12346)) as mock_get_zone_filter, \
+            mock_zone_points(mock_trails) \
+            as (mock_count_points, mock_get_points_at):
 
         # call get_trails with mocked db
         # (zip_code and rayon values haven't importance here)
@@ -315,12 +357,17 @@ def test_get_trails():
         assert len(response['results']) == 10
         assert response['results'][0]['name'] == mock_trails_result[0]['name']
 
-        # check that get_trails_by_zone has been called once
-        mock_get_trails_by_zone.assert_called_once_with(12345, 10)
+        # check that only the trails of the page have been fetched
+        mock_count_points.assert_called_once_with(
+            'trail', (12345, 12346))
+        mock_get_points_at.assert_called_once_with(
+            'trail', (12345, 12346), 0, 10)
+        mock_get_zone_filter.assert_called_once_with(12345, 10)
 
         # closed mock of BDD
-        mock_get_trails_by_zone.return_value = None
-        mock_get_trails_by_zone.reset_mock()  # Réinitialise l'appel précédent
+        mock_count_points.return_value = 0
+        # the previous response is cached by the server
+        response_cache.clear()
         assert client.get(
             "/data/trails?zip_code=12345&rayon=10").status_code == 404
 
@@ -350,9 +397,9 @@ for _ in range(100):
 
 
 def test_get_wcs_with_non_int_params():
-    # mock get_WCs_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_wc_by_zone") as mock_get_wc_by_zone:
-        mock_get_wc_by_zone.return_value = mock_WCs
+    # mock the WCs of the zone to be independant to BDD
+    with mock_zone_points(mock_WCs) \
+            as (mock_count_points, mock_get_points_at):
 
         response = client.get("/data/wcs?zip_code=balbla&rayon=10")
         # check results
@@ -365,9 +412,11 @@ def test_get_wcs_with_non_int_params():
 
 
 def test_get_wcs():
-    # mock get_WCs_by_zone to be independant to BDD
-    with patch("navigo.app.main.get_wc_by_zone") as mock_get_wc_by_zone:
-        mock_get_wc_by_zone.return_value = mock_WCs
+    # mock the WCs of the zone to be independant to BDD
+    with patch("navigo.db.get_zone_filter",
+               return_value=(12345, 12346)) as mock_get_zone_filter, \
+            mock_zone_points(mock_WCs) \
+            as (mock_count_points, mock_get_points_at):
 
         # call get_WCs with mocked db
         # (zip_code and rayon values haven't importance here)
@@ -383,11 +432,236 @@ def test_get_wcs():
         assert len(response['results']) == 10
         assert response['results'][0]['uuid'] == mock_WCs_result[0]['uuid']
 
-        # check that get_WCs_by_zone has been called once
-        mock_get_wc_by_zone.assert_called_once_with(12345, 10)
+        # check that only the WCs of the page have been fetched
+        mock_count_points.assert_called_once_with(
+            'wc', (12345, 12346))
+        mock_get_points_at.assert_called_once_with(
+            'wc', (12345, 12346), 0, 10)
+        mock_get_zone_filter.assert_called_once_with(12345, 10)
 
         # closed mock of BDD
-        mock_get_wc_by_zone.return_value = None
-        mock_get_wc_by_zone.reset_mock()  # Réinitialise l'appel précédent
+        mock_count_points.return_value = 0
+        # the previous response is cached by the server
+        response_cache.clear()
         assert client.get(
             "/data/WCs?zip_code=12345&rayon=10").status_code == 404
+
+
+# ####################### KEYSET PAGES AND EXPORT ########################
+def test_get_points_by_cursor():
+    with patch("navigo.app.main.get_zone_filter") as mock_get_zone_filter, \
+            patch("navigo.app.main.get_points_page") as mock_get_points_page:
+        mock_get_zone_filter.return_value = [12345]
+        mock_get_points_page.return_value = (mock_POIs[:10],
+                                             mock_POIs[9].uuid)
+
+        response = client.get(
+            "/data/pois/page?zip_code=12345&rayon=20&size=10&after=abc")
+
+        assert response.status_code == 200
+        response = response.json()
+        assert response.keys() == {"size", "next", "results"}
+        assert response['next'] == mock_POIs[9].uuid
+        assert [r['uuid'] for r in response['results']] == \
+            [p['uuid'] for p in mock_POIs_result[:10]]
+        mock_get_zone_filter.assert_called_once_with(12345, 20)
+        mock_get_points_page.assert_called_once_with('poi', [12345], 10, 'abc')
+
+        assert client.get(
+            "/data/unknown/page?zip_code=12345&rayon=20").status_code == 422
+
+
+def test_export_points():
+    with patch("navigo.app.main.get_zone_filter") as mock_get_zone_filter, \
+            patch("navigo.app.main.iter_points_by_zone") as mock_iter_points:
+        mock_get_zone_filter.return_value = [12345]
+        mock_iter_points.return_value = iter(mock_POIs)
+
+        response = client.get("/data/pois/export?zip_code=12345&rayon=20")
+
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        lines = response.text.splitlines()
+        assert len(lines) == 100
+        assert json.loads(lines[0])['uuid'] == mock_POIs_result[0]['uuid']
+        mock_iter_points.assert_called_once_with('poi', [12345])
+
+
+# ####################### RESPONSE CACHE ##################################
+def test_data_responses_are_cached_with_etag():
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)), \
+            mock_zone_points(mock_WCs) \
+            as (mock_count_points, mock_get_points_at):
+
+        response = client.get("/data/wcs?zip_code=12345&rayon=10")
+        assert response.status_code == 200
+        etag = response.headers['etag']
+        assert response.headers['cache-control'] == 'no-cache'
+
+        # same request in another order: served from the cache
+        cached = client.get("/data/wcs?rayon=10&zip_code=12345")
+        assert cached.status_code == 200
+        assert cached.content == response.content
+        assert cached.headers['etag'] == etag
+        mock_get_points_at.assert_called_once()
+
+        not_modified = client.get("/data/wcs?zip_code=12345&rayon=10",
+                                  headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b''
+
+        assert client.get("/data/wcs?zip_code=12345&rayon=10&page=2"
+                          ).headers['etag'] != etag
+        assert mock_get_points_at.call_count == 2
+
+
+def test_large_pages_are_compressed():
+    with patch("navigo.db.get_zone_filter", return_value=(12345,)), \
+            mock_zone_points(mock_trails) \
+            as (mock_count_points, mock_get_points_at):
+
+        response = client.get("/data/trails?zip_code=12345&rayon=10&size=100",
+                              headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['content-encoding'] == 'gzip'
+        results = response.json()['results']
+        assert len(results) == 100
+        assert results[0]['latitude'] == float(mock_trails_result[0]['latitude'])
+
+        # the same weak ETag identifies the compressed and the plain bodies
+        etag = response.headers['etag']
+        assert etag.startswith('W/')
+        plain = client.get("/data/trails?zip_code=12345&rayon=10&size=100",
+                           headers={'Accept-Encoding': 'identity'})
+        assert 'content-encoding' not in plain.headers
+        assert plain.headers['etag'] == etag
+        assert client.get("/data/trails?zip_code=12345&rayon=10&size=100",
+                          headers={'Accept-Encoding': 'identity',
+                                   'If-None-Match': etag}).status_code == 304
+
+
+# ####################### BATCH PLANNING ##################################
+def test_batch_recommendations():
+    trip = {
+        "trip_zone": "33000",
+        "trip_start": "2024-01-08",
+        "trip_duration": "2",
+        "favorite_category_poi_type_list": [],
+        "favorite_category_poi_theme_list": [],
+        "favorite_restaurant_categories": [],
+        "favorite_hosting_categories": [],
+        "sensitivity_to_weather": "false",
+        "days_on_hiking": "0",
+    }
+    with patch("navigo.app.main.reference_data"), \
+            patch("navigo.app.main.plan_trips") as mock_plan_trips:
+        mock_plan_trips.return_value = [
+            (mock_POIs[:2], mock_WCs[:1]),
+            ValueError("no POI found"),
+        ]
+        response = client.post("/recommendations/batch",
+                               json=[trip, {**trip, "trip_zone": "75001"}])
+
+        assert response.status_code == 200
+        results = response.json()
+        assert [r["trip"] for r in results] == [0, 1]
+        assert results[0]["map_url"] == f"/dash/{results[0]['plan_id']}/"
+        assert len(results[0]["toilets"]) == 1
+        assert results[1] == {"trip": 1, "error": "no POI found"}
+        user_inputs = mock_plan_trips.call_args.args[0]
+        assert [u.trip_zone for u in user_inputs] == [33000, 75001]
+
+        # a trip which can't be converted doesn't reject the others
+        mock_plan_trips.return_value = [(mock_POIs[:2], mock_WCs[:1])]
+        with patch("navigo.app.main.get_zipcode",
+                   side_effect=ConnectionError("vicopo down")):
+            response = client.post(
+                "/recommendations/batch",
+                json=[{**trip, "trip_zone": "Bordeaux"}, trip])
+
+        assert response.status_code == 200
+        results = response.json()
+        assert results[0] == {"trip": 0, "error": "vicopo down"}
+        assert results[1]["trip"] == 1 and "map_url" in results[1]
+        user_inputs = mock_plan_trips.call_args.args[0]
+        assert [u.trip_zone for u in user_inputs] == [33000]
+
+
+# ####################### PLANNING ########################################
+def make_itinerary():
+    itinerary = []
+    for day, rank, latitude, point_type in [
+            (1, 1, 44.80, POI), (1, 2, 44.81, Restaurant),
+            (1, 3, 44.82, Hosting), (2, 1, 44.83, POI)]:
+        itinerary.append(point_type(longitude=-0.57, latitude=latitude,
+                                    city="Bordeaux", city_code=33000,
+                                    name=f"step {day}.{rank}",
+                                    uuid=f"{day}.{rank}"))
+        itinerary[-1].day, itinerary[-1].rank = day, rank
+    return itinerary
+
+
+def test_recommendations_return_itinerary_and_build_map_lazily():
+    with patch("navigo.app.main.reference_data"), \
+            patch("navigo.app.main.plan_trip") as mock_plan_trip, \
+            patch("navigo.app.plans.create_dash_app") as mock_create_dash_app:
+        # shuffled itinerary, as returned by compute_itinerary
+        mock_plan_trip.return_value = (make_itinerary()[::-1], mock_WCs[:1])
+
+        response = client.post("/recommendations/", json={
+            "trip_zone": "33000",
+            "trip_start": "2024-01-08",
+            "trip_duration": "2",
+            "favorite_category_poi_type_list": [],
+            "favorite_category_poi_theme_list": [],
+            "favorite_restaurant_categories": [],
+            "favorite_hosting_categories": [],
+            "sensitivity_to_weather": "false",
+            "days_on_hiking": "0",
+        })
+        assert response.status_code == 200
+        plan = response.json()
+        assert [d["day"] for d in plan["days"]] == [1, 2]
+        steps = plan["days"][0]["steps"]
+        assert [(s["rank"], s["point"]["type"]) for s in steps] == \
+            [(1, "POI"), (2, "Restaurant"), (3, "Hosting")]
+        assert steps[0]["leg_distance"] is None
+        # 0.01 degree of latitude
+        assert steps[1]["leg_distance"] == pytest.approx(1.112, abs=0.001)
+        assert plan["days"][0]["distance"] == pytest.approx(2.224, abs=0.002)
+        assert plan["distance"] == pytest.approx(3.336, abs=0.003)
+
+        # no map until it is requested
+        mock_create_dash_app.assert_not_called()
+        # the server response is the WSGI app of the Dash map
+        mock_create_dash_app.return_value.server.side_effect = \
+            lambda environ, start_response: (
+                start_response("200 OK", [("Content-Type", "text/html")]),
+                [environ["PATH_INFO"].encode()])[1]
+        for _ in range(2):
+            response = client.get(plan["map_url"])
+            assert response.status_code == 200
+            assert response.text == "/"
+        mock_create_dash_app.assert_called_once()
+        assert mock_create_dash_app.call_args.kwargs[
+            "requests_pathname_prefix"] == plan["map_url"]
+
+        assert client.get("/dash/unknown/").status_code == 404
+        # the maps of the other plans are not listed
+        assert client.get("/dash/", follow_redirects=False
+                          ).status_code == 404
+
+
+def test_reference_refresh_needs_token():
+    with patch("navigo.app.main.reference_data.refresh") as mock_refresh:
+        mock_refresh.return_value.loaded_at = 1
+        assert client.post("/data/reference/refresh").status_code == 403
+        with patch("navigo.app.main.REFERENCE_REFRESH_TOKEN", "secret"):
+            assert client.post(
+                "/data/reference/refresh",
+                headers={"X-Refresh-Token": "wrong"}).status_code == 403
+            response = client.post("/data/reference/refresh",
+                                   headers={"X-Refresh-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"loaded_at": 1}
+    mock_refresh.assert_called_once()
@@ -0,0 +1,30 @@
+from navigo.app.cache import ResponseCache, etag_matches
+
+
+def test_lru_bounded_by_size():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', b'aaaa', 'application/json')
+    cache.put('b', b'bbbb', 'application/json')
+    # a is now the most recently used
+    assert cache.get('a').body == b'aaaa'
+
+    cache.put('c', b'cccc', 'application/json')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.size == 8
+
+    # too large to be cached
+    entry = cache.put('d', b'd' * 11, 'application/json')
+    assert entry.etag and cache.get('d') is None and len(cache) == 2
+
+
+def test_etag_matches():
+    cache = ResponseCache(max_bytes=10)
+    etag = cache.put('a', b'aaaa', 'application/json').etag
+    assert etag.startswith('W/"')
+    assert etag_matches(etag, etag)
+    # weak comparison
+    assert etag_matches(f'"other", {etag.removeprefix("W/")}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
@@ -0,0 +1,65 @@
+from unittest.mock import patch
+
+from navigo.communes import CommunesTable, build_table, normalize_name, \
+    read_laposte_csv
+
+ROWS = [
+    (33000, 'BORDEAUX', 44.851895, -0.587877),
+    (33100, 'BORDEAUX', 44.851895, -0.587877),
+    (33130, 'BEGLES', 44.808127, -0.548045),
+    (33330, 'ST EMILION', 44.903040, -0.162940),
+    (75001, 'PARIS 01', 48.862550, 2.336443),
+]
+
+
+def make_table(tmp_path):
+    build_table(ROWS, tmp_path)
+    return CommunesTable(tmp_path)
+
+
+def test_normalize_name():
+    assert normalize_name("Saint-Émilion") == "ST EMILION"
+    assert normalize_name(" bordeaux ") == "BORDEAUX"
+
+
+def test_zip_to_name_and_name_to_zip(tmp_path):
+    table = make_table(tmp_path)
+    assert len(table) == len(ROWS)
+    assert table.get_cityname(33130) == 'BEGLES'
+    assert table.get_cityname(12345) is None
+    assert table.get_zipcode('Bordeaux') == 33000
+    assert table.get_zipcode('Saint-Émilion') == 33330
+    assert table.get_zipcode('Nowhere') is None
+
+
+def test_nearby_zipcodes(tmp_path):
+    table = make_table(tmp_path)
+    assert table.get_nearby_zipcodes(33000, 10) == {33000, 33100, 33130}
+    assert table.get_nearby_zipcodes(33000, 50) == \
+        {33000, 33100, 33130, 33330}
+    assert table.get_nearby_zipcodes(12345, 50) == set()
+
+
+def test_read_laposte_csv(tmp_path):
+    csv_path = tmp_path / 'laposte.csv'
+    csv_path.write_text(
+        "#Code_commune_INSEE;Nom_commune;Code_postal;Ligne_5;"
+        "Libellé_d_acheminement;coordonnees_gps\n"
+        "33063;BORDEAUX;33000;;BORDEAUX;44.851895, -0.587877\n"
+        "33063;BORDEAUX;33000;;BORDEAUX;44.851895, -0.587877\n"
+        "98799;ILE DE CLIPPERTON;98799;;ILE DE CLIPPERTON;\n",
+        encoding='utf-8')
+    assert read_laposte_csv(csv_path) == \
+        [(33000, 'BORDEAUX', 44.851895, -0.587877)]
+
+
+def test_names_are_indexed_when_the_table_is_loaded(tmp_path):
+    build_table(ROWS + [(33340, 'SAINT-EMILION', 44.9, -0.16)], tmp_path)
+    with patch("navigo.communes.normalize_name",
+               wraps=normalize_name) as mock_normalize_name:
+        table = CommunesTable(tmp_path)
+        # once by distinct name
+        assert mock_normalize_name.call_count == 5
+        assert table.get_zipcode('saint emilion') == 33330
+        assert table.get_zipcode('Bordeaux') == 33000
+        assert mock_normalize_name.call_count == 7
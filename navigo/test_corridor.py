@@ -0,0 +1,136 @@
+import random
+from unittest.mock import patch
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from navigo.corridor import GridIndex, segment_distances_m, \
+    select_points_along_itinerary
+from navigo.db import get_wc_along_itinerary
+from navigo.planner.models import POI, Hosting, WC, db_raw_to_wc
+from navigo.settings import MARIADB_WC_TABLE
+from navigo.snapshot import SnapshotStore, publish, write_department
+
+
+def make_itinerary():
+    # day 1 goes east along latitude 44.84, day 2 goes north
+    return [
+        POI(longitude=-0.58, latitude=44.84, city="Bordeaux",
+            city_code=33000, uuid="p1", day=1, rank=1),
+        Hosting(longitude=-0.56, latitude=44.84, city="Bordeaux",
+                city_code=33000, uuid="h1", day=1, rank=2),
+        POI(longitude=-0.56, latitude=44.85, city="Bordeaux",
+            city_code=33000, uuid="p2", day=2, rank=1),
+        POI(longitude=-0.56, latitude=44.87, city="Bordeaux",
+            city_code=33300, uuid="p3", day=2, rank=2),
+    ]
+
+
+def make_wc(uuid, latitude, longitude):
+    return WC(longitude=longitude, latitude=latitude, city="Bordeaux",
+              city_code=33000, uuid=uuid)
+
+
+def test_select_points_along_itinerary():
+    toilets = [
+        make_wc("far", 44.80, -0.57),
+        make_wc("day-2", 44.86, -0.5605),
+        make_wc("day-1", 44.8405, -0.57),
+        # close to the end of day 1 and to the start of day 2
+        make_wc("overnight", 44.8402, -0.5601),
+        make_wc("off-the-leg", 44.8405, -0.59),
+    ]
+
+    selected = select_points_along_itinerary(make_itinerary(), toilets, 200)
+
+    assert [(t.uuid, t.day) for t in selected] == [
+        ("day-1", 1), ("overnight", 1), ("day-2", 2)]
+    # points are copied
+    assert toilets[2].day is None
+
+
+def test_grid_index_finds_same_points_as_full_scan():
+    random.seed(1)
+    lats = [44.8 + random.random() * 0.1 for _ in range(2000)]
+    lons = [-0.6 + random.random() * 0.1 for _ in range(2000)]
+    index = GridIndex(lats, lons, 300 / 111320)
+    start, end = (44.82, -0.59), (44.87, -0.53)
+
+    d_lat, d_lon = 300 / 111320, 300 / 111320 / np.cos(np.radians(44.82))
+    candidates = index.query(44.82 - d_lat, -0.59 - d_lon,
+                             44.87 + d_lat, -0.53 + d_lon)
+    near = candidates[segment_distances_m(
+        index.latitudes[candidates], index.longitudes[candidates],
+        start, end) <= 300]
+    all_near = np.flatnonzero(
+        segment_distances_m(lats, lons, start, end) <= 300)
+
+    assert sorted(near) == list(all_near)
+    assert 0 < len(near) < len(candidates) < len(lats)
+
+
+def test_wc_along_itinerary_from_snapshot(tmp_path):
+    toilets = [make_wc("day-1", 44.8405, -0.57), make_wc("far", 44.80, -0.57)]
+    store = SnapshotStore(tmp_path, "v1")
+    write_department(store.department_path("33"), "v1", "33",
+                     {"wc": toilets})
+    publish(tmp_path, "v1")
+
+    with patch("navigo.db.get_snapshot_store",
+               return_value=SnapshotStore(tmp_path)), \
+            patch("navigo.db.get_wc_by_zone") as mock_get_wc_by_zone:
+        selected = get_wc_along_itinerary(make_itinerary(), 200)
+
+    assert [(t.uuid, t.day) for t in selected] == [("day-1", 1)]
+    mock_get_wc_by_zone.assert_not_called()
+    assert get_wc_along_itinerary([], 200) == []
+
+
+def make_wc_engine(rows, coordinates=True):
+    engine = create_engine("sqlite://")
+    with engine.begin() as con:
+        con.execute(text(
+            f"CREATE TABLE {MARIADB_WC_TABLE} (UUID TEXT, NAME TEXT, "
+            f"CITY TEXT, POSTAL_CODE INTEGER"
+            f"{', LATITUDE REAL, LONGITUDE REAL' if coordinates else ''})"))
+        for uuid, postal_code, latitude, longitude in rows:
+            con.execute(text(
+                f"INSERT INTO {MARIADB_WC_TABLE} VALUES (:uuid, 'wc', "
+                f"'Bordeaux', :postal_code"
+                f"{', :latitude, :longitude' if coordinates else ''})"),
+                {"uuid": uuid, "postal_code": postal_code,
+                 "latitude": latitude, "longitude": longitude})
+    return engine
+
+
+def test_wc_along_itinerary_from_bounding_boxes():
+    rows = [("day-1", 33000, 44.8405, -0.57),
+            ("day-2", 33300, 44.86, -0.5605),
+            ("far", 33000, 44.80, -0.57),
+            ("other-commune", 33800, 44.8405, -0.571)]
+    engine = make_wc_engine(rows)
+    fetched = []
+
+    def keep_fetched(db_raw):
+        fetched.append(db_raw['UUID'])
+        return db_raw_to_wc(db_raw)
+
+    with patch("navigo.db.get_snapshot_store", return_value=None), \
+            patch("navigo.db.get_engine", return_value=engine), \
+            patch("navigo.db.db_raw_to_wc", side_effect=keep_fetched):
+        selected = get_wc_along_itinerary(make_itinerary(), 200)
+    assert [(t.uuid, t.day) for t in selected] == [("day-1", 1),
+                                                  ("day-2", 2)]
+    # only the toilets in the bounding boxes of the legs are hydrated
+    assert set(fetched) == {"day-1", "day-2"}
+
+    # tables without coordinates columns are read by postal codes
+    engine = make_wc_engine(rows, coordinates=False)
+    locations = {uuid: (lat, lon) for uuid, _, lat, lon in rows}
+    with patch("navigo.db.get_snapshot_store", return_value=None), \
+            patch("navigo.db.get_engine", return_value=engine), \
+            patch("navigo.planner.models.get_neo4j_coordinates",
+                  side_effect=lambda uuid, label: locations[uuid]):
+        selected = get_wc_along_itinerary(make_itinerary(), 200)
+    assert [(t.uuid, t.day) for t in selected] == [("day-1", 1),
+                                                  ("day-2", 2)]
@@ -0,0 +1,139 @@
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from navigo.db import ORM_POINT_QUERIES, count_points, expand_zone_search, \
+    get_points_at, get_points_page, get_zone_filter, iter_points_by_zone, \
+    query_pois_by_zone
+from navigo.planner.models_DB_ORM import Base, Poi, PoiType, PoiTheme
+
+
+def make_session(nb_pois):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+
+    types = [PoiType(f"type_{i}") for i in range(3)]
+    themes = [PoiTheme(f"theme_{i}") for i in range(2)]
+    for i in range(nb_pois):
+        poi = Poi(UUID=f"poi-{i}", PETS_ALLOWED=None,
+                  REDUCED_MOBILITY_ACCESS=None, WEBPAGE_LINK=None,
+                  IMAGE_LINK=None, CITY="Bordeaux", POSTAL_CODE=33000,
+                  POSTAL_ADDRESS=f"{i} rue Sainte-Catherine",
+                  DATATOURISME_ID=f"dt-{i}", LAST_UPDATE=None)
+        poi.LOCATION = "POINT(-0.57 44.84)"
+        poi.POI_TYPES = types[:i % 3 + 1]
+        poi.POI_THEMES = themes[:i % 2 + 1]
+        session.add(poi)
+    session.commit()
+    session.expunge_all()
+    return engine, session
+
+
+def count_statements(engine, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def test_poi_types_and_themes_are_eager_loaded():
+    for nb_pois in (5, 50):
+        engine, session = make_session(nb_pois)
+        result = {}
+
+        def load_pois():
+            pois = query_pois_by_zone(session, [33000], nb_pois)
+            # what db_raw_to_poi reads for each POI
+            result['names'] = [
+                (sorted(t.NAME for t in poi.POI_TYPES),
+                 sorted(t.NAME for t in poi.POI_THEMES))
+                for poi in pois
+            ]
+
+        statements = count_statements(engine, load_pois)
+        # one SELECT for POI, one for types and one for themes
+        assert len(statements) == 3
+        assert len(result['names']) == nb_pois
+        assert result['names'][2] == (
+            ["type_0", "type_1", "type_2"], ["theme_0"])
+        session.close()
+
+
+def test_keyset_pages_hydrate_only_returned_rows():
+    engine, session = make_session(25)
+    session.close()
+    hydrated = []
+
+    def hydrate(row):
+        hydrated.append(row.UUID)
+        return row.UUID
+
+    with patch("navigo.db.get_engine", return_value=engine), \
+            patch("navigo.db.get_snapshot_store", return_value=None), \
+            patch.dict(ORM_POINT_QUERIES, {'poi': (Poi, hydrate)}):
+        uuids, after = [], None
+        while True:
+            page, after = get_points_page('poi', [33000], 10, after)
+            uuids.extend(page)
+            if after is None:
+                break
+        assert uuids == sorted(f"poi-{i}" for i in range(25))
+        # the extra row of each page (LIMIT size + 1) is not hydrated
+        assert len(hydrated) == 25
+
+        hydrated.clear()
+        assert list(iter_points_by_zone('poi', [33000], batch_size=7)) == \
+            uuids
+        assert len(hydrated) == 25
+
+
+def test_zone_search_expands_radius_with_cached_zone_filters():
+    get_zone_filter.cache_clear()
+    with patch("navigo.db.get_zone_area", return_value=None), \
+            patch("navigo.db.get_nearby_communes",
+                  side_effect=lambda zone, rayon: {zone, zone + rayon}) \
+            as mock_get_nearby_communes:
+        fetched = []
+
+        def fetch(zone_filter):
+            fetched.append(zone_filter)
+            return list(zone_filter) if 33020 in zone_filter else []
+
+        for _ in range(2):
+            fetched.clear()
+            points, zone_filter = expand_zone_search(33000, 10, fetch, 1)
+            assert zone_filter == (33000, 33020)
+            assert fetched == [(33000, 33010), (33000, 33015),
+                               (33000, 33020)]
+        # the second search only uses cached postal codes
+        assert mock_get_nearby_communes.call_count == 3
+    get_zone_filter.cache_clear()
+
+
+def test_offset_pages_hydrate_only_returned_rows():
+    engine, session = make_session(25)
+    session.close()
+    hydrated = []
+
+    def hydrate(row):
+        hydrated.append(row.UUID)
+        return row.UUID
+
+    with patch("navigo.db.get_engine", return_value=engine), \
+            patch("navigo.db.get_snapshot_store", return_value=None), \
+            patch.dict(ORM_POINT_QUERIES, {'poi': (Poi, hydrate)}):
+        assert count_points('poi', [33000]) == 25
+        assert count_points('poi', [75001]) == 0
+        page = get_points_at('poi', [33000], 20, 10)
+
+    assert page == sorted(f"poi-{i}" for i in range(25))[20:]
+    assert hydrated == page
@@ -0,0 +1,62 @@
+import time
+from unittest.mock import patch
+
+from navigo.external import get_cityname, get_external_data
+
+
+def slow(result, seconds=1):
+    def fetch(*args, **kwargs):
+        time.sleep(seconds)
+        return result
+    return fetch
+
+
+def fail(*args, **kwargs):
+    raise ConnectionError("upstream down")
+
+
+def test_external_data_of_slow_and_failing_sources():
+    with patch("navigo.external.get_cityname", return_value="Bordeaux"), \
+            patch("navigo.external.get_most_popular_poi_by_zone",
+                  side_effect=slow(["poi"])), \
+            patch("navigo.external.get_most_popular_restaurant_by_zone",
+                  side_effect=fail), \
+            patch("navigo.external.get_weather_forecast_by_zone",
+                  return_value=False) as mock_weather:
+        start = time.monotonic()
+        data = get_external_data(33000, "2024-01-08", 7, True, timeout=0.3)
+
+    assert time.monotonic() - start < 0.8
+    assert data.missing == ["top_poi_list", "top_restaurant_list"]
+    assert data.top_poi_list == [] and data.top_restaurant_list == []
+    assert data.weather_forecast is False
+    # the requests end with the deadline
+    assert 0 < mock_weather.call_args.kwargs["timeout"] <= 0.3
+    assert mock_weather.call_args.kwargs["city_name"] == "Bordeaux"
+
+
+def test_external_data_without_city_name():
+    for get_city in (slow("Bordeaux"), fail):
+        with patch("navigo.external.get_cityname", side_effect=get_city), \
+                patch("navigo.external.get_most_popular_poi_by_zone") \
+                as mock_poi:
+            start = time.monotonic()
+            data = get_external_data(33000, "2024-01-08", 7, True,
+                                     timeout=0.3)
+
+        assert time.monotonic() - start < 0.8
+        assert data.missing == ["top_poi_list", "top_restaurant_list",
+                                "weather_forecast"]
+        assert data.weather_forecast is True
+        assert data.top_poi_list == [] and data.top_restaurant_list == []
+        mock_poi.assert_not_called()
+
+
+def test_city_name_request_has_a_timeout():
+    with patch("navigo.external.get_communes_table", return_value=None), \
+            patch("navigo.external.transport.get") as mock_get:
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "cities": [{"city": "BORDEAUX", "code": 33000}]}
+        assert get_cityname(33000, timeout=2) == "BORDEAUX"
+    assert mock_get.call_args.kwargs["timeout"] == 2
@@ -0,0 +1,71 @@
+from unittest.mock import patch
+
+from navigo.itinerary import compute_itinerary
+from navigo.planner import routing
+from navigo.planner.models import POI, Restaurant, Hosting, Trail
+from navigo.planner.routing import PlanDistances, optimise_itinerary
+
+
+def make_point(point_class, uuid, latitude, longitude, cluster=None):
+    return point_class(longitude=longitude, latitude=latitude,
+                       city="Bordeaux", city_code=33000, uuid=uuid,
+                       cluster=cluster)
+
+
+def test_compute_itinerary_fills_day_template():
+    # 5 POIs in cluster 0 (more than the 4 POI slots), 1 in cluster 1
+    pois = [make_point(POI, f"a{i}", 44.840, -0.580 + i * 0.002, 0)
+            for i in range(5)] + [make_point(POI, "b0", 44.860, -0.570, 1)]
+    restaurants = [make_point(Restaurant, "r0", 44.841, -0.577),
+                   make_point(Restaurant, "r1", 44.841, -0.571)]
+    hostings = [make_point(Hosting, "h0", 44.850, -0.570)]
+    trails = [make_point(Trail, "t0", 44.855, -0.570)]
+
+    itinerary, toilets = compute_itinerary(
+        pois[0], pois, restaurants, hostings, trails, ["wc"],
+        day_template="POI,POI,LUNCH,POI,POI,DINNER,TRAIL,HOSTING")
+
+    assert toilets == ["wc"]
+    steps = sorted(itinerary, key=lambda p: (p.day, p.rank))
+    assert [(p.uuid, p.day, p.rank) for p in steps] == [
+        ("a0", 1, 1), ("a1", 1, 2), ("a2", 1, 3), ("r0", 1, 4),
+        ("a3", 1, 5), ("a4", 1, 6), ("r1", 1, 7), ("t0", 1, 8),
+        ("h0", 1, 9),
+        ("b0", 2, 1), ("r1", 2, 2), ("t0", 2, 3), ("h0", 2, 4)]
+    # the selected points are copied
+    assert pois[1].day is None
+
+
+def test_compute_itinerary_without_candidates():
+    pois = [make_point(POI, "a0", 44.840, -0.580, 0),
+            make_point(POI, "a1", 44.840, -0.578, 0)]
+
+    itinerary, _ = compute_itinerary(pois[1], pois, [], [], [])
+
+    assert [(p.uuid, p.day, p.rank) for p in itinerary] == [
+        ("a1", 1, 1), ("a0", 1, 2)]
+
+
+def test_distances_are_computed_once_by_plan():
+    pois = [make_point(POI, f"a{i}", 44.840, -0.580 + i * 0.003, i // 3)
+            for i in range(6)]
+    restaurants = [make_point(Restaurant, "r0", 44.842, -0.576),
+                   make_point(Restaurant, "r1", 44.838, -0.568)]
+    hostings = [make_point(Hosting, "h0", 44.845, -0.570)]
+
+    with patch("navigo.planner.routing.distance_matrix",
+               wraps=routing.distance_matrix) as mock_distance_matrix:
+        distances = PlanDistances(pois, restaurants, hostings)
+        itinerary, _ = compute_itinerary(pois[2], pois, restaurants,
+                                         hostings, [], distances=distances)
+        shared = optimise_itinerary(itinerary, restaurants, hostings,
+                                    distances=distances)
+
+    assert mock_distance_matrix.call_count == 1
+    # same itinerary as with distances of its own points
+    itinerary_alone, _ = compute_itinerary(pois[2], pois, restaurants,
+                                           hostings, [])
+    alone = optimise_itinerary(itinerary_alone, restaurants, hostings)
+    assert [(p.uuid, p.day, p.rank) for p in shared[0]] == \
+        [(p.uuid, p.day, p.rank) for p in alone[0]]
+    assert shared[1] == alone[1]
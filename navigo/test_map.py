@@ -0,0 +1,68 @@
+from navigo.map import create_dash_app, create_figure, get_toilets_data, \
+    preprocess_geospatial_data
+from navigo.planner.models import POI, Restaurant, Hosting, WC
+
+
+def make_trip(nb_days):
+    points = []
+    for day in range(1, nb_days + 1):
+        day_points = [POI] * 4 + [Restaurant] * 2 + [Hosting]
+        for rank, point_class in enumerate(day_points, start=1):
+            points.append(point_class(
+                longitude=-0.57 + day * 0.01 + rank * 0.001,
+                latitude=44.83 + rank * 0.001,
+                city="Bordeaux", city_code=33000,
+                name=f"{point_class.__name__} {day}.{rank}",
+                uuid=f"{day}-{rank}", day=day, rank=rank))
+    return points
+
+
+def test_create_figure_traces_by_day():
+    nb_days = 7
+    df = preprocess_geospatial_data(make_trip(nb_days))
+    fig = create_figure(df)
+
+    # a marker trace by point type and day, a line trace and a label trace
+    # by day and a (hidden) trace for the start of each day
+    assert len(fig.data) <= 3 * nb_days + 2 * nb_days + nb_days
+    markers = [t for t in fig.data if t.meta["layer"] == "points"]
+    assert sum(len(t.lon) for t in markers) == len(df)
+    lines = [t for t in fig.data if t.mode == "lines"]
+    assert len(lines) == nb_days
+    # 2 points and a None separator by leg
+    assert sum(len(t.lon) for t in lines) == 3 * (len(df) - 1)
+    labels = [t for t in fig.data if t.mode == "text"]
+    assert len(labels) == nb_days
+    assert sum(len(t.text) for t in labels) == len(df) - 1
+    assert labels[1].text[0] == "Day : 2<br>From Hosting 1.7 to POI 2.1"
+
+
+def test_dash_app_filters_map_in_browser():
+    toilets = [WC(longitude=-0.56, latitude=44.83, city="Bordeaux",
+                  city_code=33000, uuid="wc", day=2)]
+    app = create_dash_app(make_trip(3), toilets)
+
+    # no callback runs on the server
+    assert "callback" not in app.callback_map["map-fig.figure"]
+    [callback] = app._callback_list
+    assert callback["clientside_function"]["function_name"]
+
+    layout = app.server.test_client().get("/_dash-layout").json
+    components = {c["props"]["id"]: c["props"]
+                  for c in layout["props"]["children"] if "id" in c["props"]}
+    views = components["map-views"]["data"]
+    assert set(views) == {"all", "1", "2", "3"}
+    metas = [t["meta"] for t in components["map-fig"]["figure"]["data"]]
+    assert {"layer": "WC", "day": 2} in metas
+    assert {"layer": "start", "day": 3} in metas
+
+
+def test_preprocess_geospatial_data_symbols_and_colors():
+    df = preprocess_geospatial_data(make_trip(2))
+
+    assert list(df["symbol"]) == ["🏁"] + [" 🏛️"] * 3 + ["🍽️"] * 2 + \
+        ["🛏️"] + [" 🏛️"] * 4 + ["🍽️"] * 2 + ["🚀"]
+    assert list(df["colors"]) == ["blue"] * 7 + ["green"] * 7
+    assert list(get_toilets_data([]).columns) == [
+        "longitude", "latitude", "city", "city_code", "type", "name",
+        "colors", "day", "symbol"]
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+
+from navigo.planner.models import UserData
+from navigo.planner.planner import get_planning_pool, plan_trips
+
+
+# planning functions run in a real pool of processes, they have to be
+# found by name in the processes
+def crash_planning(user_input, internal_nodes_data, external_data):
+    os._exit(1)
+
+
+def zone_itinerary(user_input, internal_nodes_data, external_data):
+    return [user_input.trip_zone, os.getpid()]
+
+
+def test_plan_trips_shares_fetches_by_zone():
+    user_inputs = [
+        UserData(trip_zone=33000, favorite_restaurant_categories=["Bistro"]),
+        UserData(trip_zone=75001, trip_duration=2),
+        UserData(trip_zone=33000, trip_duration=3,
+                 favorite_restaurant_categories=["Pizzeria", "Bistro"]),
+        UserData(trip_zone=64200),
+        UserData(trip_zone=40000),
+    ]
+
+    def fetch(zone, rayon, days, restaurant_categories, hosting_categories):
+        if zone == 64200:
+            raise ConnectionError("database unreachable")
+        return f"points of {zone}"
+
+    def external(zone, *key):
+        if zone == 40000:
+            raise ConnectionError("city of zone not found")
+        return (zone, *key)
+
+    with ThreadPoolExecutor(2) as pool, \
+            patch("navigo.planner.planner.get_planning_pool",
+                  return_value=pool), \
+            patch("navigo.planner.planner.get_db_internal_nodes_data_by_zone",
+                  side_effect=fetch) as mock_fetch, \
+            patch("navigo.planner.planner.get_external_data",
+                  side_effect=external) as mock_external_data, \
+            patch("navigo.planner.planner.plan_trip_itinerary",
+                  side_effect=lambda u, points, external: u.trip_zone), \
+            patch("navigo.planner.planner.get_wc_along_itinerary",
+                  side_effect=lambda zone: f"toilets of {zone}"):
+        results = plan_trips(user_inputs)
+
+    assert results[:3] == [(33000, "toilets of 33000"),
+                           (75001, "toilets of 75001"),
+                           (33000, "toilets of 33000")]
+    assert isinstance(results[3], ConnectionError)
+    assert isinstance(results[4], ConnectionError)
+    # one fetch by zone, for the longest trip and all favorites
+    assert mock_fetch.call_count == 4
+    mock_fetch.assert_any_call(33000, 10, 7, ["Bistro", "Pizzeria"], [])
+    # trips of 33000 have different durations
+    assert mock_external_data.call_count == 4
+
+
+def test_plan_trips_recreates_broken_pool():
+    user_inputs = [UserData(trip_zone=33000), UserData(trip_zone=75001)]
+    get_planning_pool.cache_clear()
+    try:
+        with patch("navigo.planner.planner.PLANNING_PROCESSES", 1), \
+                patch("navigo.planner.planner."
+                      "get_db_internal_nodes_data_by_zone",
+                      return_value="points"), \
+                patch("navigo.planner.planner.get_external_data",
+                      return_value="external"), \
+                patch("navigo.planner.planner.get_wc_along_itinerary",
+                      return_value=[]):
+            with patch("navigo.planner.planner.plan_trip_itinerary",
+                       crash_planning):
+                results = plan_trips(user_inputs)
+            assert all(isinstance(r, BrokenProcessPool) for r in results)
+
+            with patch("navigo.planner.planner.plan_trip_itinerary",
+                       zone_itinerary):
+                results = plan_trips(user_inputs)
+            assert [r[0][0] for r in results] == [33000, 75001]
+            assert results[0][0][1] != os.getpid()
+    finally:
+        get_planning_pool().shutdown()
+        get_planning_pool.cache_clear()
@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+import pytest
+
+from navigo.reference import ReferenceData, ReferenceDataCache, \
+    ReferenceDataError
+
+
+def make_loader(calls):
+    def loader():
+        calls.append(1)
+        return ReferenceData(
+            poi_types_by_category={
+                'Culture': ['Museum', 'Theater'],
+                'Nature': ['Park'],
+                'Other': ['Store']},
+            poi_themes_by_category={'Food': ['Wine']},
+            restaurant_types=['pizza'],
+            hosting_types=['hotel'],
+            loaded_at=len(calls))
+    return loader
+
+
+def test_reference_data_is_loaded_once():
+    calls = []
+    cache = ReferenceDataCache(loader=make_loader(calls), ttl=0)
+    for _ in range(10):
+        ref = cache.get()
+    assert len(calls) == 1
+    assert ref.poi_type_categories == ['Culture', 'Nature']
+    assert ref.expand_poi_type_categories(['Nature', 'Culture']) == \
+        ['Park', 'Museum', 'Theater']
+    assert ref.expand_poi_theme_categories(['Unknown']) == []
+
+    # refresh on demand
+    assert cache.refresh().loaded_at == 2
+    assert len(calls) == 2
+
+
+def test_reference_data_expires():
+    calls = []
+    cache = ReferenceDataCache(loader=make_loader(calls), ttl=60)
+    cache.get()
+    # loaded_at of the fake loader is far in the past
+    cache.get()
+    assert len(calls) == 2
+
+
+def test_failed_reload_keeps_previous_data():
+    calls = []
+    loader = make_loader(calls)
+
+    def failing_loader():
+        if len(calls) == 1:
+            calls.append(1)
+            raise ReferenceDataError("empty reference data: hosting_types")
+        return loader()
+
+    cache = ReferenceDataCache(loader=failing_loader, ttl=60)
+    cache._data = loader()
+    # expired: the reload fails, the loaded data are kept
+    assert cache.get().loaded_at == 1
+    # and the reload is tried again
+    assert cache.get().loaded_at == 3
+    assert len(calls) == 3
+
+
+def test_empty_reference_data_are_not_loaded():
+    with patch("navigo.reference.get_poi_types", return_value=[]), \
+            patch("navigo.reference.get_poi_themes", return_value=[]), \
+            patch("navigo.reference.get_restaurants_types",
+                  return_value=[{"TYPE": "pizza"}]), \
+            patch("navigo.reference.get_hostings_types", return_value=[]):
+        cache = ReferenceDataCache(ttl=0)
+        with pytest.raises(ReferenceDataError):
+            cache.get()
+    assert cache._data is None
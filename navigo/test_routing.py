@@ -0,0 +1,139 @@
+import itertools
+import random
+
+import pytest
+
+from navigo.planner.models import POI, Restaurant, Hosting
+from navigo.planner.routing import choose_hostings, day_slots, \
+    day_slots_after, distance_matrix, greedy_day, nearest_neighbour_path, \
+    optimise_itinerary, optimise_path, parse_day_template, path_length, \
+    plan_day
+
+
+def random_point(point_class, i, latitude, longitude, spread):
+    return point_class(longitude=longitude + random.gauss(0, spread),
+                       latitude=latitude + random.gauss(0, spread),
+                       city="Bordeaux", city_code=33000, uuid=str(i))
+
+
+def make_point(point_class, uuid, latitude, longitude, day=None, rank=None):
+    return point_class(longitude=longitude, latitude=latitude,
+                       city="Bordeaux", city_code=33000, uuid=uuid,
+                       day=day, rank=rank)
+
+
+def test_optimise_path_is_mostly_shortest_on_small_days():
+    random.seed(2)
+    nb_shortest = 0
+    for _ in range(50):
+        points = [random_point(POI, i, 44.84, -0.57, 0.01) for i in range(7)]
+        dist = distance_matrix(points)
+        shortest = min(path_length([0, *others], dist)
+                       for others in itertools.permutations(range(1, 7)))
+        path = optimise_path(0, list(range(1, 7)), dist)
+        assert sorted(path) == list(range(7)) and path[0] == 0
+        assert path_length(path, dist) <= path_length(
+            nearest_neighbour_path(0, list(range(1, 7)), dist), dist)
+        nb_shortest += path_length(path, dist) < shortest + 1e-9
+    assert nb_shortest >= 45
+
+
+def test_day_slots_follow_template():
+    template = parse_day_template("POI,POI,LUNCH,POI,POI,DINNER,HOSTING")
+    candidates = {'restaurant': [10], 'hosting': [11]}
+
+    def slots(nb_pois, candidates=candidates):
+        return "".join(slot[0] for slot in
+                       day_slots(template, nb_pois, candidates))
+
+    # days of compute_itinerary before day templates
+    assert [slots(n) for n in (4, 3, 2, 1)] == [
+        "PPLPPDH", "PPLPDH", "PLPDH", "PLH"]
+    assert slots(0) == "H"
+    assert slots(7) == "PPPPLPPPDH"
+    assert slots(3, {'hosting': [11]}) == "PPPH"
+    with pytest.raises(ValueError):
+        parse_day_template("LUNCH,POI")
+    with pytest.raises(ValueError):
+        parse_day_template(["POI", "BRUNCH"])
+
+
+def test_plan_day_is_never_longer_than_greedy_chain():
+    random.seed(4)
+    for _ in range(200):
+        nb_pois = random.randint(1, 10)
+        points = [random_point(POI, i, 44.84, -0.57, 0.01)
+                  for i in range(nb_pois)] + \
+            [random_point(Restaurant, i, 44.84, -0.57, 0.015)
+             for i in range(6)] + \
+            [random_point(Hosting, i, 44.84, -0.57, 0.02) for i in range(4)]
+        dist = distance_matrix(points)
+        pois = list(range(1, nb_pois))
+        candidates = {'restaurant': list(range(nb_pois, nb_pois + 6)),
+                      'hosting': list(range(nb_pois + 6, nb_pois + 10))}
+
+        nodes, distance = plan_day(0, day_slots_after(0, pois, candidates),
+                                   pois, candidates, dist)
+        path = [0] + nodes
+
+        assert distance == path_length(path, dist)
+        assert distance <= path_length(
+            greedy_day(0, pois, candidates, dist), dist) + 1e-9
+        assert sorted(p for p in path if p < nb_pois) == list(range(nb_pois))
+        # POI..., lunch, POI..., dinner, hosting
+        kinds = [type(points[p]).__name__[0] for p in path]
+        nb_first = (nb_pois + 1) // 2
+        assert kinds == ["P"] * nb_first + ["R"] + \
+            ["P"] * (nb_pois - nb_first) + \
+            ["R"] * (nb_pois > 1) + ["H"]
+
+
+def test_optimise_itinerary_reorders_each_day():
+    # POIs of day 1 visited in zig-zag by the greedy chain
+    itinerary = [
+        make_point(POI, "a", 44.840, -0.580, 1, 1),
+        make_point(POI, "c", 44.840, -0.560, 1, 2),
+        make_point(Restaurant, "r1", 44.841, -0.560, 1, 3),
+        make_point(POI, "b", 44.840, -0.570, 1, 4),
+        make_point(POI, "d", 44.840, -0.550, 1, 5),
+        make_point(Restaurant, "r2", 44.841, -0.550, 1, 6),
+        make_point(Hosting, "h1", 44.842, -0.550, 1, 7),
+        make_point(POI, "e", 44.850, -0.550, 2, 1),
+    ]
+    restaurants = [make_point(Restaurant, "r1", 44.8405, -0.565),
+                   make_point(Restaurant, "r2", 44.841, -0.550),
+                   make_point(Restaurant, "r3", 44.851, -0.551)]
+    hostings = [make_point(Hosting, "h1", 44.842, -0.550),
+                make_point(Hosting, "h2", 44.851, -0.549)]
+
+    result, distances = optimise_itinerary(itinerary, restaurants, hostings,
+                                           hosting_change_penalty=0)
+
+    assert [(p.uuid, p.day, p.rank) for p in result] == [
+        ("a", 1, 1), ("b", 1, 2), ("r1", 1, 3), ("c", 1, 4), ("d", 1, 5),
+        ("r2", 1, 6), ("h1", 1, 7), ("e", 2, 1), ("r3", 2, 2), ("h2", 2, 3)]
+    # day 2 starts from the hosting of day 1
+    assert round(distances[1], 2) == 2.6 and round(distances[2], 2) == 1.18
+    # the points of the itinerary are copied
+    assert itinerary[3].rank == 4
+    # with the default penalty, the hosting of day 2 is kept for both nights
+    result, distances = optimise_itinerary(itinerary, restaurants, hostings)
+    assert [p.uuid for p in result if isinstance(p, Hosting)] == ["h2", "h2"]
+    assert round(distances[1] + distances[2], 2) == 4.03
+
+
+def test_choose_hostings_is_optimal():
+    random.seed(6)
+    for _ in range(30):
+        points = [random_point(POI, i, 44.84, -0.57, 0.02) for i in range(8)]
+        dist = distance_matrix(points)
+        befores, afters, hostings = [0, 1, 2], [3, 4, None], [5, 6, 7]
+
+        def cost(chosen):
+            return sum(dist[b, h] + (dist[h, a] if a is not None else 0)
+                       for b, a, h in zip(befores, afters, chosen)) + \
+                0.5 * sum(h != g for h, g in zip(chosen, chosen[1:]))
+
+        chosen = choose_hostings(befores, afters, hostings, dist, 0.5)
+        assert cost(chosen) < min(
+            cost(c) for c in itertools.product(hostings, repeat=3)) + 1e-9
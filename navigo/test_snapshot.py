@@ -0,0 +1,132 @@
+import shutil
+from unittest.mock import patch
+
+import numpy as np
+
+from navigo.db import GeoArea
+from navigo.planner.models import POI, Restaurant, WC
+from navigo.snapshot import POINT_CLASSES, CurrentSnapshot, SnapshotStore, \
+    get_department, publish, write_department
+
+
+def make_store(tmp_path):
+    points = {
+        'poi': [POI(longitude=-0.57, latitude=44.84, city="Bordeaux",
+                    city_code=33000, name="Cathédrale", uuid="poi-1",
+                    type_list=["Church"], theme_list=["Heritage"])],
+        'restaurant': [
+            Restaurant(longitude=-0.58, latitude=44.83, city="Bordeaux",
+                       city_code=33000, name=f"resto {i}", uuid=f"r-{i}",
+                       category=category)
+            for i, category in enumerate(["Pizzeria", "Brasserie", "Bistro"])
+        ],
+        'wc': [WC(longitude=-1.17, latitude=44.66, city="Arcachon",
+                  city_code=33120),
+               None],
+    }
+    store = SnapshotStore(tmp_path, "v1")
+    write_department(store.department_path("33"), "v1", "33", points)
+    publish(tmp_path, "v1")
+    return SnapshotStore(tmp_path)
+
+
+def test_department():
+    assert get_department(33000) == "33"
+    assert get_department(1000) == "01"
+    assert get_department(97400) == "974"
+
+
+def test_points_by_postal_codes(tmp_path):
+    store = make_store(tmp_path)
+    assert store.version == "v1"
+
+    pois = store.get_points('poi', [33000])
+    assert pois == [POI(longitude=-0.57, latitude=44.84, city="Bordeaux",
+                        city_code=33000, name="Cathédrale", uuid="poi-1",
+                        type_list=["Church"], theme_list=["Heritage"])]
+    assert store.get_points('wc', [33120])[0].city == "Arcachon"
+    # departments without snapshot are ignored
+    assert store.get_points('poi', [75001]) == []
+
+
+def test_points_by_area_with_favorites(tmp_path):
+    store = make_store(tmp_path)
+    bordeaux = GeoArea(latitude=44.84, longitude=-0.57, radius=10)
+
+    assert store.get_points('wc', bordeaux) == []
+    restaurants = store.get_points('restaurant', bordeaux, limit=2,
+                                   favorite_categories=["Bistro", "Pizzeria"])
+    assert [r.category for r in restaurants] == ["Bistro", "Pizzeria"]
+
+
+def test_area_reads_only_departments_around_it(tmp_path):
+    store = make_store(tmp_path)
+    write_department(store.department_path("75"), "v1", "75", {
+        'poi': [POI(longitude=2.35, latitude=48.85, city="Paris",
+                    city_code=75001, uuid="poi-2")]})
+    write_department(store.department_path("23"), "v1", "23", {})
+    store = SnapshotStore(tmp_path)
+    assert store.get_bboxes()["33"] == [44.66, -1.17, 44.84, -0.57]
+    assert store.get_bboxes()["23"] is None
+
+    with patch.object(store, "get_table",
+                      wraps=store.get_table) as mock_get_table:
+        pois = store.get_points(
+            'poi', GeoArea(latitude=44.84, longitude=-0.57, radius=10))
+    assert [p.uuid for p in pois] == ["poi-1"]
+    mock_get_table.assert_called_once_with("33")
+
+
+def test_fixed_layout_is_memory_mapped_and_matches_sqlite(tmp_path):
+    store = make_store(tmp_path)
+    bordeaux = GeoArea(latitude=44.84, longitude=-0.57, radius=10)
+
+    table = store.get_table("33")
+    assert isinstance(table.latitudes, np.memmap)
+    assert len(table) == 5
+    from_table = {kind: store.get_points(kind, bordeaux)
+                  for kind in POINT_CLASSES}
+
+    shutil.rmtree(store.department_path("33").with_suffix(''))
+    sqlite_store = SnapshotStore(tmp_path)
+    assert sqlite_store.get_table("33") is None
+    assert {kind: sqlite_store.get_points(kind, bordeaux)
+            for kind in POINT_CLASSES} == from_table
+
+
+def test_pages_by_uuid_read_only_their_points(tmp_path):
+    store = make_store(tmp_path)
+    table = store.get_table("33")
+
+    assert store.count_points('restaurant', [33000]) == 3
+    with patch.object(table, "row_at", wraps=table.row_at) as mock_row_at:
+        page = store.get_points_by_uuid('restaurant', [33000], after="r-0",
+                                        offset=1, limit=5)
+    assert [r.uuid for r in page] == ["r-2"]
+    assert mock_row_at.call_count == 1
+
+    sqlite_store = make_store(tmp_path / "sqlite")
+    shutil.rmtree(sqlite_store.department_path("33").with_suffix(''))
+    sqlite_store = SnapshotStore(tmp_path / "sqlite")
+    bordeaux = GeoArea(latitude=44.84, longitude=-0.57, radius=10)
+    assert sqlite_store.count_points('restaurant', bordeaux) == 3
+    assert [r.uuid for r in sqlite_store.get_points_by_uuid(
+        'restaurant', bordeaux, limit=2)] == ["r-0", "r-1"]
+
+
+def test_published_snapshot_is_served_without_restart(tmp_path):
+    current = CurrentSnapshot(tmp_path, check_interval=60)
+    assert current.get() is None
+
+    make_store(tmp_path)
+    # CURRENT is not read again before check_interval
+    assert current.get() is None
+    current.check_interval = 0
+    store = current.get()
+    assert store.version == "v1" and current.get() is store
+
+    write_department(SnapshotStore(tmp_path, "v2").department_path("33"),
+                     "v2", "33", {})
+    publish(tmp_path, "v2")
+    assert current.get().version == "v2"
+    assert current.get().get_points('poi', [33000]) == []
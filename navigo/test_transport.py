@@ -0,0 +1,95 @@
+import time
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from navigo.transport import ExternalTransport, FixtureNotFound
+
+
+def make_response(status_code, content):
+    response = requests.Response()
+    response.status_code = status_code
+    response.encoding = 'utf-8'
+    response._content = content.encode('utf-8')
+    return response
+
+
+def test_record_then_replay(tmp_path):
+    url = "https://vicopo.selfbuild.fr?code=33000"
+    recorder = ExternalTransport(mode='record', fixtures_dir=tmp_path)
+    with patch("navigo.transport.requests.get") as mock_get:
+        mock_get.return_value = make_response(
+            200, '{"cities": [{"city": "BORDEAUX", "code": 33000}]}')
+        recorder.get(url)
+        mock_get.assert_called_once()
+
+    player = ExternalTransport(mode='replay', fixtures_dir=tmp_path)
+    with patch("navigo.transport.requests.get") as mock_get:
+        response = player.get(url)
+        # replay never uses the network
+        mock_get.assert_not_called()
+
+    assert response.status_code == 200
+    assert response.json()["cities"][0]["city"] == "BORDEAUX"
+
+
+def test_replay_key_depends_on_params_not_headers(tmp_path):
+    url = "https://api.foursquare.com/v3/places/search"
+    recorder = ExternalTransport(mode='record', fixtures_dir=tmp_path)
+    with patch("navigo.transport.requests.get") as mock_get:
+        mock_get.return_value = make_response(200, '{"results": []}')
+        recorder.get(url, params={'near': 'Bordeaux_FR'},
+                     headers={'Authorization': 'secret'})
+
+    player = ExternalTransport(mode='replay', fixtures_dir=tmp_path)
+    assert player.get(url, params={'near': 'Bordeaux_FR'}).json() == \
+        {"results": []}
+    with pytest.raises(FixtureNotFound):
+        player.get(url, params={'near': 'Paris_FR'})
+
+
+def test_missing_fixture_is_a_request_exception(tmp_path):
+    player = ExternalTransport(mode='replay', fixtures_dir=tmp_path)
+    with pytest.raises(requests.exceptions.RequestException):
+        player.get("https://www.villes-voisines.fr/getcp.php?cp=1&rayon=10")
+
+
+def test_latency_injection(tmp_path):
+    url = "https://vicopo.selfbuild.fr?code=33000"
+    ExternalTransport(mode='replay', fixtures_dir=tmp_path)._save(
+        url, None, make_response(200, '{}'))
+
+    player = ExternalTransport(mode='replay', fixtures_dir=tmp_path,
+                               latency_ms=50)
+    start = time.perf_counter()
+    player.get(url)
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ExternalTransport(mode='offline')
+
+
+def test_credentials_are_not_recorded(tmp_path):
+    url = "https://api.openweathermap.org/data/2.5/forecast/daily" \
+        "?q=Bordeaux&cnt=16&appid={}&units=metric"
+    params = {'near': 'Bordeaux_FR', 'client_secret': 'secret-1'}
+    recorder = ExternalTransport(mode='record', fixtures_dir=tmp_path)
+    with patch("navigo.transport.requests.get") as mock_get:
+        mock_get.return_value = make_response(200, '{"list": []}')
+        recorder.get(url.format("key-1"), params)
+        # the request itself keeps its credentials
+        assert "appid=key-1" in mock_get.call_args.args[0]
+
+    fixtures = list(tmp_path.rglob("*.json"))
+    assert len(fixtures) == 1
+    content = fixtures[0].read_text()
+    assert "key-1" not in content and "secret-1" not in content
+
+    # replayed with other credentials
+    player = ExternalTransport(mode='replay', fixtures_dir=tmp_path)
+    response = player.get(url.format("key-2"),
+                          {'near': 'Bordeaux_FR', 'client_secret': 'secret-2'})
+    assert response.json() == {"list": []}
@@ -0,0 +1,93 @@
+import random
+from unittest.mock import patch
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from navigo import walking
+from navigo.communes import haversine_km
+from navigo.planner.models import POI
+from navigo.walking import WalkingGraph, get_walking_graph, \
+    get_zone_walking_graph, write_walking_graph
+
+
+def write_river_graph(path):
+    """grid of 10 x 20 nodes about 100 metres apart, with a river between
+    rows 4 and 5 crossed by a single bridge, on the last column"""
+    lats = np.repeat(44.840 + np.arange(10) * 0.0009, 20)
+    lons = np.tile(-0.580 + np.arange(20) * 0.00127, 10)
+    edges = []
+    for node in range(200):
+        row, col = divmod(node, 20)
+        neighbours = [node + 1] if col < 19 else []
+        if row < 9 and (row != 4 or col == 19):
+            neighbours.append(node + 20)
+        for other in neighbours:
+            edges.append((node, other, 1000 * float(haversine_km(
+                lats[node], lons[node], lats[other], lons[other]))))
+    write_walking_graph(path, lats, lons, edges)
+    return WalkingGraph(path, snap_distance=80, max_leg=10000)
+
+
+def make_poi(latitude, longitude):
+    return POI(longitude=longitude, latitude=latitude, city="Bordeaux",
+               city_code=33000)
+
+
+def test_legs_are_shortest_paths(tmp_path):
+    graph = write_river_graph(tmp_path)
+    csr = csr_matrix((graph.lengths, graph.indices, graph.indptr),
+                     shape=(len(graph), len(graph)))
+    random.seed(3)
+    nodes = random.sample(range(len(graph)), 12)
+    expected = dijkstra(csr, indices=nodes)[:, nodes]
+
+    assert np.allclose([[graph.leg_m(a, b) for b in nodes] for a in nodes],
+                       expected)
+    graph._legs.clear()
+    assert np.allclose(graph.legs_m(nodes), expected)
+    # legs are cached
+    with patch("navigo.walking.dijkstra") as mock_dijkstra:
+        assert np.allclose(graph.legs_m(nodes), expected)
+    mock_dijkstra.assert_not_called()
+
+
+def test_walking_distances_go_around_the_river(tmp_path):
+    graph = write_river_graph(tmp_path)
+    points = [make_poi(44.8436, -0.580),   # south bank, west
+              make_poi(44.8445, -0.580),   # north bank, facing it
+              make_poi(44.8436, -0.570),   # south bank, 800 m east
+              make_poi(44.900, -0.580)]    # off the graph
+
+    matrix = graph.distance_matrix(points)
+    straight = haversine_km(points[0].latitude, points[0].longitude,
+                            points[1].latitude, points[1].longitude)
+
+    # to the bridge on the last column and back
+    assert straight < 0.11 and 3.85 < matrix[0, 1] < 3.95
+    assert np.isclose(matrix[0, 1], graph.leg_km(points[0], points[1]))
+    assert 0.79 < matrix[0, 2] < 0.83
+    assert np.allclose(matrix, matrix.T) and not matrix.diagonal().any()
+    assert matrix[0, 3] == haversine_km(points[0].latitude,
+                                        points[0].longitude,
+                                        points[3].latitude,
+                                        points[3].longitude)
+
+
+def test_walking_graph_of_department(tmp_path):
+    get_walking_graph.cache_clear()
+    assert get_walking_graph("64") is None
+
+    write_river_graph(tmp_path / "dept-33")
+    with patch("navigo.walking.WALKING_GRAPH_DIR", str(tmp_path)):
+        graph = get_walking_graph("33")
+        assert len(graph) == 200 and get_walking_graph("40") is None
+        assert get_zone_walking_graph(33800) is graph
+
+    start, end = make_poi(44.8436, -0.580), make_poi(44.8445, -0.580)
+    # the graph of the trip, whatever the postal code of the points
+    start.city_code = 40000
+    assert walking.leg_km(start, end, graph) > 3.8
+    assert walking.leg_km(start, end) < 0.11
+    get_walking_graph.cache_clear()
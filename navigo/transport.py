@@ -0,0 +1,130 @@
+# record / replay HTTP transport used by navigo.external
+#
+# live:   requests are sent to the real APIs
+# record: requests are sent to the real APIs and responses stored on disk
+# replay: responses are served from disk, the network is never used
+
+import hashlib
+import json
+import logging
+import time
+import urllib.parse
+from pathlib import Path
+
+import requests
+
+from navigo.settings import EXTERNAL_API_MODE, EXTERNAL_API_FIXTURES_DIR, \
+    EXTERNAL_API_LATENCY_MS
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MODES = ('live', 'record', 'replay')
+# query parameters holding credentials, they are not part of the key of the
+# fixtures and are not stored
+CREDENTIAL_PARAMS = ('appid', 'api_key', 'apikey', 'key', 'token',
+                     'access_token', 'client_id', 'client_secret')
+
+
+def strip_credentials(url: str, params: dict = None) -> (str, dict):
+    """url and params of a request without their credentials"""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    kept = [(name, value) for name, value in query
+            if name.lower() not in CREDENTIAL_PARAMS]
+    # other urls are kept as is, so are the keys of their fixtures
+    if len(kept) != len(query):
+        url = urllib.parse.urlunsplit(
+            parts._replace(query=urllib.parse.urlencode(kept)))
+    if params is not None:
+        params = {name: value for name, value in params.items()
+                  if name.lower() not in CREDENTIAL_PARAMS}
+    return url, params
+
+
+class FixtureNotFound(requests.exceptions.ConnectionError):
+    """raised in replay mode when no response was recorded for a request,
+    it is a ConnectionError so callers handle it like a network failure"""
+    pass
+
+
+class ExternalTransport:
+    """
+    HTTP GET transport for the external APIs (villes-voisines, Vicopo,
+    OpenWeatherMap, Foursquare) with record / replay support.
+
+    Args:
+        mode: one of 'live', 'record' or 'replay'.
+        fixtures_dir: directory where responses are stored.
+        latency_ms: latency injected before returning each response.
+    """
+
+    def __init__(self, mode='live', fixtures_dir=EXTERNAL_API_FIXTURES_DIR,
+                 latency_ms=0):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(
+                f"unknown transport mode {mode}, expected one of "
+                f"{TRANSPORT_MODES}")
+        self.mode = mode
+        self.fixtures_dir = Path(fixtures_dir)
+        self.latency_ms = latency_ms
+
+    def fixture_path(self, url: str, params: dict = None) -> Path:
+        """path of the fixture of a request, credentials (headers and
+        CREDENTIAL_PARAMS of the query) are not part of the key, so that
+        fixtures replay with any key"""
+        url, params = strip_credentials(url, params)
+        params = sorted((params or {}).items())
+        key = json.dumps([url, params], default=str)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        host = urllib.parse.urlsplit(url).hostname or 'unknown'
+        return self.fixtures_dir / host / f"{digest}.json"
+
+    def get(self, url: str, params: dict = None, headers: dict = None,
+            timeout: float = None) -> requests.Response:
+        if self.mode == 'replay':
+            response = self._load(url, params)
+        else:
+            response = requests.get(url, params=params, headers=headers,
+                                    timeout=timeout)
+            if self.mode == 'record':
+                self._save(url, params, response)
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return response
+
+    def _save(self, url, params, response: requests.Response):
+        path = self.fixture_path(url, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        url, params = strip_credentials(url, params)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'url': url,
+                'params': params,
+                'status_code': response.status_code,
+                'content': response.content.decode('utf-8'),
+            }, f, ensure_ascii=False, indent=2)
+        logger.debug(f"recorded {url} into {path}")
+
+    def _load(self, url, params) -> requests.Response:
+        path = self.fixture_path(url, params)
+        if not path.exists():
+            url, params = strip_credentials(url, params)
+            raise FixtureNotFound(f"no recorded response for {url} "
+                                  f"(params={params}) in {path}")
+
+        with open(path, encoding='utf-8') as f:
+            fixture = json.load(f)
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = fixture['status_code']
+        response.encoding = 'utf-8'
+        response._content = fixture['content'].encode('utf-8')
+        return response
+
+
+transport = ExternalTransport(
+    mode=EXTERNAL_API_MODE,
+    fixtures_dir=EXTERNAL_API_FIXTURES_DIR,
+    latency_ms=EXTERNAL_API_LATENCY_MS)
@@ -0,0 +1,303 @@
+# local walking graph of a department, to measure the legs of itineraries
+# along the streets and paths instead of straight lines (eg across the
+# Garonne in Bordeaux), without any external routing service
+#
+# a graph is built from the walkable ways of an OpenStreetMap extract and
+# written with write_walking_graph into arrays memory-mapped on first use:
+#   <WALKING_GRAPH_DIR>/dept-<department>/
+#     latitudes.npy   float64  coordinates of the nodes
+#     longitudes.npy  float64
+#     indptr.npy      int64    (n + 1) offsets of the edges of each node (CSR)
+#     indices.npy     int32    node at the end of each edge
+#     lengths.npy     float32  length of each edge in metres
+# graphs are undirected: each way is stored in both directions
+#
+# legs are snapped to the nearest node of the graph, legs whose ends are
+# too far from the graph or which are too long keep their straight line
+
+import heapq
+import logging
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from navigo.communes import haversine_km
+from navigo.corridor import GridIndex, M_BY_DEGREE
+from navigo.settings import WALKING_GRAPH_DIR, WALKING_LEG_CACHE_SIZE, \
+    WALKING_MAX_LEG, WALKING_SNAP_DISTANCE
+from navigo.snapshot import get_department
+
+logger = logging.getLogger(__name__)
+
+# sources of a many-to-many search run together (a row of distances to all
+# the nodes of the searched area each)
+SOURCES_BY_SEARCH = 32
+
+
+def write_walking_graph(output_dir, latitudes, longitudes, edges):
+    """
+    write the arrays of a walking graph from the coordinates of its nodes
+    and its edges ((node, node, length in metres) of each way segment)
+    """
+    edges = np.asarray(edges, dtype=float).reshape(-1, 3)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    starts = np.concatenate([edges[:, 0], edges[:, 1]]).astype(np.int64)
+    ends = np.concatenate([edges[:, 1], edges[:, 0]]).astype(np.int64)
+    lengths = np.concatenate([edges[:, 2], edges[:, 2]])
+    # shortest of the parallel edges, the searches need a single one
+    order = np.lexsort((lengths, ends, starts))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (np.diff(starts[order]) != 0) | (np.diff(ends[order]) != 0)
+    starts, ends, lengths = starts[order][first], \
+        ends[order][first].astype(np.int32), \
+        np.maximum(lengths[order][first], 0.01).astype(np.float32)
+    indptr = np.zeros(len(latitudes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(starts, minlength=len(latitudes)))
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    np.save(output_dir / 'latitudes.npy',
+            np.asarray(latitudes, dtype=np.float64))
+    np.save(output_dir / 'longitudes.npy',
+            np.asarray(longitudes, dtype=np.float64))
+    np.save(output_dir / 'indptr.npy', indptr)
+    np.save(output_dir / 'indices.npy', ends)
+    np.save(output_dir / 'lengths.npy', lengths)
+
+
+class WalkingGraph:
+    """
+    Walking graph of a department memory-mapped from its arrays, with a
+    cache of the lengths of the legs already searched.
+
+    Args:
+        data_dir: directory holding the arrays written by write_walking_graph.
+        snap_distance: max distance in metres from a point to its node.
+        max_leg: legs longer than this (in metres) are not searched.
+        cache_size: number of legs kept in the cache.
+    """
+
+    def __init__(self, data_dir, snap_distance: float = WALKING_SNAP_DISTANCE,
+                 max_leg: float = WALKING_MAX_LEG,
+                 cache_size: int = WALKING_LEG_CACHE_SIZE):
+        data_dir = Path(data_dir)
+        self.latitudes = np.load(data_dir / 'latitudes.npy', mmap_mode='r')
+        self.longitudes = np.load(data_dir / 'longitudes.npy', mmap_mode='r')
+        self.indptr = np.load(data_dir / 'indptr.npy', mmap_mode='r')
+        self.indices = np.load(data_dir / 'indices.npy', mmap_mode='r')
+        self.lengths = np.load(data_dir / 'lengths.npy', mmap_mode='r')
+        self.snap_distance = snap_distance
+        self.max_leg = max_leg
+        self.cache_size = cache_size
+        self._grid = GridIndex(self.latitudes, self.longitudes,
+                               snap_distance / M_BY_DEGREE)
+        # (node, node) => length in metres (inf if longer than max_leg)
+        self._legs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def nearest_node(self, latitude: float, longitude: float) -> tuple:
+        """nearest node of a location and its distance in metres, (None,
+        None) if no node is within snap_distance"""
+        d_lat = self.snap_distance / M_BY_DEGREE
+        d_lon = d_lat / max(math.cos(math.radians(latitude)), 0.01)
+        candidates = self._grid.query(latitude - d_lat, longitude - d_lon,
+                                      latitude + d_lat, longitude + d_lon)
+        if not len(candidates):
+            return None, None
+        distances = haversine_km(latitude, longitude,
+                                 self.latitudes[candidates],
+                                 self.longitudes[candidates]) * 1000
+        best = int(np.argmin(distances))
+        if distances[best] > self.snap_distance:
+            return None, None
+        return int(candidates[best]), float(distances[best])
+
+    def _cached(self, key):
+        with self._lock:
+            length = self._legs.get(key)
+            if length is not None:
+                self._legs.move_to_end(key)
+            return length
+
+    def _cache(self, key, length: float):
+        with self._lock:
+            self._legs[key] = length
+            self._legs.move_to_end(key)
+            while len(self._legs) > self.cache_size:
+                self._legs.popitem(last=False)
+
+    def leg_m(self, source: int, target: int) -> float:
+        """
+        length in metres of the shortest path between 2 nodes, inf if
+        longer than max_leg: bidirectional Dijkstra, from both ends until
+        the searches meet
+        """
+        if source == target:
+            return 0.0
+        key = (min(source, target), max(source, target))
+        length = self._cached(key)
+        if length is not None:
+            return length
+
+        distances = ({source: 0.0}, {target: 0.0})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        settled = (set(), set())
+        best = math.inf
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= min(best, self.max_leg):
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            distance, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            first, last = self.indptr[node], self.indptr[node + 1]
+            for next_node, length in zip(self.indices[first:last].tolist(),
+                                         self.lengths[first:last].tolist()):
+                next_distance = distance + length
+                if next_distance < distances[side].get(next_node, math.inf):
+                    distances[side][next_node] = next_distance
+                    heapq.heappush(heaps[side], (next_distance, next_node))
+                    other = distances[1 - side].get(next_node)
+                    if other is not None:
+                        best = min(best, next_distance + other)
+        length = best if best <= self.max_leg else math.inf
+        self._cache(key, length)
+        return length
+
+    def legs_m(self, nodes: list) -> np.ndarray:
+        """
+        lengths in metres of the shortest paths between nodes (inf if longer
+        than max_leg): Dijkstra from the nodes whose legs are not cached,
+        limited to max_leg, on the part of the graph around the nodes
+        """
+        nodes = list(dict.fromkeys(nodes))
+        legs = np.full((len(nodes), len(nodes)), math.inf)
+        np.fill_diagonal(legs, 0)
+        missing = []
+        for i, source in enumerate(nodes):
+            for j in range(i + 1, len(nodes)):
+                length = self._cached((min(source, nodes[j]),
+                                       max(source, nodes[j])))
+                if length is None:
+                    missing.append(i)
+                    break
+                legs[i, j] = legs[j, i] = length
+        if not missing:
+            return legs
+
+        # nodes within max_leg of the bounding box of the searched nodes
+        lats, lons = self.latitudes[nodes], self.longitudes[nodes]
+        d_lat = self.max_leg / M_BY_DEGREE
+        d_lon = d_lat / max(math.cos(math.radians(float(lats.mean()))), 0.01)
+        area = np.sort(self._grid.query(lats.min() - d_lat, lons.min() - d_lon,
+                                        lats.max() + d_lat, lons.max() + d_lon))
+        local = np.full(len(self), -1, dtype=np.int64)
+        local[area] = np.arange(len(area))
+        counts = np.diff(self.indptr)[area]
+        starts = np.repeat(area, counts)
+        edges = np.repeat(self.indptr[area] - np.cumsum(counts) + counts,
+                          counts) + np.arange(counts.sum())
+        ends = local[self.indices[edges]]
+        inside = ends >= 0
+        graph = csr_matrix((self.lengths[edges][inside],
+                            (local[starts][inside], ends[inside])),
+                           shape=(len(area), len(area)))
+
+        targets = local[nodes]
+        for first in range(0, len(missing), SOURCES_BY_SEARCH):
+            sources = missing[first:first + SOURCES_BY_SEARCH]
+            found = dijkstra(graph, indices=targets[sources],
+                             limit=self.max_leg)[:, targets]
+            for i, row in zip(sources, found):
+                legs[i, :] = legs[:, i] = row
+                for j, length in enumerate(row.tolist()):
+                    if j != i:
+                        self._cache((min(nodes[i], nodes[j]),
+                                     max(nodes[i], nodes[j])), length)
+        return legs
+
+    def distance_matrix(self, points: list) -> np.ndarray:
+        """
+        walking distances in km between all points, their straight line
+        when they are not on the graph or too far from each other
+        """
+        lats = np.array([float(p.latitude) for p in points])
+        lons = np.array([float(p.longitude) for p in points])
+        matrix = haversine_km(lats[:, None], lons[:, None],
+                              lats[None, :], lons[None, :])
+        snapped = [self.nearest_node(lat, lon) for lat, lon in zip(lats, lons)]
+        on_graph = [i for i, (node, _) in enumerate(snapped)
+                    if node is not None]
+        if len(on_graph) < 2:
+            return matrix
+        nodes = list(dict.fromkeys(snapped[i][0] for i in on_graph))
+        legs = self.legs_m(nodes)
+        position = {node: k for k, node in enumerate(nodes)}
+        rows = np.array([position[snapped[i][0]] for i in on_graph])
+        offsets = np.array([snapped[i][1] for i in on_graph])
+        walked = (offsets[:, None] + legs[np.ix_(rows, rows)] +
+                  offsets[None, :]) / 1000
+        np.fill_diagonal(walked, 0)
+        sub = matrix[np.ix_(on_graph, on_graph)]
+        matrix[np.ix_(on_graph, on_graph)] = np.where(
+            np.isfinite(walked), np.maximum(walked, sub), sub)
+        return matrix
+
+    def leg_km(self, start, end) -> float:
+        """walking distance in km between 2 points, their straight line
+        when they are not on the graph or too far from each other"""
+        straight = float(haversine_km(
+            float(start.latitude), float(start.longitude),
+            float(end.latitude), float(end.longitude)))
+        start_node, start_offset = self.nearest_node(
+            float(start.latitude), float(start.longitude))
+        end_node, end_offset = self.nearest_node(
+            float(end.latitude), float(end.longitude))
+        if start_node is None or end_node is None:
+            return straight
+        length = self.leg_m(start_node, end_node)
+        if not math.isfinite(length):
+            return straight
+        return max((start_offset + length + end_offset) / 1000, straight)
+
+
+@lru_cache(maxsize=None)
+def get_walking_graph(department: str) -> WalkingGraph | None:
+    """the walking graph of a department, None when WALKING_GRAPH_DIR is not
+    set or has no graph of the department"""
+    if not WALKING_GRAPH_DIR:
+        return None
+    data_dir = Path(WALKING_GRAPH_DIR, f"dept-{department}")
+    if not data_dir.exists():
+        logger.warning(f"no walking graph for department {department}")
+        return None
+    graph = WalkingGraph(data_dir)
+    logger.info(f"walking graph of department {department}: "
+                f"{len(graph)} nodes")
+    return graph
+
+
+def get_zone_walking_graph(zone) -> WalkingGraph | None:
+    """the walking graph of the department of a trip zone (postal code),
+    the same for planning the trip and for measuring its legs"""
+    return get_walking_graph(get_department(zone))
+
+
+def leg_km(start, end, graph: WalkingGraph = None) -> float:
+    """distance in km of a leg, walked on the graph when there is one, else
+    in straight line"""
+    if graph is None:
+        return float(haversine_km(
+            float(start.latitude), float(start.longitude),
+            float(end.latitude), float(end.longitude)))
+    return graph.leg_km(start, end)
@@ -14,6 +14,7 @@ data_files = ['requirements.txt']
 # data_files.extend(glob.glob('raft_core/py.typed', recursive=True))
 data_files.extend(glob.glob('navigo/app/static/**/*.*', recursive=True))
 data_files.extend(glob.glob('navigo/app/templates/*.*', recursive=True))
+data_files.extend(glob.glob('navigo/data/**/*.*', recursive=True))
 
 
 with open("README.md", "r", encoding="utf-8") as readme_file: